@@ -0,0 +1,110 @@
+'''
+Micro-benchmarks for the HTML <-> Markdown conversions (h2m and m2h).
+
+For every document in the corpus this reports the median latency, the
+throughput and the peak memory of h2m, m2h and a full round trip. Results
+are saved and compared against a baseline; the script exits with a non-zero
+status if any measurement regresses by more than the threshold.
+
+    python -m benchmarks.bench_conversion --threshold 0.25
+'''
+import sys
+import argparse
+import statistics
+import tracemalloc
+
+from benchmarks.corpus import build_corpus
+from benchmarks.common import (Timer, save_results, load_previous_results,
+                               compare_results)
+
+DEFAULT_THRESHOLD = 0.25
+
+
+def measure(convert, fragments, repeat):
+    '''
+    Returns:
+        (float, int): The median seconds to convert every fragment, and the
+            peak bytes allocated while doing it once.
+    '''
+    timings = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            for fragment in fragments:
+                convert(fragment)
+        timings.append(timer.elapsed)
+    tracemalloc.start()
+    for fragment in fragments:
+        convert(fragment)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def run(repeat):
+    from waltz.html_markdown_utilities import h2m, m2h
+    results = {}
+    print('{:<18} {:<10} {:>11} {:>11} {:>11}'.format(
+        'document', 'direction', 'latency ms', 'KB/s', 'peak KB'))
+    for name, origin, fragments in build_corpus():
+        if origin == 'html':
+            html, markdown = fragments, [h2m(f) for f in fragments]
+
+            def round_trip(text):
+                return m2h(h2m(text))
+            round_trip_input = html
+        else:
+            markdown, html = fragments, [m2h(f) for f in fragments]
+
+            def round_trip(text):
+                return h2m(m2h(text))
+            round_trip_input = markdown
+        directions = [('h2m', h2m, html), ('m2h', m2h, markdown),
+                      ('roundtrip', round_trip, round_trip_input)]
+        for direction, convert, inputs in directions:
+            size = sum(len(f.encode('utf-8')) for f in inputs)
+            latency, peak = measure(convert, inputs, repeat)
+            key = '{}/{}'.format(name, direction)
+            results[key+'/latency'] = latency
+            results[key+'/peak_memory'] = peak
+            results[key+'/throughput'] = size / latency
+            print('{:<18} {:<10} {:>11.2f} {:>11.1f} {:>11.1f}'.format(
+                name, direction, latency*1000, size/latency/1024, peak/1024))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark h2m/m2h conversions')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to time each conversion')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed fractional slowdown before failing (e.g., 0.25 = 25%%)')
+    parser.add_argument('--baseline', default=None,
+                        help='Result file to compare against (defaults to the latest saved run)')
+    parser.add_argument('--no-save', action='store_true', default=False,
+                        help='Do not save the results for later comparison')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.baseline:
+        import json
+        with open(args.baseline) as baseline_file:
+            baseline_path, baseline = args.baseline, json.load(baseline_file)
+    else:
+        baseline_path, baseline = load_previous_results('conversion')
+    if not args.no_save:
+        print("Saved results to", save_results('conversion', results))
+    if baseline:
+        print("Compared with", baseline_path)
+        # Throughput goes up when things get faster, so only gate on the
+        # measurements where bigger is worse.
+        gated = {k: v for k, v in results.items()
+                 if not k.endswith('/throughput')}
+        regressions = compare_results(baseline, gated, args.threshold)
+        if regressions:
+            print(len(regressions), "measurements regressed by more than",
+                  "{:.0%}".format(args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+Benchmark for the Waltz daemon, run against FakeCanvas.
+
+Pulls a course with a question bank, then pushes one quiz at a time with
+separate CLI commands, first each in a fresh process and then each
+forwarded to a running daemon (which keeps the settings, templates and
+question bank loaded between commands), and reports the time per command
+and how much of it the daemon spent on the job (the rest is starting the
+CLI process).
+
+    python -m benchmarks.bench_daemon --scale 20 --questions 5 --commands 10
+'''
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.bench_sync import populate, COURSE_ID, COURSE_NAME
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def waltz_command(arguments):
+    subprocess.run([sys.executable, '-m', 'waltz']+arguments, cwd=REPOSITORY,
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def start_daemon(settings_path, port):
+    import requests
+    daemon = subprocess.Popen([sys.executable, '-m', 'waltz', 'daemon', '-q',
+                               '-s', settings_path, '--port', str(port)],
+                              cwd=REPOSITORY, stdout=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}/'.format(port)
+    for attempt in range(100):
+        try:
+            requests.get(url+'status')
+            return daemon, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    daemon.kill()
+    raise RuntimeError("The daemon did not start")
+
+
+def run(scale, questions, commands, latency, port):
+    import requests
+    from waltz.resources import Course
+    from waltz.sync import pull_all_resources
+    results = {}
+    server = FakeCanvas(latency=latency)
+    populate(server, scale, questions)
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+        settings_path = os.path.join(os.path.dirname(os.path.dirname(destination)),
+                                     'settings', 'settings.yaml')
+        course = Course(destination, COURSE_NAME)
+        with quietly():
+            pull_all_resources('quizzes/*', 'raw', destination, course, True)
+        course.index.close()
+        base = ['push', '-x', '-q', '-s', settings_path, '-d', destination]
+        # The last quizzes, since titles like "Quiz 1" also match "Quiz 10"
+        ids = [['-i', 'quizzes/?Quiz {}'.format(index)]
+               for index in range(scale-commands, scale)]
+        with Timer() as timer:
+            for id in ids:
+                waltz_command(base+id)
+        results['cold_seconds'] = timer.elapsed / commands
+        daemon, url = start_daemon(settings_path, port)
+        try:
+            # The first command warms the daemon up
+            waltz_command(base+ids[0]+['--daemon', url])
+            with Timer() as timer:
+                for id in ids:
+                    waltz_command(base+id+['--daemon', url])
+            results['daemon_seconds'] = timer.elapsed / commands
+            jobs = requests.get(url+'jobs').json()[1:]
+            results['daemon_job_seconds'] = sum(job['finished']-job['started']
+                                                for job in jobs) / commands
+        finally:
+            requests.post(url+'shutdown')
+            daemon.wait()
+    print('{:<8} {:>10} {:>18}'.format('mode', 'commands', 'seconds/command'))
+    for mode in ('cold', 'daemon'):
+        print('{:<8} {:>10} {:>18.3f}'.format(mode, commands,
+                                              results[mode+'_seconds']))
+    print("Of each daemon command, {:.3f}s was spent on the job itself".format(
+        results['daemon_job_seconds']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Waltz daemon')
+    parser.add_argument('--scale', type=int, default=20,
+                        help='How many pages, assignments and quizzes the course has')
+    parser.add_argument('--questions', type=int, default=5,
+                        help='How many questions each quiz has')
+    parser.add_argument('--commands', type=int, default=10,
+                        help='How many push commands to run')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--port', type=int, default=8799,
+                        help='The port for the daemon')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.scale, args.questions, min(args.commands, args.scale//2),
+                  args.latency, args.port)
+    if not args.no_save:
+        print("Saved results to", save_results('daemon', results))
+
+
+if __name__ == '__main__':
+    main()
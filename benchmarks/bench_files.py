@@ -0,0 +1,116 @@
+'''
+Benchmark for pushing course files, run against FakeCanvas.
+
+Pushes a folder of files one at a time and then several at a time, and
+pushes it again unchanged (which should upload nothing). It then uploads a
+single large file from a separate process and reports the most memory
+that process allocated along the way, which should stay far below the
+file's size since files are streamed from memory maps.
+
+    python -m benchmarks.bench_files --files 40 --size 256 --latency 0.02 --jobs 1 4 8
+'''
+import os
+import sys
+import shutil
+import argparse
+import subprocess
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+COURSE_ID = 1
+COURSE_NAME = 'bench'
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a separate process, so that the fake server's copy of the upload
+# is not counted
+UPLOAD_SCRIPT = '''
+import sys, tracemalloc
+from waltz.canvas_tools import load_settings
+from waltz.resources import Course
+from waltz.files import push_files
+load_settings(sys.argv[1])
+course = Course(sys.argv[2], sys.argv[3])
+tracemalloc.start()
+push_files(course)
+current, peak = tracemalloc.get_traced_memory()
+course.index.close()
+print(peak)
+'''
+
+
+def write_files(directory, count, size):
+    os.makedirs(directory, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(directory, 'data {}.bin'.format(index)), 'wb') as out:
+            out.write(os.urandom(size))
+
+
+def run(files, size, large, latency, jobs_list):
+    from waltz.resources import Course
+    from waltz.files import push_files
+    server = FakeCanvas(latency=latency)
+    server.add_course(COURSE_ID, COURSE_NAME)
+    results = {}
+    print('{:<24} {:>8} {:>10} {:>10}'.format('push', 'uploads', 'requests', 'seconds'))
+
+    def report(key, label, uploaded, before, timer):
+        results[key+'_requests'] = server.request_count - before
+        results[key+'_seconds'] = timer.elapsed
+        print('{:<24} {:>8} {:>10} {:>10.3f}'.format(label, uploaded,
+                                                     results[key+'_requests'],
+                                                     timer.elapsed))
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+        write_files(os.path.join(destination, 'files', 'data'), files, size*1024)
+        for jobs in jobs_list:
+            # Every push starts from an empty Canvas course
+            server.courses[COURSE_ID]['files'].clear()
+            shutil.rmtree(os.path.join(destination, '_cache'), ignore_errors=True)
+            course = Course(destination, COURSE_NAME)
+            before = server.request_count
+            with quietly(), Timer() as timer:
+                uploaded = push_files(course, jobs=jobs)
+            report('push_{}'.format(jobs), 'push ({} at a time)'.format(jobs),
+                   uploaded, before, timer)
+        before = server.request_count
+        with quietly(), Timer() as timer:
+            uploaded = push_files(course, jobs=jobs_list[-1])
+        report('unchanged', 'push unchanged', uploaded, before, timer)
+        course.index.close()
+        # A single large file, uploaded from a separate process
+        shutil.rmtree(os.path.join(destination, 'files'))
+        write_files(os.path.join(destination, 'files'), 1, large*1024*1024)
+        settings_path = os.path.join(os.path.dirname(os.path.dirname(destination)),
+                                     'settings', 'settings.yaml')
+        output = subprocess.run([sys.executable, '-c', UPLOAD_SCRIPT, settings_path,
+                                 destination, COURSE_NAME], cwd=REPOSITORY,
+                                check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        results['large_upload_memory_mb'] = int(output.split()[-1]) / 1024 / 1024
+    print("Uploading a {} MB file allocated at most {:.1f} MB".format(
+        large, results['large_upload_memory_mb']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pushing course files')
+    parser.add_argument('--files', type=int, default=40,
+                        help='How many files to push')
+    parser.add_argument('--size', type=int, default=256,
+                        help='The size of each file, in kilobytes')
+    parser.add_argument('--large', type=int, default=64,
+                        help='The size of the large file, in megabytes')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8],
+                        help='The numbers of files to upload at once')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.files, args.size, args.large, args.latency, args.jobs)
+    if not args.no_save:
+        print("Saved results to", save_results('files', results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''
+Benchmark and check for the GraphQL fetch backend, run against FakeCanvas
+and its GraphQL stub.
+
+Pulls every assignment and looks up a batch of assignments by id with each
+backend, reports the requests and time each takes, and checks that the
+GraphQL backend (and its fallback to REST, when the endpoint is missing)
+writes exactly the same files as REST.
+
+    python -m benchmarks.bench_graphql --scale 300 --lookups 120 --latency 0.02
+'''
+import os
+import glob
+import hashlib
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.bench_sync import populate, COURSE_ID, COURSE_NAME
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+
+def assignment_files(destination):
+    files = {}
+    for path in sorted(glob.glob(os.path.join(destination, 'assignments', '*.yaml'))):
+        with open(path, 'rb') as assignment_file:
+            files[os.path.basename(path)] = hashlib.sha1(assignment_file.read()).hexdigest()
+    return files
+
+
+def run_backend(backend, scale, lookups, latency, graphql=True):
+    import waltz.canvas_tools
+    from waltz.resources import Course, ResourceID
+    from waltz.sync import pull_all_resources
+    server = FakeCanvas(latency=latency, graphql=graphql)
+    populate(server, scale, 1)
+    ids = list(server.courses[COURSE_ID]['assignments'])[:lookups]
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+        waltz.canvas_tools.defaults['fetch-backend'] = backend
+        course = Course(destination, COURSE_NAME)
+        row = {}
+        before = server.request_count
+        with quietly(), Timer() as timer:
+            pull_all_resources('assignments/*', 'raw', destination, course, True)
+        row['pull'] = server.request_count - before, timer.elapsed
+        before = server.request_count
+        with quietly(), Timer() as timer:
+            resolved = ResourceID.resolve_all(
+                course, ['assignments/:{}'.format(id) for id in ids])
+        row['lookup'] = server.request_count - before, timer.elapsed
+        titles = [resource_id.canvas_title for resource_id in resolved]
+        files = assignment_files(destination)
+        course.index.close()
+    return row, files, titles
+
+
+def run(scale, lookups, latency):
+    results = {}
+    print('{:<18} {:>14} {:>10} {:>16} {:>10}'.format(
+        'backend', 'pull requests', 'pull s', 'lookup requests', 'lookup s'))
+    expected = None
+    for key, label, backend, graphql in [
+            ('rest', 'rest', 'rest', True),
+            ('graphql', 'graphql', 'graphql', True),
+            ('graphql_missing', 'graphql (missing)', 'graphql', False)]:
+        row, files, titles = run_backend(backend, scale, lookups, latency, graphql)
+        if expected is None:
+            expected = files, titles
+        elif (files, titles) != expected:
+            print("  WARNING: the", label, "backend fetched different data")
+        results[key+'/pull_requests'], results[key+'/pull_seconds'] = row['pull']
+        results[key+'/lookup_requests'], results[key+'/lookup_seconds'] = row['lookup']
+        print('{:<18} {:>14} {:>10.3f} {:>16} {:>10.3f}'.format(
+            label, row['pull'][0], row['pull'][1], row['lookup'][0], row['lookup'][1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GraphQL fetch backend')
+    parser.add_argument('--scale', type=int, default=300,
+                        help='How many assignments (and quizzes) the course has')
+    parser.add_argument('--lookups', type=int, default=120,
+                        help='How many assignments to look up by id')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.scale, args.lookups, args.latency)
+    if not args.no_save:
+        print("Saved results to", save_results('graphql', results))
+
+
+if __name__ == '__main__':
+    main()
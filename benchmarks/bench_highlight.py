@@ -0,0 +1,88 @@
+'''
+Benchmark for the persistent syntax-highlight cache.
+
+Converts the Markdown corpus with m2h three ways: without a cache, with an
+empty cache (every block is highlighted and stored), and with the cache left
+by the previous pass (as on the next run of Waltz). Checks that the cached
+output is identical to the uncached output.
+
+    python -m benchmarks.bench_highlight --repeat 5
+'''
+import os
+import argparse
+import tempfile
+import statistics
+
+from benchmarks.corpus import build_corpus
+from benchmarks.common import Timer, save_results
+
+
+def convert_all(documents, course):
+    from waltz.html_markdown_utilities import m2h
+    return [[m2h(fragment, course) for fragment in fragments]
+            for fragments in documents]
+
+
+def timed(documents, course, cache_path):
+    '''
+    Returns:
+        (float, list): The seconds taken to convert every document through
+            the cache at `cache_path` (or none), and the outputs.
+    '''
+    from waltz.highlight_cache import HighlightCache
+    if cache_path is not None:
+        course.highlight_cache = HighlightCache(cache_path)
+    with Timer() as timer:
+        outputs = convert_all(documents, course)
+    course.stop_caching_highlighting()
+    return timer.elapsed, outputs
+
+
+def run(repeat):
+    from waltz.resources import Course
+    from waltz.html_markdown_utilities import h2m
+    documents = []
+    for _, origin, fragments in build_corpus():
+        if origin == 'html':
+            fragments = [h2m(fragment) for fragment in fragments]
+        documents.append(fragments)
+    timings = {'uncached': [], 'cold': [], 'warm': []}
+    with tempfile.TemporaryDirectory() as directory:
+        course = Course(directory, 'bench')
+        for attempt in range(repeat):
+            path = os.path.join(directory, 'highlight{}.sqlite'.format(attempt))
+            elapsed, expected = timed(documents, course, None)
+            timings['uncached'].append(elapsed)
+            elapsed, outputs = timed(documents, course, path)
+            timings['cold'].append(elapsed)
+            if outputs != expected:
+                print("WARNING: the cold cache changed the output")
+            elapsed, outputs = timed(documents, course, path)
+            timings['warm'].append(elapsed)
+            if outputs != expected:
+                print("WARNING: the warm cache changed the output")
+        course.index.close()
+    results = {}
+    baseline = statistics.median(timings['uncached'])
+    print('{:<10} {:>10} {:>9}'.format('cache', 'seconds', 'speedup'))
+    for label, values in timings.items():
+        elapsed = statistics.median(values)
+        results[label] = elapsed
+        print('{:<10} {:>10.3f} {:>8.1f}x'.format(label, elapsed, baseline/elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the highlight cache')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to convert the corpus')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.repeat)
+    if not args.no_save:
+        print("Saved results to", save_results('highlight', results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Benchmark for paginated Canvas listings, run against FakeCanvas.
+
+Compares collecting a whole listing with `get(..., all=True)` before
+processing it, against streaming it with `iter_all`, which processes each
+page while the next one downloads. Reports the elapsed time and the peak
+memory allocated while walking the listing.
+
+    python -m benchmarks.bench_listing --items 5000 --latency 0.02
+'''
+import time
+import argparse
+import tracemalloc
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.common import waltz_sandbox, Timer, save_results
+
+COURSE_ID = 1
+COURSE_NAME = 'bench'
+
+
+def populate(server, items, description_size):
+    server.add_course(COURSE_ID, COURSE_NAME)
+    description = '<p>{}</p>'.format('x' * description_size)
+    for index in range(items):
+        server.add_assignment(COURSE_ID, 'Assignment {}'.format(index),
+                              description)
+
+
+def walk(items, work):
+    count = 0
+    for item in items:
+        if work:
+            time.sleep(work)
+        count += len(item['description'])
+    return count
+
+
+def measure(label, listing, work):
+    tracemalloc.start()
+    with Timer() as timer:
+        walk(listing(), work)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<10} {:>9.3f}s {:>10.0f} KB peak'.format(label, timer.elapsed,
+                                                      peak / 1024))
+    return timer.elapsed, peak
+
+
+def run(items, latency, work, description_size):
+    from waltz.canvas_tools import get, iter_all
+    server = FakeCanvas(latency=latency, per_page=100)
+    populate(server, items, description_size)
+    results = {}
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID):
+        listings = [
+            ('list', lambda: get('assignments', all=True, course=COURSE_NAME)),
+            ('stream', lambda: iter_all('assignments', course=COURSE_NAME)),
+        ]
+        for label, listing in listings:
+            elapsed, peak = measure(label, listing, work)
+            results[label+'/seconds'] = elapsed
+            results[label+'/peak_bytes'] = peak
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark paginated listings')
+    parser.add_argument('--items', type=int, default=5000,
+                        help='How many assignments are listed')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--work', type=float, default=0.0002,
+                        help='Seconds of simulated processing per item')
+    parser.add_argument('--description-size', type=int, default=2000,
+                        help='Characters in each assignment description')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.items, args.latency, args.work, args.description_size)
+    if not args.no_save:
+        print("Saved results to", save_results('listing', results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+'''
+Memory benchmark for resource objects.
+
+Builds many quiz questions (and a few thousand quizzes, pages and
+assignments) from realistic Canvas JSON, and reports the bytes retained per
+object by the slotted resource classes, next to a copy of the previous
+kwargs-to-attributes representation, where every Canvas field landed in a
+per-instance __dict__.
+
+    python -m benchmarks.bench_memory --questions 20000
+'''
+import gc
+import argparse
+import tracemalloc
+
+from benchmarks.common import save_results
+
+# Fields Canvas sends that Waltz never reads
+UNUSED_FIELDS = {
+    'locked_for_user': False, 'lock_explanation': '', 'permissions':
+    {'read': True, 'update': True, 'delete': True},
+    'created_at': '2020-01-01T12:00:00Z', 'has_submitted_submissions': False,
+    'workflow_state': 'published', 'migration_id': None,
+}
+
+
+class LegacyResource:
+    '''How resources stored their fields before they declared __slots__.'''
+    def __init__(self, **kwargs):
+        for key, value in list(kwargs.items()):
+            setattr(self, key, value)
+            del kwargs[key]
+        self.unmatched_parameters = kwargs
+
+
+def question_json(index):
+    data = {
+        'id': 1000+index, 'quiz_id': 7, 'quiz_group_id': None,
+        'position': index, 'question_name': 'Question {}'.format(index),
+        'question_type': 'multiple_choice_question',
+        'question_text': '<p>What is {} + {}?</p>'.format(index, index),
+        'points_possible': 1, 'correct_comments': '',
+        'incorrect_comments': '', 'neutral_comments': '',
+        'correct_comments_html': '', 'incorrect_comments_html': '',
+        'neutral_comments_html': '', 'variables': None, 'formulas': None,
+        'matching_answer_incorrect_matches': None, 'matches': None,
+        'assessment_question_id': 5000+index,
+        'answers': [{'id': i, 'html': '<p>{}</p>'.format(i), 'weight': 100 if i == 0 else 0,
+                     'comments_html': ''} for i in range(4)],
+    }
+    data.update(UNUSED_FIELDS)
+    return data
+
+
+def quiz_json(index):
+    data = {
+        'id': index, 'title': 'Quiz {}'.format(index), 'description': '<p>Quiz</p>',
+        'html_url': 'https://canvas.example.edu/courses/1/quizzes/{}'.format(index),
+        'published': True, 'quiz_type': 'assignment', 'points_possible': 10,
+        'allowed_attempts': 1, 'scoring_policy': 'keep_highest',
+        'due_at': None, 'unlock_at': None, 'lock_at': None,
+        'one_question_at_a_time': False, 'shuffle_answers': False,
+        'time_limit': None, 'cant_go_back': False,
+        'show_correct_answers': True, 'show_correct_answers_last_attempt': False,
+        'show_correct_answers_at': None, 'hide_correct_answers_at': None,
+        'hide_results': None, 'one_time_results': False, 'access_code': None,
+        'ip_filter': None, 'assignment_id': 10000+index,
+        'updated_at': '2020-01-01T12:00:00Z', 'mobile_url': '', 'preview_url': '',
+        'question_count': 10, 'speedgrader_url': '', 'quiz_extensions_url': '',
+        'anonymous_submissions': False, 'question_types': [],
+        'require_lockdown_browser': False,
+    }
+    data.update(UNUSED_FIELDS)
+    return data
+
+
+def page_json(index):
+    data = {'title': 'Page {}'.format(index), 'url': 'page-{}'.format(index),
+            'body': '<p>Page</p>', 'published': True, 'page_id': index,
+            'html_url': 'https://canvas.example.edu/courses/1/pages/page-{}'.format(index),
+            'updated_at': '2020-01-01T12:00:00Z', 'hide_from_students': False,
+            'editing_roles': 'teachers', 'front_page': False,
+            'last_edited_by': {'id': 1, 'display_name': 'Teacher'},
+            'todo_date': None, 'publish_at': None}
+    data.update(UNUSED_FIELDS)
+    return data
+
+
+def assignment_json(index):
+    data = {'id': index, 'name': 'Project {}'.format(index),
+            'description': '<p>Project</p>',
+            'html_url': 'https://canvas.example.edu/courses/1/assignments/{}'.format(index),
+            'published': True, 'points_possible': 10, 'grading_type': 'points',
+            'submission_types': ['online_upload'], 'allowed_extensions': ['py'],
+            'due_at': None, 'unlock_at': None, 'lock_at': None,
+            'anonymize_students': False, 'anonymous_grading': False,
+            'updated_at': '2020-01-01T12:00:00Z', 'course_id': 1,
+            'assignment_group_id': 3, 'position': index, 'peer_reviews': False,
+            'grade_group_students_individually': False, 'muted': False,
+            'needs_grading_count': 0, 'submissions_download_url': '',
+            'due_date_required': False, 'max_name_length': 255,
+            'omit_from_final_grade': False, 'moderated_grading': False,
+            'post_manually': False, 'rubric_settings': None}
+    data.update(UNUSED_FIELDS)
+    return data
+
+
+def retained(build, count):
+    '''
+    Returns:
+        float: The bytes still allocated per object once `count` objects are
+            built (the JSON they were built from is not counted).
+    '''
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [build(index) for index in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+
+def run(question_count, resource_count):
+    from waltz.resources import Page, Assignment
+    from waltz.quizzes import Quiz, MultipleChoiceQuestion, QuizGroup
+    course = object()
+    # The JSON is built up front, so only the objects themselves are measured
+    questions = [question_json(i) for i in range(question_count)]
+    quizzes = [quiz_json(i) for i in range(resource_count)]
+    pages = [page_json(i) for i in range(resource_count)]
+    assignments = [assignment_json(i) for i in range(resource_count)]
+    groups = [{'id': i, 'quiz_id': 7, 'name': 'Pool', 'pick_count': 1,
+               'question_points': 1, 'position': None,
+               'assessment_question_bank_id': None}
+              for i in range(resource_count)]
+    cases = [
+        ('question', question_count, questions, MultipleChoiceQuestion),
+        ('quiz', resource_count, quizzes, Quiz),
+        ('group', resource_count, groups, QuizGroup),
+        ('page', resource_count, pages, Page),
+        ('assignment', resource_count, assignments, Assignment),
+    ]
+    results = {}
+    print('{:<12} {:>8} {:>14} {:>14} {:>8}'.format(
+        'resource', 'count', 'legacy B/obj', 'slots B/obj', 'saved'))
+    for name, count, data, resource_type in cases:
+        legacy = retained(lambda i: LegacyResource(course=course, **data[i]), count)
+        slotted = retained(lambda i: resource_type(course=course, **data[i]), count)
+        saved = 1 - slotted / legacy
+        results[name+'/legacy'] = legacy
+        results[name+'/slots'] = slotted
+        print('{:<12} {:>8} {:>14.0f} {:>14.0f} {:>7.0%}'.format(
+            name, count, legacy, slotted, saved))
+    total_legacy = results['question/legacy'] * question_count
+    total_slots = results['question/slots'] * question_count
+    print("{} bank questions: {:.1f} MB -> {:.1f} MB".format(
+        question_count, total_legacy / 2**20, total_slots / 2**20))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark resource memory use')
+    parser.add_argument('--questions', type=int, default=20000,
+                        help='How many quiz questions to build')
+    parser.add_argument('--resources', type=int, default=2000,
+                        help='How many quizzes, pages and assignments to build')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.questions, args.resources)
+    if not args.no_save:
+        print("Saved results to", save_results('memory', results))
+
+
+if __name__ == '__main__':
+    main()
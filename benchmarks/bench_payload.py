@@ -0,0 +1,99 @@
+'''
+Benchmark for the size of pushed HTML in each highlight mode.
+
+Converts the Markdown corpus with m2h using inline styles and using class
+names, and reports the bytes that would be pushed to Canvas, the savings,
+and how long h2m takes to read each back on the next pull. The one-time
+stylesheet upload is reported alongside, since it pays for class names.
+
+    python -m benchmarks.bench_payload
+'''
+import argparse
+import tempfile
+
+from benchmarks.corpus import build_corpus
+from benchmarks.common import Timer, save_results
+
+
+def convert(documents, mode):
+    from waltz.resources import Course
+    from waltz.html_markdown_utilities import m2h
+    with tempfile.TemporaryDirectory() as directory:
+        course = Course(directory, 'bench')
+        course.highlight_settings['mode'] = mode
+        try:
+            return [[m2h(fragment, course) for fragment in fragments]
+                    for fragments in documents]
+        finally:
+            course.index.close()
+
+
+def read_back(html):
+    # The HTML2Text converter keeps state between documents, so each
+    # fragment is read with a fresh one to compare the modes fairly
+    import waltz.html_markdown_utilities as utilities
+    markdown = []
+    for fragment in html:
+        utilities.converters.html_to_markdown = None
+        markdown.append(utilities.h2m(fragment))
+    return markdown
+
+
+def size(fragments):
+    return sum(len(fragment.encode('utf-8')) for fragment in fragments)
+
+
+def run():
+    from waltz.html_markdown_utilities import h2m
+    from waltz.stylesheet import build_stylesheet
+    names, documents = [], []
+    for name, origin, fragments in build_corpus():
+        if origin == 'html':
+            fragments = [h2m(fragment) for fragment in fragments]
+        names.append(name)
+        documents.append(fragments)
+    outputs = {mode: convert(documents, mode) for mode in ('inline', 'classes')}
+    results = {}
+    print('{:<18} {:>12} {:>12} {:>7} {:>13} {:>13}'.format(
+        'document', 'inline KB', 'classes KB', 'saved',
+        'h2m inline ms', 'h2m class ms'))
+    for index, name in enumerate(names):
+        row = {}
+        for mode in outputs:
+            html = outputs[mode][index]
+            with Timer() as timer:
+                markdown = read_back(html)
+            row[mode] = size(html), timer.elapsed, markdown
+        if row['inline'][2] != row['classes'][2]:
+            print("  WARNING: h2m reads the modes back differently for", name)
+        inline, classes = row['inline'][0], row['classes'][0]
+        saved = 1 - classes / inline
+        results[name+'/inline_bytes'] = inline
+        results[name+'/classes_bytes'] = classes
+        results[name+'/inline_h2m'] = row['inline'][1]
+        results[name+'/classes_h2m'] = row['classes'][1]
+        print('{:<18} {:>12.1f} {:>12.1f} {:>6.0%} {:>13.1f} {:>13.1f}'.format(
+            name, inline/1024, classes/1024, saved,
+            row['inline'][1]*1000, row['classes'][1]*1000))
+    inline = sum(results[name+'/inline_bytes'] for name in names)
+    classes = sum(results[name+'/classes_bytes'] for name in names)
+    stylesheet = len(build_stylesheet().encode('utf-8'))
+    results['stylesheet_bytes'] = stylesheet
+    print("Total: {:.1f} KB -> {:.1f} KB ({:.0%} saved), plus a one-time "
+          "{:.1f} KB stylesheet".format(inline/1024, classes/1024,
+                                        1 - classes/inline, stylesheet/1024))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pushed payload sizes')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run()
+    if not args.no_save:
+        print("Saved results to", save_results('payload', results))
+
+
+if __name__ == '__main__':
+    main()
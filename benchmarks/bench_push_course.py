@@ -0,0 +1,81 @@
+'''
+Benchmark for pushing a whole course, run against FakeCanvas.
+
+Pulls a course, then times `push_course` with different limits on how many
+resources are pushed at once (1 pushes one resource at a time), and
+checks that every limit leaves Canvas in the same state.
+
+    python -m benchmarks.bench_push_course --scale 20 --latency 0.02 --jobs 1 4 8
+'''
+import json
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.bench_sync import populate, COURSE_ID, COURSE_NAME
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+
+def canvas_state(server):
+    '''Everything pushed to the course, without the ever-changing timestamps.'''
+    course = server.courses[COURSE_ID]
+    state = {}
+    for category in ('pages', 'assignments', 'quizzes'):
+        state[category] = sorted(
+            json.dumps({key: value for key, value in item.items()
+                        if key != 'updated_at'}, sort_keys=True, default=str)
+            for item in course[category].values())
+    return state
+
+
+def run(scale, questions, latency, jobs_list):
+    from waltz.resources import Course
+    from waltz.quizzes import QuizQuestion
+    from waltz.sync import pull_all_resources
+    from waltz.schedule import push_course
+    results = {}
+    expected = None
+    print('{:>5} {:>10} {:>9}'.format('jobs', 'seconds', 'speedup'))
+    for jobs in jobs_list:
+        QuizQuestion.CACHE.clear()
+        server = FakeCanvas(latency=latency)
+        populate(server, scale, questions)
+        with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+            course = Course(destination, COURSE_NAME)
+            with quietly():
+                for category in ('pages', 'assignments', 'quizzes'):
+                    pull_all_resources(category+'/*', 'raw', destination,
+                                       course, True)
+            with quietly(), Timer() as timer:
+                push_course(course, jobs)
+            state = canvas_state(server)
+            course.index.close()
+        if expected is None:
+            expected = state
+        elif state != expected:
+            print("  WARNING: Canvas was left different with", jobs, "jobs")
+        results['jobs_{}'.format(jobs)] = timer.elapsed
+        print('{:>5} {:>10.3f} {:>8.1f}x'.format(
+            jobs, timer.elapsed, results['jobs_{}'.format(jobs_list[0])]/timer.elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pushing a whole course')
+    parser.add_argument('--scale', type=int, default=20,
+                        help='How many pages, assignments and quizzes the course has')
+    parser.add_argument('--questions', type=int, default=5,
+                        help='How many questions each quiz has')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8],
+                        help='The push limits to compare')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.scale, args.questions, args.latency, args.jobs)
+    if not args.no_save:
+        print("Saved results to", save_results('push_course', results))
+
+
+if __name__ == '__main__':
+    main()
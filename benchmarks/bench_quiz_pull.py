@@ -0,0 +1,73 @@
+'''
+Benchmark for pulling every quiz of a course, run against FakeCanvas.
+
+Times `pull_all_quizzes` with different limits on how many quizzes are
+downloaded at once (1 is the old one-quiz-at-a-time behaviour), and checks
+that every limit writes the same files.
+
+    python -m benchmarks.bench_quiz_pull --quizzes 100 --latency 0.02 --jobs 1 4 8 16
+'''
+import os
+import glob
+import hashlib
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.bench_sync import populate, COURSE_ID, COURSE_NAME
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+
+def quiz_files(destination):
+    files = {}
+    for path in sorted(glob.glob(os.path.join(destination, 'quizzes', '*.yaml'))):
+        with open(path, 'rb') as quiz_file:
+            files[os.path.basename(path)] = hashlib.sha1(quiz_file.read()).hexdigest()
+    return files
+
+
+def run(quizzes, questions, latency, jobs_list):
+    from waltz.resources import Course
+    from waltz.quizzes import QuizQuestion
+    from waltz.sync import pull_all_quizzes
+    results = {}
+    expected = None
+    print('{:>5} {:>10} {:>9}'.format('jobs', 'seconds', 'speedup'))
+    for jobs in jobs_list:
+        QuizQuestion.CACHE.clear()
+        server = FakeCanvas(latency=latency)
+        populate(server, quizzes, questions)
+        with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+            course = Course(destination, COURSE_NAME)
+            with quietly(), Timer() as timer:
+                pull_all_quizzes(course, jobs)
+            files = quiz_files(destination)
+        if expected is None:
+            expected = files
+        elif files != expected:
+            print("  WARNING: different files were written with", jobs, "jobs")
+        results['jobs_{}'.format(jobs)] = timer.elapsed
+        print('{:>5} {:>10.3f} {:>8.1f}x'.format(
+            jobs, timer.elapsed, results['jobs_{}'.format(jobs_list[0])]/timer.elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pulling every quiz')
+    parser.add_argument('--quizzes', type=int, default=100,
+                        help='How many quizzes the course has')
+    parser.add_argument('--questions', type=int, default=5,
+                        help='How many questions each quiz has')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8, 16],
+                        help='The download limits to compare')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.quizzes, args.questions, args.latency, args.jobs)
+    if not args.no_save:
+        print("Saved results to", save_results('quiz_pull', results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+'''
+Benchmark for resolving many resource IDs, run against FakeCanvas.
+
+Resolves a "?title" ID for every page, assignment and quiz one at a time
+(a search per ID and a disk search per path) and then all together with
+`ResourceID.resolve_all` (a listing per category and a directory scan per
+category), and reports the requests and time each takes.
+
+    python -m benchmarks.bench_resolve --scale 50 --latency 0.02
+'''
+import os
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.bench_sync import populate, COURSE_ID, COURSE_NAME
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+
+def resource_ids(scale):
+    ids = []
+    for index in range(scale):
+        ids.append('pages/?Lesson {}'.format(index))
+        ids.append('assignments/?Project {}'.format(index))
+        ids.append('quizzes/?Quiz {}'.format(index))
+    return ids
+
+
+def resolve_each(course, raws):
+    from waltz.resources import ResourceID
+    resolved = []
+    for raw in raws:
+        resource_id = ResourceID(course, raw)
+        resource_id.path
+        resolved.append(resource_id)
+    return resolved
+
+
+def resolve_together(course, raws):
+    from waltz.resources import ResourceID
+    return ResourceID.resolve_all(course, raws)
+
+
+def run(scale, latency):
+    from waltz.resources import Course
+    # Titles like "Lesson 1" also match "Lesson 10", so only the IDs
+    # that are unambiguous are resolved
+    raws = [raw for raw in resource_ids(scale)
+            if not any(other != raw and other.startswith(raw)
+                       for other in resource_ids(scale))]
+    results = {}
+    print('{:<10} {:>6} {:>10} {:>10}'.format('method', 'ids', 'requests', 'seconds'))
+    paths = {}
+    for label, resolve in [('each', resolve_each), ('together', resolve_together)]:
+        server = FakeCanvas(latency=latency)
+        populate(server, scale, 1)
+        with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+            course = Course(destination, COURSE_NAME)
+            before = server.request_count
+            with quietly(), Timer() as timer:
+                resolved = resolve(course, raws)
+            requests = server.request_count - before
+            paths[label] = [os.path.relpath(resource_id.path, destination)
+                            for resource_id in resolved]
+            course.index.close()
+        results[label+'_requests'] = requests
+        results[label+'_seconds'] = timer.elapsed
+        print('{:<10} {:>6} {:>10} {:>10.3f}'.format(label, len(raws), requests,
+                                                     timer.elapsed))
+    if paths['each'] != paths['together']:
+        print("  WARNING: the methods resolved different paths")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark resolving resource IDs')
+    parser.add_argument('--scale', type=int, default=50,
+                        help='How many pages, assignments and quizzes the course has')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.scale, args.latency)
+    if not args.no_save:
+        print("Saved results to", save_results('resolve', results))
+
+
+if __name__ == '__main__':
+    main()
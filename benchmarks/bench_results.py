@@ -0,0 +1,110 @@
+'''
+Benchmark for the results verb (quiz item analysis), run against FakeCanvas.
+
+Simulates sections of students taking a multiple choice quiz, where each
+student's chance of answering correctly grows with their ability and
+shrinks with the question's difficulty, and then times downloading the
+submissions, analyzing them and exporting the report in every format.
+Since stronger students answer more questions correctly, every question
+should come out with a positive discrimination.
+
+    python -m benchmarks.bench_results --students 100 1000 --questions 20 --latency 0.02
+'''
+import math
+import random
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+COURSE_ID = 1
+COURSE_NAME = 'bench'
+FORMATS = ('html', 'json', 'pdf', 'text', 'yaml')
+
+
+def populate(server, students, questions, seed=0):
+    '''Adds a quiz and every student's attempt at it.'''
+    generator = random.Random(seed)
+    quiz = server.add_quiz(COURSE_ID, 'Exam {}'.format(students), '<p>Exam</p>')
+    added = []
+    for index in range(questions):
+        added.append(server.add_question(
+            COURSE_ID, quiz['id'], 'Question {}'.format(index),
+            '<p>Question {}</p>'.format(index),
+            answers=[{'text': 'Option {}'.format(option), 'html': '',
+                      'comments': '', 'comments_html': '',
+                      'weight': 100 if option == 0 else 0}
+                     for option in range(4)]))
+    difficulties = [generator.gauss(0, 1) for question in added]
+    for user_id in range(1, students+1):
+        ability = generator.gauss(0, 1)
+        answers = []
+        for question, difficulty in zip(added, difficulties):
+            correct = generator.random() < 1 / (1 + math.exp(difficulty - ability))
+            # Wrong answers favor the first distractors
+            option = 0 if correct else min(3, 1 + int(generator.expovariate(1.5)))
+            answers.append({'question_id': question['id'], 'correct': correct,
+                            'points': 1.0 if correct else 0.0,
+                            'answer_id': question['answers'][option]['id']})
+        server.add_submission(COURSE_ID, quiz['assignment_id'], user_id,
+                              sum(answer['points'] for answer in answers), answers)
+    return quiz
+
+
+def run(students_list, questions, latency):
+    from waltz.resources import Course
+    from waltz.results import QuizResults, export
+    server = FakeCanvas(latency=latency)
+    server.add_course(COURSE_ID, COURSE_NAME)
+    quizzes = [populate(server, students, questions) for students in students_list]
+    results = {}
+    print('{:>9} {:>10} {:>12} {:>12} {:>12}'.format(
+        'students', 'requests', 'download s', 'analyze s', 'export s'))
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+        course = Course(destination, COURSE_NAME)
+        for students, quiz in zip(students_list, quizzes):
+            before = server.request_count
+            with quietly(), Timer() as download:
+                quiz_results = QuizResults.download(course, quiz)
+            requests = server.request_count - before
+            with Timer() as analyze:
+                report = quiz_results.analyze()
+            with Timer() as exporting:
+                for format in FORMATS:
+                    export(report, format)
+            key = str(students)
+            results[key+'/requests'] = requests
+            results[key+'/download_seconds'] = download.elapsed
+            results[key+'/analyze_seconds'] = analyze.elapsed
+            results[key+'/export_seconds'] = exporting.elapsed
+            print('{:>9} {:>10} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+                students, requests, download.elapsed, analyze.elapsed,
+                exporting.elapsed))
+            if report['students'] != students:
+                print("  WARNING: analyzed", report['students'], "students")
+            weak = [question['name'] for question in report['questions']
+                    if not question['discrimination'] or question['discrimination'] <= 0]
+            if weak:
+                print("  WARNING: no positive discrimination for", ", ".join(weak))
+        course.index.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark quiz item analysis')
+    parser.add_argument('--students', type=int, nargs='+', default=[100, 1000],
+                        help='The sizes of the sections to analyze')
+    parser.add_argument('--questions', type=int, default=20,
+                        help='How many questions the quiz has')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.students, args.questions, args.latency)
+    if not args.no_save:
+        print("Saved results to", save_results('results', results))
+
+
+if __name__ == '__main__':
+    main()
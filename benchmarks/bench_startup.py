@@ -0,0 +1,80 @@
+'''
+Startup benchmark for the command line interface.
+
+Times `python -m waltz --help` against a bare interpreter and reports the
+import cost of the modules each verb needs. tests/test_startup.py asserts
+that --help imports none of HEAVY_MODULES, nor the modules of the verbs.
+
+    python -m benchmarks.bench_startup --repeat 10
+'''
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.common import Timer, save_results
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# None of these should be needed just to print the help text
+HEAVY_MODULES = ['requests', 'requests_cache', 'tqdm', 'dateutil', 'jinja2',
+                 'ruamel', 'markdown', 'pygments', 'html2text']
+
+# What each family of verbs ends up importing
+VERB_MODULES = {
+    'build/publicize': 'waltz.sync',
+    'pull/push': 'waltz.sync, requests, requests_cache',
+}
+
+
+def time_command(command, repeat):
+    timings = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+        timings.append(timer.elapsed)
+    return statistics.median(timings)
+
+
+def imported_modules(command):
+    '''Uses -X importtime to find every module that a command imports.'''
+    result = subprocess.run(command[:1] + ['-X', 'importtime'] + command[1:],
+                            cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative.strip())
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CLI startup time')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='How many times to run each command')
+    args = parser.parse_args()
+
+    python = sys.executable
+    results = {}
+    bare = time_command([python, '-c', 'pass'], args.repeat)
+    help_time = time_command([python, '-m', 'waltz', '--help'], args.repeat)
+    results['interpreter'] = bare
+    results['help'] = help_time
+    print('{:<20} {:>8.1f} ms'.format('interpreter', bare*1000))
+    print('{:<20} {:>8.1f} ms'.format('waltz --help', help_time*1000))
+    for verb, modules in VERB_MODULES.items():
+        statement = 'import ' + modules
+        elapsed = time_command([python, '-W', 'ignore', '-c', statement],
+                               args.repeat)
+        results['imports/'+verb] = elapsed
+        print('{:<20} {:>8.1f} ms'.format(verb+' imports', elapsed*1000))
+    print("Saved results to", save_results('startup', results))
+
+
+if __name__ == '__main__':
+    main()
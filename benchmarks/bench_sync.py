@@ -0,0 +1,109 @@
+'''
+End-to-end throughput benchmark for the sync verbs, run against FakeCanvas.
+
+Times ``pull_all_resources`` for pages and assignments, ``push_resource`` for
+pages, and full pull/push round trips for quizzes at several course sizes.
+Results are saved in benchmarks/results/ and compared against the previous
+run.
+
+    python -m benchmarks.bench_sync --scales 10 100 1000 --latency 0.005
+'''
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.common import (waltz_sandbox, quietly, Timer, save_results,
+                               load_previous_results, compare_results)
+
+COURSE_ID = 1
+COURSE_NAME = 'bench'
+
+PAGE_BODY = '''<h2>Lesson {index}</h2>
+<p>This is a <strong>sample</strong> page with a <a href="https://example.com">link</a>.</p>
+<ul><li>First point</li><li>Second point</li></ul>
+<pre><code>def add(a, b):
+    return a + b
+</code></pre>
+'''
+
+
+def populate(server, scale, questions_per_quiz=5):
+    server.add_course(COURSE_ID, COURSE_NAME)
+    for index in range(scale):
+        server.add_page(COURSE_ID, 'Lesson {}'.format(index),
+                        PAGE_BODY.format(index=index))
+        server.add_assignment(COURSE_ID, 'Project {}'.format(index),
+                              '<p>Build project {}.</p>'.format(index),
+                              due_at='2020-02-01T04:59:00Z')
+        quiz = server.add_quiz(COURSE_ID, 'Quiz {}'.format(index),
+                               '<p>Quiz {} description</p>'.format(index))
+        group = server.add_group(COURSE_ID, quiz['id'], 'Pool', pick_count=1)
+        for q in range(questions_per_quiz):
+            server.add_question(
+                COURSE_ID, quiz['id'], 'Q{}.{}'.format(index, q),
+                '<p>What is {} + {}?</p>'.format(index, q),
+                quiz_group_id=group['id'] if q == 0 else None,
+                answers=[{'text': str(index+q), 'html': '',
+                          'comments': '', 'comments_html': '', 'weight': 100},
+                         {'text': str(index-q), 'html': '',
+                          'comments': '', 'comments_html': '', 'weight': 0}])
+
+
+def run_scale(scale, latency):
+    from waltz.sync import pull_all_resources, push_resource
+    from waltz.quizzes import QuizQuestion
+    QuizQuestion.CACHE.clear()
+    results = {}
+    server = FakeCanvas(latency=latency)
+    populate(server, scale)
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+        def timed(label, action):
+            before = server.request_count
+            with quietly(), Timer() as timer:
+                action()
+            results['{}/{}/seconds'.format(scale, label)] = timer.elapsed
+            results['{}/{}/requests'.format(scale, label)] = server.request_count - before
+            print('  {:<28} {:>8.3f}s {:>7} requests'.format(
+                label, timer.elapsed, server.request_count - before))
+
+        timed('pull pages', lambda: pull_all_resources(
+            'pages/*', 'raw', destination, COURSE_NAME, True))
+        timed('pull assignments', lambda: pull_all_resources(
+            'assignments/*', 'raw', destination, COURSE_NAME, True))
+        page_urls = list(server.courses[COURSE_ID]['pages'])
+        timed('push pages', lambda: [
+            push_resource('pages/:'+url, 'raw', destination, COURSE_NAME, True)
+            for url in page_urls])
+        quiz_ids = list(server.courses[COURSE_ID]['quizzes'])
+        timed('pull quizzes', lambda: pull_all_resources(
+            'quizzes/*', 'raw', destination, COURSE_NAME, True))
+        timed('push quizzes', lambda: [
+            push_resource('quizzes/:{}'.format(id), 'raw', destination,
+                          COURSE_NAME, True)
+            for id in quiz_ids])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sync throughput against a fake Canvas')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Number of each kind of resource to create')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Simulated seconds of latency per request')
+    parser.add_argument('--no-save', action='store_true', default=False,
+                        help='Do not save the results for later comparison')
+    args = parser.parse_args()
+
+    results = {}
+    for scale in args.scales:
+        print("Scale:", scale)
+        results.update(run_scale(scale, args.latency))
+    previous_path, previous = load_previous_results('sync')
+    if not args.no_save:
+        print("Saved results to", save_results('sync', results))
+    if previous:
+        print("Compared with", previous_path)
+        compare_results(previous, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+'''
+Benchmark for the durable task queue, run against FakeCanvas.
+
+Pulls a whole course directly and then through the task queue with
+different numbers of workers. It then makes a fraction of the tasks fail,
+and compares resuming that run (which only pulls the failed resources) to
+pulling everything again. It checks that every pull writes the same files.
+
+    python -m benchmarks.bench_task_queue --scale 30 --latency 0.02 --workers 1 4 8
+'''
+import os
+import glob
+import zlib
+import shutil
+import hashlib
+import argparse
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.bench_sync import populate, COURSE_ID, COURSE_NAME
+from benchmarks.common import waltz_sandbox, quietly, Timer, save_results
+
+
+def course_files(destination):
+    files = {}
+    for path in sorted(glob.glob(os.path.join(destination, '*', '**', '*.*'),
+                                 recursive=True)):
+        relative = os.path.relpath(path, destination)
+        if relative.startswith(('_cache', '_backups')):
+            continue
+        with open(path, 'rb') as course_file:
+            files[relative] = hashlib.sha1(course_file.read()).hexdigest()
+    return files
+
+
+def clear(destination):
+    for name in os.listdir(destination):
+        shutil.rmtree(os.path.join(destination, name))
+
+
+def run(scale, questions, latency, workers_list, failures):
+    import waltz.tasks
+    import waltz.canvas_tools
+    from waltz.resources import Course, RESOURCE_TYPES
+    from waltz.sync import pull_all_resources
+    server = FakeCanvas(latency=latency)
+    populate(server, scale, questions)
+    results = {}
+    print('{:<24} {:>10} {:>10}'.format('pull', 'requests', 'seconds'))
+
+    def report(key, label, before, timer):
+        results[key+'_requests'] = server.request_count - before
+        results[key+'_seconds'] = timer.elapsed
+        print('{:<24} {:>10} {:>10.3f}'.format(label, results[key+'_requests'],
+                                               timer.elapsed))
+    with server, waltz_sandbox(server, COURSE_NAME, COURSE_ID) as destination:
+        waltz.canvas_tools.defaults['task-backoff'] = 0
+        course = Course(destination, COURSE_NAME)
+        before = server.request_count
+        with quietly(), Timer() as timer:
+            for category in sorted(RESOURCE_TYPES):
+                pull_all_resources(category+'/*', 'raw', destination, course, True)
+        report('direct', 'direct', before, timer)
+        expected = course_files(destination)
+        for workers in workers_list:
+            clear(destination)
+            course = Course(destination, COURSE_NAME)
+            before = server.request_count
+            with quietly(), Timer() as timer:
+                waltz.tasks.run_queued(course, 'pull', None, workers)
+            report('queue_{}'.format(workers),
+                   'queue ({} workers)'.format(workers), before, timer)
+            if course_files(destination) != expected:
+                print("  WARNING: the queue wrote different files with", workers, "workers")
+        # Every few tasks fail, as if Canvas went away partway through
+        clear(destination)
+        course = Course(destination, COURSE_NAME)
+        pull_task = waltz.tasks.pull_task
+        failing = set()
+
+        def unreliable_pull(course, resource_id):
+            if zlib.crc32(resource_id.raw.encode('utf-8')) % 100 < failures*100:
+                failing.add(resource_id.raw)
+                raise ConnectionError("Canvas went away")
+            return pull_task(course, resource_id)
+        waltz.tasks.pull_task = unreliable_pull
+        try:
+            with quietly():
+                waltz.tasks.run_queued(course, 'pull', None, workers_list[-1])
+        except Exception:
+            pass
+        finally:
+            waltz.tasks.pull_task = pull_task
+        before = server.request_count
+        with quietly(), Timer() as timer:
+            waltz.tasks.run_queued(course, 'pull', None, workers_list[-1])
+        report('resume', 'resume ({} failed)'.format(len(failing)), before, timer)
+        if course_files(destination) != expected:
+            print("  WARNING: the resumed run wrote different files")
+        course.index.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the durable task queue')
+    parser.add_argument('--scale', type=int, default=30,
+                        help='How many pages, assignments and quizzes the course has')
+    parser.add_argument('--questions', type=int, default=3,
+                        help='How many questions each quiz has')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds of simulated latency per request')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8],
+                        help='The numbers of workers to try')
+    parser.add_argument('--failures', type=float, default=0.1,
+                        help='The fraction of tasks that fail before resuming')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.scale, args.questions, args.latency, args.workers,
+                  args.failures)
+    if not args.no_save:
+        print("Saved results to", save_results('task_queue', results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Benchmark for the Markdown tree processors used by m2h.
+
+Converts every corpus document with the document processor (which decorates
+tables and gives headers ids in a single pass), and reports the time spent
+in the tree processor itself as well as in the whole conversion.
+
+    python -m benchmarks.bench_tree --repeat 5
+'''
+import argparse
+import statistics
+
+from benchmarks.corpus import build_corpus
+from benchmarks.common import Timer, save_results
+
+BASE_EXTENSIONS = ['fenced_code', 'attr_list', 'tables', 'codehilite',
+                   'waltz.iconfonts:IconFontsExtension']
+CHAINS = {'fused': ['waltz.document_processor:DocumentExtension']}
+PROCESSORS = {'fused': ['document']}
+
+
+def make_converter(chain, spent):
+    '''
+    Returns:
+        Markdown: A converter whose tree processors add their running time
+            to the `spent` list.
+    '''
+    import warnings
+    from markdown import Markdown
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        md = Markdown(extensions=BASE_EXTENSIONS+CHAINS[chain],
+                      extension_configs={'codehilite': {'noclasses': True}})
+    for name in PROCESSORS[chain]:
+        processor = md.treeprocessors[name]
+
+        def timed(root, run=processor.run):
+            with Timer() as timer:
+                result = run(root)
+            spent.append(timer.elapsed)
+            return result
+        processor.run = timed
+    return md
+
+
+def convert(chain, fragments):
+    spent = []
+    outputs = []
+    with Timer() as timer:
+        for fragment in fragments:
+            md = make_converter(chain, spent)
+            outputs.append(md.convert(fragment))
+    return outputs, timer.elapsed, sum(spent)
+
+
+def run(repeat):
+    from waltz.html_markdown_utilities import h2m
+    results = {}
+    print('{:<14} {:<9} {:>11} {:>12}'.format('document', 'chain',
+                                              'tree ms', 'total ms'))
+    for name, origin, fragments in build_corpus():
+        if origin == 'html':
+            fragments = [h2m(fragment) for fragment in fragments]
+        for chain in CHAINS:
+            totals, trees = [], []
+            for _ in range(repeat):
+                _, total, tree = convert(chain, fragments)
+                totals.append(total)
+                trees.append(tree)
+            total, tree = statistics.median(totals), statistics.median(trees)
+            results['{}/{}/tree'.format(name, chain)] = tree
+            results['{}/{}/total'.format(name, chain)] = total
+            print('{:<14} {:<9} {:>11.2f} {:>12.2f}'.format(name, chain,
+                                                            tree*1000, total*1000))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Markdown tree processors')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to convert each document')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not save the results')
+    args = parser.parse_args()
+    results = run(args.repeat)
+    if not args.no_save:
+        print("Saved results to", save_results('tree', results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Shared helpers for the benchmark scripts: pointing Waltz at a fake Canvas,
+timing blocks of code, and saving/comparing result files.
+'''
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import contextlib
+from glob import glob
+from datetime import datetime
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+
+
+@contextlib.contextmanager
+def waltz_sandbox(server, course_name='bench', course_id=1):
+    '''
+    Creates a temporary course directory and settings file that point Waltz
+    at the given FakeCanvas, and yields the course directory.
+    '''
+    from waltz.yaml_setup import yaml
+    from waltz.canvas_tools import load_settings
+    with tempfile.TemporaryDirectory() as directory:
+        settings_path = os.path.join(directory, 'settings', 'settings.yaml')
+        os.makedirs(os.path.dirname(settings_path))
+        with open(settings_path, 'w') as settings_file:
+            yaml.dump({
+                'courses': {course_name: {'id': course_id}},
+                'defaults': {'course': course_name,
+                             'canvas-token': 'fake-token',
+                             'canvas-url': server.url}
+            }, settings_file)
+        load_settings(settings_path)
+        destination = os.path.join(directory, 'courses', course_name)
+        os.makedirs(destination)
+        yield destination
+
+
+@contextlib.contextmanager
+def quietly():
+    '''Swallows the chatty prints that the sync code does along the way.'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def save_results(name, results):
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    path = os.path.join(RESULTS_DIRECTORY, '{}-{}.json'.format(
+        name, datetime.now().strftime('%Y-%m-%d_%H-%M-%S')))
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    return path
+
+
+def load_previous_results(name, exclude=None):
+    paths = sorted(glob(os.path.join(RESULTS_DIRECTORY, name+'-*.json')))
+    paths = [p for p in paths if p != exclude]
+    if not paths:
+        return None, None
+    with open(paths[-1]) as results_file:
+        return paths[-1], json.load(results_file)
+
+
+def compare_results(previous, current, threshold=None, out=sys.stdout):
+    '''
+    Prints the ratio between matching numeric entries of two result sets.
+    Returns the keys whose ratio exceeded ``1 + threshold``.
+    '''
+    regressions = []
+    for key in sorted(current):
+        if key not in previous:
+            continue
+        old, new = previous[key], current[key]
+        if not isinstance(old, (int, float)) or not old:
+            continue
+        ratio = new / old
+        flag = ''
+        if threshold is not None and ratio > 1 + threshold:
+            regressions.append(key)
+            flag = '  <-- REGRESSION'
+        print('{:<50} {:>10.4f} -> {:>10.4f}  ({:.2f}x){}'.format(
+            key, old, new, ratio, flag), file=out)
+    return regressions
@@ -0,0 +1,85 @@
+'''
+A synthetic corpus of course content for the conversion benchmarks.
+
+Every document is a list of fragments: a page is one fragment, while a quiz
+is many small fragments (question texts, answers and comments), which is
+how the sync code actually feeds them to h2m/m2h.
+'''
+import os
+
+TESTS_DIRECTORY = os.path.join(os.path.dirname(__file__), '..', 'tests')
+
+CODE_SNIPPET = '''```python
+def fibonacci(n):
+    """Return the n-th Fibonacci number."""
+    if n < 2:
+        return n
+    total = 0
+    for index in range({index}):
+        total += index * 2 if index % 3 else -index
+    return fibonacci(n - 1) + fibonacci(n - 2)
+```
+'''
+
+ICONS = ['icon-check', 'icon-warning', 'icon-info', 'icon-video',
+         'icon-document', 'icon-quiz', 'icon-assignment', 'icon-email']
+
+
+def code_heavy_page(blocks=40):
+    parts = ['# Worked Examples\n']
+    for index in range(blocks):
+        parts.append('## Example {}\n\nConsider the following code:\n'.format(index))
+        parts.append(CODE_SNIPPET.format(index=index))
+        parts.append('Notice how `total` changes on each iteration.\n')
+    return '\n'.join(parts)
+
+
+def table_page(tables=10, rows=30):
+    parts = ['# Schedule\n']
+    for table in range(tables):
+        parts.append('## Week {}\n'.format(table))
+        parts.append('| Day | Topic | Reading | Due |')
+        parts.append('|-----|-------|---------|-----|')
+        for row in range(rows):
+            parts.append('| {} | Topic {} | Chapter {} | Project {} |'.format(
+                row % 5, row, row // 3, row // 7))
+        parts.append('')
+    return '\n'.join(parts)
+
+
+def icon_page(lines=300):
+    return '\n\n'.join(
+        '&{}; Item {} of the checklist &{};'.format(
+            ICONS[index % len(ICONS)], index, ICONS[(index+3) % len(ICONS)])
+        for index in range(lines))
+
+
+def long_quiz(questions=100):
+    fragments = []
+    for index in range(questions):
+        fragments.append('What does the following code print?\n\n' +
+                         CODE_SNIPPET.format(index=index % 7))
+        for answer in range(4):
+            fragments.append('`{}`'.format(index * answer))
+        fragments.append('Remember that **loops** run until the condition is false.')
+    return fragments
+
+
+def load_syllabus():
+    with open(os.path.join(TESTS_DIRECTORY, 'perfect_syllabus.html')) as syllabus:
+        return syllabus.read()
+
+
+def build_corpus():
+    '''
+    Returns:
+        list of (str, str, list of str): The document name, the format its
+            fragments start in ('html' or 'md'), and the fragments themselves.
+    '''
+    return [
+        ('perfect_syllabus', 'html', [load_syllabus()]),
+        ('code_heavy', 'md', [code_heavy_page()]),
+        ('tables', 'md', [table_page()]),
+        ('icon_fonts', 'md', [icon_page()]),
+        ('long_quiz', 'md', long_quiz()),
+    ]
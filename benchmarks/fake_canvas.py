@@ -0,0 +1,936 @@
+'''
+An in-process fake of the parts of the Canvas REST API that Waltz talks to.
+
+The server runs on a background thread and keeps all of its data in memory,
+so the sync code can be exercised end-to-end (and timed) without touching a
+real Canvas instance. It supports courses, pages, assignments, quizzes, quiz
+questions, quiz groups, files (with the three-step upload, and downloads),
+folders, quiz submissions and progress objects, paginates listings with Link
+headers, and can simulate per-request latency and Canvas' rate-limit headers.
+A small stub of the GraphQL endpoint answers the assignment queries of
+waltz.graphql_backend, rejecting fields it does not know like Canvas does.
+
+    server = FakeCanvas(latency=0.01)
+    server.add_course(1, 'bench')
+    server.add_page(1, 'Syllabus', '<p>Hello</p>')
+    server.start()
+    ... point 'canvas-url' at server.url ...
+    server.stop()
+'''
+import re
+import json
+import time
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from itertools import count
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+CANVAS_DATE_STRING = "%Y-%m-%dT%H:%M:%SZ"
+BRACKETS = re.compile(r'\[([^\]]*)\]')
+
+
+def parse_nested(pairs):
+    '''
+    Turns Rails-style form keys (``question[answers][0][answer_text]``) into
+    nested dictionaries. Empty brackets (``quiz_groups[][name]``) build lists.
+    '''
+    result = {}
+    for key, value in pairs:
+        head = key.split('[', 1)[0]
+        parts = [head] + BRACKETS.findall(key[len(head):])
+        target = result
+        for index, part in enumerate(parts[:-1]):
+            following = parts[index+1]
+            if part == '':
+                if not target or following in target[-1]:
+                    target.append({})
+                target = target[-1]
+            else:
+                default = [] if following == '' else {}
+                target = target.setdefault(part, default)
+        last = parts[-1]
+        if last == '':
+            target.append(value)
+        else:
+            target[last] = value
+    return result
+
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+
+def as_number(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return float(value)
+
+
+def as_date(value):
+    return value or None
+
+
+def slugify(title):
+    return re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+
+
+GRAPHQL_TOKENS = re.compile(r'\$?\w+|"[^"]*"|[{}():,!]')
+
+
+class GraphQLStubError(Exception):
+    pass
+
+
+def parse_selection(tokens, index):
+    '''
+    Parses the GraphQL selection set starting at tokens[index] (a "{").
+    Returns:
+        (list, int): Each field as (key, name, arguments, selection), and
+            the index after the closing brace.
+    '''
+    fields = []
+    index += 1
+    while tokens[index] != '}':
+        key = name = tokens[index]
+        index += 1
+        if tokens[index] == ':':
+            name = tokens[index+1]
+            index += 2
+        arguments = {}
+        if tokens[index] == '(':
+            index += 1
+            while tokens[index] != ')':
+                arguments[tokens[index]] = tokens[index+2]
+                index += 3
+                if tokens[index] == ',':
+                    index += 1
+            index += 1
+        selection = None
+        if tokens[index] == '{':
+            selection, index = parse_selection(tokens, index)
+        fields.append((key, name, arguments, selection))
+    return fields, index+1
+
+
+def graphql_date(value):
+    # GraphQL dates carry an offset instead of a Z
+    return value.replace('Z', '+00:00') if value else None
+
+
+class FakeCanvas:
+    '''
+    Args:
+        latency (float): Seconds to sleep before answering each request.
+        per_page (int): The largest page size the server will honor.
+        rate_limit (float): Size of the simulated rate-limit bucket.
+        request_cost (float): How much each request drains from the bucket.
+        refill_rate (float): How much of the bucket refills per second.
+        enforce_rate_limit (bool): Whether an empty bucket rejects requests
+            with a 403, like Canvas does.
+        graphql (bool): Whether the GraphQL endpoint is available.
+    '''
+    def __init__(self, latency=0, per_page=100, rate_limit=700.0,
+                 request_cost=1.0, refill_rate=10.0,
+                 enforce_rate_limit=False, host='127.0.0.1', port=0,
+                 graphql=True):
+        self.latency = latency
+        self.graphql = graphql
+        self.per_page = per_page
+        self.rate_limit = rate_limit
+        self.request_cost = request_cost
+        self.refill_rate = refill_rate
+        self.enforce_rate_limit = enforce_rate_limit
+        self.bucket = rate_limit
+        self.bucket_checked = time.time()
+        self.lock = threading.RLock()
+        self.ids = count(1000)
+        self.courses = OrderedDict()
+        self.progress = {}
+        # Files are addressed globally by id; uploads wait here for step two
+        self.files = {}
+        self.file_contents = {}
+        self.uploads = {}
+        self.request_log = Counter()
+        self.address = (host, port)
+        self.server = None
+        self.thread = None
+
+    # Lifecycle
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/api/v1/'.format(host, port)
+
+    def start(self):
+        handler = type('FakeCanvasHandler', (FakeCanvasHandler,),
+                       {'canvas': self})
+        self.server = ThreadingHTTPServer(self.address, handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def request_count(self):
+        return sum(self.request_log.values())
+
+    # Populating data
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def add_course(self, course_id, name):
+        self.courses[course_id] = {
+            'course': {'id': course_id, 'name': name, 'course_code': name},
+            'pages': OrderedDict(),
+            'assignments': OrderedDict(),
+            'quizzes': OrderedDict(),
+            'questions': {},
+            'groups': {},
+            'files': OrderedDict(),
+            'folders': OrderedDict(),
+            'submissions': {},
+        }
+        return self.courses[course_id]['course']
+
+    def _html_url(self, course_id, category, key):
+        return 'https://canvas.example.edu/courses/{}/{}/{}'.format(
+            course_id, category, key)
+
+    def add_page(self, course_id, title, body, published=True):
+        url = slugify(title)
+        page = {
+            'page_id': self.next_id(), 'url': url, 'title': title,
+            'body': body, 'published': published, 'front_page': False,
+            'html_url': self._html_url(course_id, 'pages', url),
+            'created_at': '2020-01-01T12:00:00Z',
+            'updated_at': '2020-01-01T12:00:00Z',
+        }
+        self.courses[course_id]['pages'][url] = page
+        return page
+
+    def add_assignment(self, course_id, name, description, **fields):
+        id = fields.pop('id', None) or self.next_id()
+        assignment = {
+            'id': id, 'name': name, 'description': description,
+            'html_url': self._html_url(course_id, 'assignments', id),
+            'published': True, 'points_possible': 10,
+            'grading_type': 'points', 'submission_types': ['online_upload'],
+            'allowed_extensions': ['py'], 'due_at': None, 'unlock_at': None,
+            'lock_at': None, 'anonymize_students': False,
+            'anonymous_grading': False, 'course_id': course_id,
+            'updated_at': '2020-01-01T12:00:00Z',
+        }
+        assignment.update(fields)
+        self.courses[course_id]['assignments'][id] = assignment
+        return assignment
+
+    def add_quiz(self, course_id, title, description, **fields):
+        id = self.next_id()
+        quiz = {
+            'id': id, 'title': title, 'description': description,
+            'html_url': self._html_url(course_id, 'quizzes', id),
+            'published': True, 'quiz_type': 'assignment',
+            'points_possible': 0, 'allowed_attempts': 1,
+            'scoring_policy': 'keep_highest', 'due_at': None,
+            'unlock_at': None, 'lock_at': None,
+            'one_question_at_a_time': False, 'shuffle_answers': False,
+            'time_limit': None, 'cant_go_back': False,
+            'show_correct_answers': True,
+            'show_correct_answers_last_attempt': False,
+            'show_correct_answers_at': None, 'hide_correct_answers_at': None,
+            'hide_results': None, 'one_time_results': False,
+            'access_code': None, 'ip_filter': None,
+            'updated_at': '2020-01-01T12:00:00Z',
+        }
+        quiz.update(fields)
+        course = self.courses[course_id]
+        course['quizzes'][id] = quiz
+        course['questions'][id] = OrderedDict()
+        course['groups'][id] = OrderedDict()
+        # Every quiz is also backed by an assignment
+        assignment = self.add_assignment(course_id, title, description,
+                                         id=self.next_id(),
+                                         quiz_id=id)
+        quiz['assignment_id'] = assignment['id']
+        return quiz
+
+    def add_group(self, course_id, quiz_id, name, pick_count=1,
+                  question_points=1):
+        group = {'id': self.next_id(), 'quiz_id': quiz_id, 'name': name,
+                 'pick_count': pick_count, 'question_points': question_points,
+                 'position': None, 'assessment_question_bank_id': None}
+        self.courses[course_id]['groups'][quiz_id][group['id']] = group
+        return group
+
+    def add_question(self, course_id, quiz_id, question_name, question_text,
+                     question_type='multiple_choice_question', answers=None,
+                     quiz_group_id=None, points_possible=1):
+        question = {
+            'id': self.next_id(), 'quiz_id': quiz_id,
+            'quiz_group_id': quiz_group_id, 'position': None,
+            'question_name': question_name, 'question_type': question_type,
+            'question_text': question_text,
+            'points_possible': points_possible,
+            'correct_comments': '', 'incorrect_comments': '',
+            'neutral_comments': '', 'correct_comments_html': '',
+            'incorrect_comments_html': '', 'neutral_comments_html': '',
+            'answers': answers or [], 'variables': None, 'formulas': None,
+            'matching_answer_incorrect_matches': None, 'matches': None,
+        }
+        for answer in question['answers']:
+            answer.setdefault('id', self.next_id())
+        questions = self.courses[course_id]['questions'][quiz_id]
+        questions[question['id']] = question
+        question['position'] = len(questions)
+        return question
+
+    def add_file(self, course_id, name, data, content_type='application/octet-stream',
+                 folder='course files'):
+        '''Stores a file, replacing any file of the same name in the folder.'''
+        course = self.courses[course_id]
+        if folder != 'course files' and not folder.startswith('course files/'):
+            folder = 'course files/'+folder.strip('/')
+        if folder not in course['folders']:
+            course['folders'][folder] = self.next_id()
+        for existing in list(course['files'].values()):
+            if existing['display_name'] == name and existing['folder'] == folder:
+                course['files'].pop(existing['id'])
+                self.files.pop(existing['id'])
+                self.file_contents.pop(existing['id'])
+        id = self.next_id()
+        record = {
+            'id': id, 'display_name': name, 'filename': name,
+            'size': len(data), 'content-type': content_type,
+            'folder': folder, 'folder_id': course['folders'][folder],
+            'url': 'https://canvas.example.edu/files/{}/download'.format(id),
+            'updated_at': '2020-01-01T12:00:00Z',
+        }
+        course['files'][id] = record
+        self.files[id] = record
+        self.file_contents[id] = data
+        return record
+
+    def add_submission(self, course_id, assignment_id, user_id, score,
+                       submission_data, attempt=1):
+        '''
+        Records a graded attempt at a quiz's assignment, with the answer to
+        each question (like {'question_id': 1, 'points': 1, 'answer_id': 2}).
+        '''
+        submissions = self.courses[course_id]['submissions'].setdefault(
+            assignment_id, OrderedDict())
+        submission = submissions.setdefault(user_id, {
+            'id': self.next_id(), 'user_id': user_id,
+            'assignment_id': assignment_id, 'workflow_state': 'graded',
+            'submission_history': []})
+        submission.update(score=score, attempt=attempt)
+        submission['submission_history'].append({
+            'attempt': attempt, 'score': score,
+            'submission_data': submission_data})
+        return submission
+
+    def add_progress(self, workflow_state='completed', message=None):
+        progress = {'id': self.next_id(), 'workflow_state': workflow_state,
+                    'message': message, 'completion': 100.0}
+        self.progress[progress['id']] = progress
+        return progress
+
+    # Rate limiting
+
+    def charge(self):
+        '''
+        Drains the leaky bucket for one request.
+        Returns:
+            (float, bool): The remaining budget and whether it was exhausted.
+        '''
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.bucket_checked
+            self.bucket_checked = now
+            self.bucket = min(self.rate_limit,
+                              self.bucket + elapsed * self.refill_rate)
+            self.bucket -= self.request_cost
+            exhausted = self.bucket < 0
+            if exhausted:
+                self.bucket = 0
+            return self.bucket, exhausted
+
+
+class FakeCanvasHandler(BaseHTTPRequestHandler):
+    canvas = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm and delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        ('GET', r'courses', 'list_courses'),
+        ('GET', r'courses/(\d+)', 'get_course'),
+        ('GET', r'progress/(\d+)', 'get_progress'),
+        ('GET', r'courses/(\d+)/pages', 'list_pages'),
+        ('POST', r'courses/(\d+)/pages', 'create_page'),
+        ('GET', r'courses/(\d+)/pages/([^/]+)', 'get_page'),
+        ('PUT', r'courses/(\d+)/pages/([^/]+)', 'update_page'),
+        ('DELETE', r'courses/(\d+)/pages/([^/]+)', 'delete_page'),
+        ('GET', r'courses/(\d+)/assignments', 'list_assignments'),
+        ('POST', r'courses/(\d+)/assignments', 'create_assignment'),
+        ('GET', r'courses/(\d+)/assignments/(\d+)', 'get_assignment'),
+        ('GET', r'courses/(\d+)/assignments/(\d+)/submissions', 'list_submissions'),
+        ('PUT', r'courses/(\d+)/assignments/(\d+)', 'update_assignment'),
+        ('DELETE', r'courses/(\d+)/assignments/(\d+)', 'delete_assignment'),
+        ('PUT', r'courses/(\d+)/assignments/bulk_update', 'bulk_update_assignments'),
+        ('GET', r'courses/(\d+)/quizzes', 'list_quizzes'),
+        ('POST', r'courses/(\d+)/quizzes', 'create_quiz'),
+        ('GET', r'courses/(\d+)/quizzes/(\d+)', 'get_quiz'),
+        ('PUT', r'courses/(\d+)/quizzes/(\d+)', 'update_quiz'),
+        ('DELETE', r'courses/(\d+)/quizzes/(\d+)', 'delete_quiz'),
+        ('POST', r'courses/(\d+)/quizzes/(\d+)/reorder', 'reorder_quiz'),
+        ('GET', r'courses/(\d+)/quizzes/(\d+)/questions', 'list_questions'),
+        ('POST', r'courses/(\d+)/quizzes/(\d+)/questions', 'create_question'),
+        ('GET', r'courses/(\d+)/quizzes/(\d+)/questions/(\d+)', 'get_question'),
+        ('PUT', r'courses/(\d+)/quizzes/(\d+)/questions/(\d+)', 'update_question'),
+        ('DELETE', r'courses/(\d+)/quizzes/(\d+)/questions/(\d+)', 'delete_question'),
+        ('POST', r'courses/(\d+)/quizzes/(\d+)/groups', 'create_group'),
+        ('GET', r'courses/(\d+)/quizzes/(\d+)/groups/(\d+)', 'get_group'),
+        ('PUT', r'courses/(\d+)/quizzes/(\d+)/groups/(\d+)', 'update_group'),
+        ('DELETE', r'courses/(\d+)/quizzes/(\d+)/groups/(\d+)', 'delete_group'),
+        ('GET', r'courses/(\d+)/files', 'list_files'),
+        ('POST', r'courses/(\d+)/files', 'start_upload'),
+        ('POST', r'files/uploads/(\d+)', 'finish_upload'),
+        ('GET', r'files/(\d+)', 'get_file'),
+        ('GET', r'courses/(\d+)/folders', 'list_folders'),
+        ('GET', r'files/(\d+)/download', 'download_file'),
+    ]
+    COMPILED_ROUTES = [(verb, re.compile('/api/v1/'+pattern+'/?$'), name)
+                       for verb, pattern, name in ROUTES]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    # Plumbing
+
+    def read_params(self):
+        split = urlsplit(self.path)
+        pairs = parse_qsl(split.query, keep_blank_values=True)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.json_body = None
+        self.body = body
+        if body:
+            content_type = self.headers.get('Content-Type', '')
+            if 'multipart' in content_type:
+                pass
+            elif 'json' in content_type:
+                self.json_body = json.loads(body.decode('utf-8'))
+            else:
+                pairs += parse_qsl(body.decode('utf-8'), keep_blank_values=True)
+        self.flat = dict(pairs)
+        return split.path, pairs
+
+    def dispatch(self, verb):
+        canvas = self.canvas
+        path, pairs = self.read_params()
+        self.params = parse_nested(pairs)
+        if canvas.latency:
+            time.sleep(canvas.latency)
+        remaining, exhausted = canvas.charge()
+        self.extra_headers = {
+            'X-Rate-Limit-Remaining': '{:.1f}'.format(remaining),
+            'X-Request-Cost': '{:.1f}'.format(canvas.request_cost),
+        }
+        if exhausted and canvas.enforce_rate_limit:
+            return self.send_text(403, '403 Forbidden (Rate Limit Exceeded)')
+        if verb == 'POST' and path.rstrip('/') == '/api/graphql' and canvas.graphql:
+            with canvas.lock:
+                canvas.request_log[(verb, 'graphql')] += 1
+                return self.graphql()
+        for route_verb, pattern, name in self.COMPILED_ROUTES:
+            if route_verb != verb:
+                continue
+            match = pattern.match(path)
+            if match:
+                with canvas.lock:
+                    canvas.request_log[(verb, name)] += 1
+                    args = [int(a) if a.isdigit() else a
+                            for a in match.groups()]
+                    try:
+                        return getattr(self, name)(*args)
+                    except KeyError:
+                        return self.send_error_json(404, 'The specified resource does not exist.')
+        self.send_error_json(404, 'No route for {} {}'.format(verb, path))
+
+    def send_text(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in self.extra_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200, links=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if links:
+            self.send_header('Link', ','.join(
+                '<{}>; rel="{}"'.format(url, rel) for rel, url in links.items()))
+        for key, value in self.extra_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json({'errors': [{'message': message}]}, status=status)
+
+    def paginate(self, items):
+        '''Sends one page of ``items`` with Canvas-style Link headers.'''
+        per_page = min(int(self.flat.get('per_page', 10)),
+                       self.canvas.per_page)
+        page = int(self.flat.get('page', 1))
+        start = (page - 1) * per_page
+        chunk = items[start:start+per_page]
+        base = 'http://{}:{}{}'.format(self.server.server_address[0],
+                                       self.server.server_address[1],
+                                       urlsplit(self.path).path)
+        query = {k: v for k, v in self.flat.items()
+                 if k not in ('page', 'per_page', 'access_token')}
+
+        def link(number):
+            query.update(page=number, per_page=per_page)
+            return base + '?' + urlencode(query)
+        last = max(1, (len(items) + per_page - 1) // per_page)
+        links = OrderedDict([('current', link(page)), ('first', link(1))])
+        if page < last:
+            links['next'] = link(page+1)
+        if page > 1:
+            links['prev'] = link(page-1)
+        links['last'] = link(last)
+        self.send_json(chunk, links=links)
+
+    def search(self, items, field):
+        term = self.flat.get('search_term', '').lower()
+        return [item for item in items if term in item[field].lower()]
+
+    def course(self, course_id):
+        return self.canvas.courses[course_id]
+
+    # Courses and progress
+
+    def list_courses(self):
+        self.paginate([c['course'] for c in self.canvas.courses.values()])
+
+    def get_course(self, course_id):
+        self.send_json(self.course(course_id)['course'])
+
+    def get_progress(self, progress_id):
+        self.send_json(self.canvas.progress[progress_id])
+
+    # Pages
+
+    def list_pages(self, course_id):
+        pages = [{k: v for k, v in page.items() if k != 'body'}
+                 for page in self.course(course_id)['pages'].values()]
+        self.paginate(self.search(pages, 'title'))
+
+    def get_page(self, course_id, url):
+        self.send_json(self.course(course_id)['pages'][url])
+
+    def create_page(self, course_id):
+        fields = self.params.get('wiki_page', {})
+        page = self.canvas.add_page(course_id, fields.get('title', 'Untitled'),
+                                    fields.get('body', ''))
+        self.send_json(page)
+
+    def update_page(self, course_id, url):
+        page = self.course(course_id)['pages'][url]
+        fields = self.params.get('wiki_page', {})
+        page.update({k: v for k, v in fields.items() if k in ('title', 'body')})
+        if 'published' in fields:
+            page['published'] = as_bool(fields['published'])
+        self.send_json(page)
+
+    def delete_page(self, course_id, url):
+        self.send_json(self.course(course_id)['pages'].pop(url))
+
+    # Assignments
+
+    ASSIGNMENT_FIELDS = {'name': str, 'description': str,
+                         'points_possible': as_number, 'due_at': as_date,
+                         'unlock_at': as_date, 'lock_at': as_date,
+                         'published': as_bool}
+
+    def _apply_fields(self, target, fields, converters):
+        for key, convert in converters.items():
+            if key in fields:
+                target[key] = convert(fields[key])
+
+    def list_assignments(self, course_id):
+        assignments = list(self.course(course_id)['assignments'].values())
+        self.paginate(self.search(assignments, 'name'))
+
+    def get_assignment(self, course_id, assignment_id):
+        self.send_json(self.course(course_id)['assignments'][assignment_id])
+
+    def list_submissions(self, course_id, assignment_id):
+        submissions = self.course(course_id)['submissions'].get(assignment_id, {})
+        # The history (with each attempt's answers) is only sent on request
+        if self.flat.get('include[]') == 'submission_history':
+            items = list(submissions.values())
+        else:
+            items = [{key: value for key, value in submission.items()
+                      if key != 'submission_history'}
+                     for submission in submissions.values()]
+        self.paginate(items)
+
+    def create_assignment(self, course_id):
+        fields = self.params.get('assignment', {})
+        assignment = self.canvas.add_assignment(course_id,
+                                                fields.get('name', 'Untitled'),
+                                                fields.get('description', ''))
+        self._apply_fields(assignment, fields, self.ASSIGNMENT_FIELDS)
+        self.send_json(assignment)
+
+    def update_assignment(self, course_id, assignment_id):
+        assignment = self.course(course_id)['assignments'][assignment_id]
+        self._apply_fields(assignment, self.params.get('assignment', {}),
+                           self.ASSIGNMENT_FIELDS)
+        self.send_json(assignment)
+
+    def delete_assignment(self, course_id, assignment_id):
+        self.send_json(self.course(course_id)['assignments'].pop(assignment_id))
+
+    def bulk_update_assignments(self, course_id):
+        course = self.course(course_id)
+        for update in self.json_body:
+            assignment = course['assignments'][update['id']]
+            for dates in update['all_dates']:
+                if dates.get('base'):
+                    self._apply_fields(assignment, dates, self.ASSIGNMENT_FIELDS)
+            # The quiz behind an assignment shares its dates
+            if assignment.get('quiz_id'):
+                quiz = course['quizzes'][assignment['quiz_id']]
+                for field in ('due_at', 'unlock_at', 'lock_at'):
+                    quiz[field] = assignment[field]
+        self.send_json(self.canvas.add_progress())
+
+    # Quizzes
+
+    QUIZ_FIELDS = {'title': str, 'description': str, 'quiz_type': str,
+                   'time_limit': as_number, 'shuffle_answers': as_bool,
+                   'hide_results': as_date, 'show_correct_answers': as_bool,
+                   'show_correct_answers_last_attempt': as_bool,
+                   'show_correct_answers_at': as_date,
+                   'hide_correct_answers_at': as_date,
+                   'allowed_attempts': as_number, 'scoring_policy': str,
+                   'one_question_at_a_time': as_bool, 'cant_go_back': as_bool,
+                   'access_code': as_date, 'ip_filter': as_date,
+                   'due_at': as_date, 'lock_at': as_date,
+                   'unlock_at': as_date, 'published': as_bool,
+                   'one_time_results': as_bool}
+
+    def list_quizzes(self, course_id):
+        quizzes = list(self.course(course_id)['quizzes'].values())
+        self.paginate(self.search(quizzes, 'title'))
+
+    def get_quiz(self, course_id, quiz_id):
+        self.send_json(self.course(course_id)['quizzes'][quiz_id])
+
+    def create_quiz(self, course_id):
+        fields = self.params.get('quiz', {})
+        quiz = self.canvas.add_quiz(course_id, fields.get('title', 'Untitled'),
+                                    fields.get('description', ''))
+        self._apply_fields(quiz, fields, self.QUIZ_FIELDS)
+        self.send_json(quiz)
+
+    def update_quiz(self, course_id, quiz_id):
+        quiz = self.course(course_id)['quizzes'][quiz_id]
+        self._apply_fields(quiz, self.params.get('quiz', {}), self.QUIZ_FIELDS)
+        self.send_json(quiz)
+
+    def delete_quiz(self, course_id, quiz_id):
+        course = self.course(course_id)
+        course['questions'].pop(quiz_id, None)
+        course['groups'].pop(quiz_id, None)
+        self.send_json(course['quizzes'].pop(quiz_id))
+
+    def reorder_quiz(self, course_id, quiz_id):
+        questions = self.course(course_id)['questions'][quiz_id]
+        order = (self.json_body or {}).get('order', [])
+        for position, item in enumerate(order, 1):
+            question = questions.get(int(item['id']))
+            if question is not None:
+                question['position'] = position
+        self.send_json({}, status=204)
+
+    # Quiz questions
+
+    ANSWER_FIELDS = {'answer_text': 'text', 'answer_html': 'html',
+                     'answer_comment_html': 'comments_html',
+                     'answer_weight': 'weight', 'blank_id': 'blank_id',
+                     'answer_match_left': 'left',
+                     'answer_match_right': 'right',
+                     'numerical_answer_type': 'numerical_answer_type',
+                     'answer_exact': 'exact', 'answer_error_margin': 'margin',
+                     'answer_range_start': 'start',
+                     'answer_range_end': 'end',
+                     'answer_precision': 'precision',
+                     'answer_approximate': 'approximate'}
+    QUESTION_FIELDS = ('question_name', 'question_type', 'question_text',
+                       'correct_comments_html', 'incorrect_comments_html',
+                       'neutral_comments_html',
+                       'matching_answer_incorrect_matches')
+
+    def _apply_question(self, question, fields):
+        for key in self.QUESTION_FIELDS:
+            if key in fields:
+                question[key] = fields[key]
+        if 'points_possible' in fields:
+            question['points_possible'] = as_number(fields['points_possible'])
+        if 'quiz_group_id' in fields:
+            question['quiz_group_id'] = as_number(fields['quiz_group_id'])
+        if 'answers' in fields:
+            answers = fields['answers']
+            if isinstance(answers, dict):
+                answers = [answers[k] for k in sorted(answers, key=int)]
+            question['answers'] = [
+                dict([('id', self.canvas.next_id())] +
+                     [(self.ANSWER_FIELDS.get(k, k),
+                       as_number(v) if k == 'answer_weight' else v)
+                      for k, v in answer.items()])
+                for answer in answers]
+
+    def list_questions(self, course_id, quiz_id):
+        questions = self.course(course_id)['questions'][quiz_id]
+        self.paginate(sorted(questions.values(),
+                             key=lambda q: q['position'] or 0))
+
+    def get_question(self, course_id, quiz_id, question_id):
+        self.send_json(self.course(course_id)['questions'][quiz_id][question_id])
+
+    def create_question(self, course_id, quiz_id):
+        fields = self.params.get('question', {})
+        question = self.canvas.add_question(course_id, quiz_id,
+                                            fields.get('question_name', ''),
+                                            fields.get('question_text', ''))
+        self._apply_question(question, fields)
+        self.send_json(question)
+
+    def update_question(self, course_id, quiz_id, question_id):
+        question = self.course(course_id)['questions'][quiz_id][question_id]
+        self._apply_question(question, self.params.get('question', {}))
+        self.send_json(question)
+
+    def delete_question(self, course_id, quiz_id, question_id):
+        self.course(course_id)['questions'][quiz_id].pop(question_id)
+        self.send_text(204, '')
+
+    # Quiz groups
+
+    GROUP_FIELDS = {'name': str, 'pick_count': as_number,
+                    'question_points': as_number}
+
+    def _group_fields(self):
+        groups = self.params.get('quiz_groups', [{}])
+        return groups[0] if groups else {}
+
+    def get_group(self, course_id, quiz_id, group_id):
+        self.send_json(self.course(course_id)['groups'][quiz_id][group_id])
+
+    def create_group(self, course_id, quiz_id):
+        fields = self._group_fields()
+        group = self.canvas.add_group(course_id, quiz_id,
+                                      fields.get('name', 'Group'))
+        self._apply_fields(group, fields, self.GROUP_FIELDS)
+        self.send_json({'quiz_groups': [group]})
+
+    def update_group(self, course_id, quiz_id, group_id):
+        group = self.course(course_id)['groups'][quiz_id][group_id]
+        self._apply_fields(group, self._group_fields(), self.GROUP_FIELDS)
+        self.send_json({'quiz_groups': [group]})
+
+    def delete_group(self, course_id, quiz_id, group_id):
+        self.course(course_id)['groups'][quiz_id].pop(group_id)
+        self.send_text(204, '')
+
+    # GraphQL
+
+    ASSIGNMENT_GRAPHQL = {
+        '_id': lambda a: str(a['id']), 'name': lambda a: a['name'],
+        'description': lambda a: a['description'],
+        'htmlUrl': lambda a: a['html_url'], 'published': lambda a: a['published'],
+        'pointsPossible': lambda a: a['points_possible'],
+        'gradingType': lambda a: a['grading_type'],
+        'submissionTypes': lambda a: a['submission_types'],
+        'allowedExtensions': lambda a: a['allowed_extensions'],
+        'dueAt': lambda a: graphql_date(a['due_at']),
+        'unlockAt': lambda a: graphql_date(a['unlock_at']),
+        'lockAt': lambda a: graphql_date(a['lock_at']),
+        'anonymizeStudents': lambda a: a['anonymize_students'],
+        'anonymousGrading': lambda a: a['anonymous_grading'],
+        'updatedAt': lambda a: graphql_date(a['updated_at']),
+    }
+
+    def graphql(self):
+        body = self.json_body or {}
+        variables = body.get('variables') or {}
+        try:
+            tokens = GRAPHQL_TOKENS.findall(body.get('query', ''))
+            selection, _ = parse_selection(tokens, tokens.index('{'))
+            data = self.resolve_graphql('Query', None, selection, variables)
+        except (GraphQLStubError, ValueError, IndexError) as e:
+            return self.send_json({'errors': [{'message': str(e)}]})
+        self.send_json({'data': data})
+
+    def resolve_graphql(self, type_name, value, selection, variables):
+        result = {}
+        for key, name, arguments, subselection in selection:
+            arguments = {argument: variables.get(raw[1:]) if raw.startswith('$')
+                         else raw.strip('"')
+                         for argument, raw in arguments.items()}
+            field, field_type = self.graphql_field(type_name, value, name, arguments)
+            if subselection is None or field is None:
+                result[key] = field
+            elif isinstance(field, list):
+                result[key] = [self.resolve_graphql(field_type, item, subselection,
+                                                    variables)
+                               for item in field]
+            else:
+                result[key] = self.resolve_graphql(field_type, field, subselection,
+                                                   variables)
+        return result
+
+    def graphql_field(self, type_name, value, name, arguments):
+        '''
+        Returns:
+            (object, str): The field's value and GraphQL type.
+        '''
+        if type_name == 'Query' and name == 'course':
+            return self.canvas.courses.get(int(arguments['id'])), 'Course'
+        if type_name == 'Query' and name == 'assignment':
+            for course in self.canvas.courses.values():
+                if int(arguments['id']) in course['assignments']:
+                    return course['assignments'][int(arguments['id'])], 'Assignment'
+            return None, 'Assignment'
+        if type_name == 'Course' and name == 'assignmentsConnection':
+            items = list(value['assignments'].values())
+            start = int(arguments.get('after') or 0)
+            end = start + min(int(arguments.get('first') or 10), self.canvas.per_page)
+            return {'nodes': items[start:end],
+                    'pageInfo': {'hasNextPage': end < len(items),
+                                 'endCursor': str(end)}}, 'AssignmentConnection'
+        if type_name == 'AssignmentConnection' and name in ('nodes', 'pageInfo'):
+            return value[name], 'Assignment' if name == 'nodes' else 'PageInfo'
+        if type_name == 'PageInfo' and name in ('hasNextPage', 'endCursor'):
+            return value[name], None
+        if type_name == 'Assignment' and name in self.ASSIGNMENT_GRAPHQL:
+            return self.ASSIGNMENT_GRAPHQL[name](value), None
+        if type_name == 'Assignment' and name == 'quiz':
+            quiz_id = value.get('quiz_id')
+            return ({'_id': str(quiz_id)} if quiz_id else None), 'Quiz'
+        if type_name == 'Quiz' and name == '_id':
+            return value['_id'], None
+        raise GraphQLStubError("Field '{}' doesn't exist on type '{}'".format(
+            name, type_name))
+
+    # Files
+
+    def file_json(self, record):
+        '''A file's record, with a download URL that points at this server.'''
+        return dict(record, url='http://{}:{}/api/v1/files/{}/download'.format(
+            self.server.server_address[0], self.server.server_address[1],
+            record['id']))
+
+    def list_files(self, course_id):
+        files = [self.file_json(record)
+                 for record in self.course(course_id)['files'].values()]
+        self.paginate(self.search(files, 'display_name'))
+
+    def get_file(self, file_id):
+        self.send_json(self.file_json(self.canvas.files[file_id]))
+
+    def download_file(self, file_id):
+        body = self.canvas.file_contents[file_id]
+        self.send_response(200)
+        self.send_header('Content-Type', self.canvas.files[file_id]['content-type'])
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in self.extra_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def list_folders(self, course_id):
+        folders = self.course(course_id)['folders']
+        self.paginate([{'id': id, 'name': full_name.rsplit('/', 1)[-1],
+                        'full_name': full_name}
+                       for full_name, id in folders.items()])
+
+    def start_upload(self, course_id):
+        token = self.canvas.next_id()
+        self.canvas.uploads[token] = {
+            'course_id': course_id, 'name': self.flat['name'],
+            'content_type': self.flat.get('content_type', 'application/octet-stream'),
+            'folder': self.flat.get('parent_folder_path', 'course files'),
+        }
+        upload_url = 'http://{}:{}/api/v1/files/uploads/{}'.format(
+            self.server.server_address[0], self.server.server_address[1], token)
+        self.send_json({'upload_url': upload_url,
+                        'upload_params': {'filename': self.flat['name']}})
+
+    def finish_upload(self, token):
+        ticket = self.canvas.uploads.pop(token)
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode('ascii') +
+            b'\r\n\r\n' + self.body)
+        data = b''
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'file':
+                data = part.get_payload(decode=True)
+        record = self.canvas.add_file(ticket['course_id'], ticket['name'], data,
+                                      ticket['content_type'], ticket['folder'])
+        # Canvas confirms an upload by redirecting to the new file
+        self.send_response(302)
+        self.send_header('Location', 'http://{}:{}/api/v1/files/{}'.format(
+            self.server.server_address[0], self.server.server_address[1],
+            record['id']))
+        self.send_header('Content-Length', '0')
+        for key, value in self.extra_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
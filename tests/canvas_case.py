@@ -0,0 +1,59 @@
+'''
+Shared fixture for the tests that talk to Canvas: every test gets its own
+FakeCanvas with one empty course, and a temporary course directory whose
+settings point Waltz at it.
+'''
+import argparse
+import contextlib
+import unittest
+
+from benchmarks.fake_canvas import FakeCanvas
+from benchmarks.common import waltz_sandbox, quietly
+
+COURSE_ID = 1
+COURSE_NAME = 'test'
+
+# The defaults of every command line argument (see waltz/__main__.py)
+ARGUMENTS = dict(verb='pull', course=None, all_courses=False, jobs=None,
+                 settings=None, id=None, destination=None, format='raw',
+                 ignore=True, quiet=True, snapshot=None, debounce=1.0,
+                 poll=False, plan=None, apply=None, offset=None, mapping=None,
+                 queue=False, daemon=None, port=8765)
+
+
+def make_args(**arguments):
+    return argparse.Namespace(**dict(ARGUMENTS, **arguments))
+
+
+class CanvasTestCase(unittest.TestCase):
+    latency = 0
+
+    def setUp(self):
+        # waltz.resources has to be imported before waltz.quizzes
+        import waltz.resources  # noqa: F401
+        from waltz.quizzes import QuizQuestion
+        QuizQuestion.CACHE.clear()
+        self.server = FakeCanvas(latency=self.latency)
+        self.server.add_course(COURSE_ID, COURSE_NAME)
+        self.stack = contextlib.ExitStack()
+        self.stack.enter_context(self.server)
+        self.destination = self.stack.enter_context(
+            waltz_sandbox(self.server, COURSE_NAME, COURSE_ID))
+        self.stack.enter_context(quietly())
+        self.courses = []
+
+    def tearDown(self):
+        for course in self.courses:
+            course.index.close()
+        self.stack.close()
+
+    @property
+    def canvas(self):
+        return self.server.courses[COURSE_ID]
+
+    def make_course(self):
+        '''Opens the sandboxed course, closing its index after the test.'''
+        from waltz.resources import Course
+        course = Course(self.destination, COURSE_NAME)
+        self.courses.append(course)
+        return course
@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import waltz.canvas_tools as canvas_tools
+from waltz.canvas_tools import send, MultipartStream
+
+from canvas_case import CanvasTestCase, COURSE_ID, make_args
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, url):
+        self.url = url
+
+
+class TestRequestLimiter(unittest.TestCase):
+    def setUp(self):
+        self.previous = canvas_tools.request_limiter
+        canvas_tools.request_limiter = threading.BoundedSemaphore(3)
+
+    def tearDown(self):
+        canvas_tools.request_limiter = self.previous
+
+    def test_nested_pools_share_the_limit(self):
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def verb(url):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return Response(url)
+
+        def outer(index):
+            with ThreadPoolExecutor(4) as inner:
+                return list(inner.map(lambda number: send(verb, number), range(4)))
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(outer, range(4)))
+        self.assertEqual([[response.url for response in responses]
+                          for responses in results], [list(range(4))] * 4)
+        self.assertEqual(in_flight[1], 3)
+
+
+class TestMultipartStream(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(3 * 1024 + 17)
+        self.sent = []
+        self.stream = MultipartStream({'key': 'value'}, 'data "1".bin', self.data,
+                                      'application/octet-stream', len(self.data),
+                                      on_read=self.sent.append)
+        self.stream.block_size = 1024
+
+    def read_all(self, size):
+        chunks = []
+        while True:
+            chunk = self.stream.read(size)
+            if not chunk:
+                return chunks
+            chunks.append(chunk)
+
+    def test_reading_everything_still_goes_a_block_at_a_time(self):
+        chunks = self.read_all(-1)
+        self.assertGreater(len(chunks), 3)
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+        self.assertEqual(sum(map(len, chunks)), len(self.stream))
+        self.assertEqual(sum(self.sent), len(self.data))
+
+    def test_body_is_valid_multipart(self):
+        body = b''.join(self.read_all(500))
+        self.assertEqual(len(body), len(self.stream))
+        boundary = self.stream.boundary.encode('ascii')
+        parts = body.split(b'--'+boundary)
+        self.assertEqual(parts[-1], b'--\r\n')
+        self.assertIn(b'name="key"\r\n\r\nvalue\r\n', parts[1])
+        head, content = parts[2].split(b'\r\n\r\n', 1)
+        self.assertIn(b'filename="data %221%22.bin"', head)
+        self.assertEqual(content, self.data+b'\r\n')
+
+
+class TestSeveralCourses(CanvasTestCase):
+    def test_failed_course_exits_nonzero(self):
+        from waltz.yaml_setup import yaml
+        from waltz.canvas_tools import load_settings
+        from waltz.sync import main
+        self.server.add_page(COURSE_ID, 'Lesson 1', '<p>Body</p>')
+        settings_path = os.path.join(os.path.dirname(os.path.dirname(
+            self.destination)), 'settings', 'settings.yaml')
+        with open(settings_path) as settings_file:
+            settings = yaml.load(settings_file)
+        # A course that FakeCanvas does not have
+        settings['courses']['missing'] = {'id': 999}
+        with open(settings_path, 'w') as settings_file:
+            yaml.dump(settings, settings_file)
+        load_settings(settings_path)
+        args = make_args(verb='pull', all_courses=True, settings=settings_path,
+                         id=['pages/*'], jobs=2,
+                         destination=os.path.dirname(self.destination))
+        with self.assertRaises(SystemExit) as exit:
+            main(args)
+        self.assertIn('missing', str(exit.exception.code))
+        self.assertTrue(os.path.isdir(os.path.join(self.destination, 'pages')))
+
+
+if __name__ == '__main__':
+    unittest.main()
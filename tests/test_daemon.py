@@ -0,0 +1,87 @@
+import os
+import json
+import stat
+import tempfile
+import time
+import threading
+import unittest
+
+import requests
+
+from waltz.daemon import WaltzDaemon, token_path, job_options
+
+from canvas_case import CanvasTestCase, COURSE_ID, make_args
+
+
+class TestWaltzDaemon(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.add_page(COURSE_ID, 'Lesson 1', '<p>One</p>')
+        self.settings = os.path.join(os.path.dirname(os.path.dirname(self.destination)),
+                                     'settings', 'settings.yaml')
+        self.daemon = WaltzDaemon(self.settings, port=0, max_finished=2)
+        self.thread = threading.Thread(target=self.daemon.serve_forever, daemon=True)
+        self.thread.start()
+        while self.daemon.token is None:
+            time.sleep(0.01)
+        with open(token_path(self.settings)) as token_file:
+            self.headers = {'Authorization': 'Bearer '+token_file.read()}
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join(10)
+        super().tearDown()
+
+    def post_job(self, **options):
+        job = requests.post(self.daemon.url+'jobs', json=options,
+                            headers=self.headers).json()
+        events = requests.get('{}jobs/{}/events'.format(self.daemon.url, job['id']),
+                              headers=self.headers)
+        return [json.loads(line) for line in events.text.splitlines()][-1]
+
+    def test_token_is_private_and_required(self):
+        self.assertEqual(stat.S_IMODE(os.stat(token_path(self.settings)).st_mode), 0o600)
+        for headers in ({}, {'Authorization': 'Bearer wrong'}):
+            self.assertEqual(requests.get(self.daemon.url+'status',
+                                          headers=headers).status_code, 401)
+            self.assertEqual(requests.post(self.daemon.url+'jobs', json={'verb': 'pull'},
+                                           headers=headers).status_code, 401)
+        self.assertEqual(requests.get(self.daemon.url+'status',
+                                      headers=self.headers).status_code, 200)
+
+    def test_posts_must_be_json(self):
+        response = requests.post(self.daemon.url+'jobs', data='{"verb": "pull"}',
+                                 headers=dict(self.headers, **{
+                                     'Content-Type': 'text/plain'}))
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(requests.get(self.daemon.url+'jobs',
+                                      headers=self.headers).json(), [])
+
+    def test_jobs_run_in_the_clients_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            before = os.getcwd()
+            os.chdir(directory)
+            try:
+                options = job_options(make_args(id=['pages/?Lesson 1'],
+                                                course=['test']))
+            finally:
+                os.chdir(before)
+            self.assertEqual(options['cwd'], directory)
+            event = self.post_job(**options)
+            self.assertEqual(event['type'], 'done', event)
+            self.assertTrue(os.path.exists(os.path.join(
+                directory, 'courses', 'test', 'pages', 'Lesson 1.md')))
+
+    def test_old_finished_jobs_are_forgotten(self):
+        for attempt in range(4):
+            event = self.post_job(verb='pull', id=['pages/?Nope'],
+                                  destination=self.destination, ignore=True)
+            self.assertEqual(event['type'], 'failed')
+        jobs = requests.get(self.daemon.url+'jobs', headers=self.headers).json()
+        self.assertEqual([job['id'] for job in jobs], ['3', '4'])
+        self.assertEqual(requests.get(self.daemon.url+'jobs/1',
+                                      headers=self.headers).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
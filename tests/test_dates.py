@@ -0,0 +1,67 @@
+import os
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from waltz.resources import WaltzException
+from waltz.dates import parse_offset, shift_dates
+
+from canvas_case import CanvasTestCase, COURSE_ID, COURSE_NAME
+
+
+class TestParseOffset(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(parse_offset('+16w'), timedelta(weeks=16))
+        self.assertEqual(parse_offset('7'), timedelta(days=7))
+        self.assertEqual(parse_offset('2d 3h 15m'),
+                         timedelta(days=2, hours=3, minutes=15))
+
+    def test_negative_applies_to_every_part(self):
+        self.assertEqual(parse_offset('-3d 2h'), -timedelta(days=3, hours=2))
+
+    def test_nonsense(self):
+        for text in ('', 'soon', '3 days', '+2y'):
+            with self.assertRaises(WaltzException):
+                parse_offset(text)
+
+
+class TestShiftDates(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        from waltz.sync import pull_all_resources
+        self.assignment = self.server.add_assignment(
+            COURSE_ID, 'Project 1', '<p>Build it.</p>', due_at='2020-09-01T03:59:00Z')
+        self.server.add_assignment(COURSE_ID, 'Reading', '<p>Read it.</p>')
+        pull_all_resources('assignments/*', 'raw', self.destination, COURSE_NAME, True)
+        self.course = self.make_course()
+        self.path = os.path.join(self.destination, 'assignments', 'Project 1.yaml')
+
+    def test_retry_after_canvas_failure_shifts_once(self):
+        with open(self.path) as assignment_file:
+            original = assignment_file.read()
+        with mock.patch('waltz.dates.put', return_value={'errors': ['down']}):
+            with self.assertRaises(WaltzException):
+                shift_dates(self.course, parse_offset('+1w'))
+        with open(self.path) as assignment_file:
+            self.assertEqual(assignment_file.read(), original)
+        self.assertEqual(shift_dates(self.course, parse_offset('+1w')), 1)
+        self.assertEqual(self.canvas['assignments'][self.assignment['id']]['due_at'],
+                         '2020-09-08T03:59:00Z')
+        with open(self.path) as assignment_file:
+            self.assertNotEqual(assignment_file.read(), original)
+
+    def test_only_changed_files_are_written(self):
+        undated = os.path.join(self.destination, 'assignments', 'Reading.yaml')
+        with mock.patch.object(self.course, 'write_file',
+                               wraps=self.course.write_file) as write_file:
+            self.assertEqual(shift_dates(self.course, parse_offset('+1w')), 1)
+            # Dates the mapping does not cover are left alone
+            self.assertEqual(shift_dates(self.course, mapping={}), 0)
+        written = [call[0][0] for call in write_file.call_args_list]
+        # Besides the recorded Canvas state, only the dated file was written
+        self.assertEqual([path for path in written if path.endswith('.yaml')], [self.path])
+        self.assertNotIn(undated, written)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+from xml.etree import ElementTree
+
+from markdown import Markdown
+
+from waltz.html_markdown_utilities import m2h
+from waltz.document_processor import DocumentExtension
+
+
+class TestDocumentProcessor(unittest.TestCase):
+    def test_header_ids_are_unique_within_each_document(self):
+        self.assertEqual(m2h('# Intro\n\n# Intro\n').split('\n'),
+                         ['<h1 id="intro">Intro</h1>', '<h1 id="intro_1">Intro</h1>'])
+        # A later document starts over
+        self.assertEqual(m2h('# Intro\n'), '<h1 id="intro">Intro</h1>')
+
+    def test_nested_tables_are_decorated(self):
+        md = Markdown(extensions=[DocumentExtension(table_class='table')])
+        root = ElementTree.fromstring('<div><div><table><tr><td><table/></td></tr>'
+                                      '</table></div><h2>Results</h2></div>')
+        md.treeprocessors['document'].run(root)
+        self.assertEqual([table.get('class') for table in root.iter('table')],
+                         ['table', 'table'])
+        self.assertEqual(root.find('h2').get('id'), 'results')
+
+
+if __name__ == '__main__':
+    unittest.main()
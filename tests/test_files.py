@@ -0,0 +1,52 @@
+import os
+import unittest
+from unittest import mock
+
+import waltz.files
+from waltz.files import Progress, push_files, pull_files
+from waltz.utilities import global_settings
+
+from canvas_case import CanvasTestCase
+
+
+class TestProgress(unittest.TestCase):
+    def test_lines_are_logged_without_tqdm(self):
+        lines = []
+        with mock.patch.object(waltz.files, 'tqdm', None), \
+                mock.patch.object(waltz.files, 'log', lambda *args: lines.append(args)), \
+                mock.patch.dict(global_settings, {'quiet': False}):
+            progress = Progress("Uploading", 2, 100)
+            progress.advance(50)
+            progress.done('a.txt')
+            progress.done('b.txt')
+            progress.close()
+        self.assertIsNone(progress.bar)
+        self.assertEqual(lines, [("Finished", "uploading", "1/2:", "a.txt"),
+                                 ("Finished", "uploading", "2/2:", "b.txt")])
+
+
+class TestFiles(CanvasTestCase):
+    def test_round_trip(self):
+        self.stack.enter_context(mock.patch.dict(global_settings, {'quiet': True}))
+        folder = os.path.join(self.destination, 'files', 'data')
+        os.makedirs(folder)
+        contents = {}
+        for index in range(3):
+            contents['data {}.bin'.format(index)] = os.urandom(1024 * (index+1))
+            with open(os.path.join(folder, 'data {}.bin'.format(index)), 'wb') as out:
+                out.write(contents['data {}.bin'.format(index)])
+        course = self.make_course()
+        self.assertEqual(push_files(course), 3)
+        self.assertEqual(push_files(course), 0)
+        self.assertEqual(sorted(self.server.file_contents.values()),
+                         sorted(contents.values()))
+        for name in contents:
+            os.remove(os.path.join(folder, name))
+        self.assertEqual(pull_files(course), 3)
+        for name, data in contents.items():
+            with open(os.path.join(folder, name), 'rb') as pulled:
+                self.assertEqual(pulled.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
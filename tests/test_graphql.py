@@ -0,0 +1,88 @@
+import unittest
+from unittest import mock
+from collections import OrderedDict
+
+import waltz.canvas_tools
+import waltz.graphql_backend
+from waltz.resources import Assignment
+from waltz.graphql_backend import BATCH_SIZE, get_resources, iter_resource_pages
+
+from canvas_case import CanvasTestCase, COURSE_ID
+
+
+class TestGraphQLBackend(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        self.assignments = [self.server.add_assignment(
+            COURSE_ID, 'Project {}'.format(index), '<p>Do it</p>')
+            for index in range(5)]
+        self.assignments[0]['due_at'] = '2020-02-01T04:59:00Z'
+        self.stack.enter_context(mock.patch.dict(
+            waltz.canvas_tools.defaults, {'fetch-backend': 'graphql'}))
+        self.course = self.make_course()
+        self.server.request_log.clear()
+
+    def listing(self):
+        return list(Assignment.iter_resources_on_canvas(self.course))
+
+    def test_fields_are_translated_to_rest(self):
+        first = self.assignments[0]
+        found = get_resources(self.course, Assignment, [first['id']])
+        result = found[str(first['id'])]
+        self.assertEqual(result['id'], first['id'])
+        self.assertEqual(result['name'], 'Project 0')
+        # GraphQL's offset dates come back in UTC, like REST's
+        self.assertEqual(result['due_at'], '2020-02-01T04:59:00Z')
+        self.assertIsNone(result['lock_at'])
+        self.assertEqual(result['submission_types'], ['online_upload'])
+        self.assertEqual(set(result), set(Assignment.graphql_fields))
+
+    def test_lookups_are_batched(self):
+        for index in range(BATCH_SIZE):
+            self.server.add_assignment(COURSE_ID, 'Extra {}'.format(index), '')
+        ids = list(self.canvas['assignments'])
+        found = get_resources(self.course, Assignment, ids + [99999])
+        self.assertEqual(len(found), len(ids))
+        self.assertEqual(dict(self.server.request_log), {('POST', 'graphql'): 2})
+
+    def test_listing_takes_a_request_per_page(self):
+        self.server.per_page = 2
+        self.assertEqual(len(self.listing()), 5)
+        self.assertEqual(dict(self.server.request_log), {('POST', 'graphql'): 3})
+
+    def test_searches_use_rest(self):
+        found = Assignment.find_resource_on_canvas(self.course, 'Project 3')
+        self.assertEqual([data['name'] for data in found], ['Project 3'])
+        self.assertEqual(dict(self.server.request_log),
+                         {('GET', 'list_assignments'): 1})
+
+    def test_unknown_fields_fall_back_to_rest(self):
+        fields = OrderedDict(Assignment.graphql_fields, bogus='bogusField')
+        with mock.patch.object(Assignment, 'graphql_fields', fields):
+            self.assertIsNone(iter_resource_pages(self.course, Assignment))
+            self.assertIsNone(get_resources(self.course, Assignment,
+                                            [self.assignments[0]['id']]))
+            self.assertEqual(len(self.listing()), 5)
+        self.assertEqual(self.server.request_log[('GET', 'list_assignments')], 1)
+
+    def test_later_pages_fall_back_to_rest(self):
+        self.server.per_page = 2
+        post = waltz.graphql_backend.post_graphql
+        calls = []
+
+        def failing_later(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                return {'errors': [{'message': 'Rate limited'}]}
+            return post(*args, **kwargs)
+        with mock.patch.object(waltz.graphql_backend, 'post_graphql', failing_later):
+            names = [data['name'] for data in self.listing()]
+        self.assertEqual(sorted(names), ['Project {}'.format(index) for index in range(5)])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.server.request_log[('GET', 'list_assignments')], 3)
+        # The listing was complete, so the index knows it
+        self.assertTrue(self.course.index.is_listed(Assignment))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import waltz.canvas_tools
+import waltz.resources  # noqa: F401
+from waltz.resources import Course, WaltzException
+from waltz.highlight_cache import HighlightCache
+from waltz.html_markdown_utilities import m2h
+
+from canvas_case import CanvasTestCase
+
+DOCUMENT = '''# Lesson
+
+```python
+def double(x):
+    return x * 2
+```
+
+Some text.
+
+    print("indented")
+'''
+
+
+class TestHighlightCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.course = Course(self.directory.name, 'test')
+        self.path = os.path.join(self.directory.name, '_cache', 'highlight.sqlite')
+
+    def tearDown(self):
+        self.course.stop_caching_highlighting()
+        self.course.index.close()
+        self.directory.cleanup()
+
+    def convert(self):
+        if self.course.highlight_cache is None:
+            self.course.highlight_cache = HighlightCache(self.path)
+        return m2h(DOCUMENT, self.course)
+
+    def test_second_conversion_is_served_from_the_cache(self):
+        first = self.convert()
+        cache = self.course.highlight_cache
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(self.convert(), first)
+        self.assertEqual(cache.hits, 2)
+
+    def test_cache_survives_closing(self):
+        first = self.convert()
+        self.course.stop_caching_highlighting()
+        self.assertEqual(self.convert(), first)
+        self.assertEqual(self.course.highlight_cache.hits, 2)
+
+    def test_cached_output_matches_uncached_output(self):
+        expected = m2h(DOCUMENT)
+        self.assertIn('codehilite', expected)
+        self.assertEqual(self.convert(), expected)
+        self.assertEqual(self.convert(), expected)
+
+    def test_classes_mode_strips_unstyled_spans(self):
+        self.course.highlight_settings['mode'] = 'classes'
+        uncached = Course(self.directory.name, 'test')
+        uncached.highlight_settings['mode'] = 'classes'
+        expected = m2h(DOCUMENT, uncached)
+        uncached.index.close()
+        self.assertIn('class="k"', expected)
+        # Punctuation has no style of its own, so it gets no span
+        self.assertIn('(x):', expected)
+        self.assertNotIn('<span class="p">', expected)
+        self.assertEqual(self.convert(), expected)
+        self.assertEqual(self.convert(), expected)
+        self.assertEqual(self.course.highlight_cache.hits, 2)
+
+    def test_courses_keep_separate_caches(self):
+        self.convert()
+        other = Course(self.directory.name, 'other')
+        try:
+            self.assertIsNone(other.highlight_cache)
+            self.assertEqual(m2h(DOCUMENT, other), m2h(DOCUMENT, self.course))
+        finally:
+            other.index.close()
+
+
+class TestHighlightSettings(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.courses = [Course(self.directory.name, name)
+                        for name in ('inline', 'classes')]
+
+    def tearDown(self):
+        for course in self.courses:
+            course.index.close()
+        self.directory.cleanup()
+
+    def test_each_course_highlights_its_own_way(self):
+        inline, classes = self.courses
+        classes.highlight_settings['mode'] = 'classes'
+        self.assertIn('style="', m2h(DOCUMENT, inline))
+        self.assertNotIn('style="', m2h(DOCUMENT, classes))
+        # Without a course, code is highlighted inline
+        self.assertEqual(m2h(DOCUMENT), m2h(DOCUMENT, inline))
+        self.assertEqual(inline.highlight_settings['mode'], 'inline')
+
+    def test_stylesheet_is_only_pushed_in_classes_mode(self):
+        self.assertFalse(self.courses[0].push_stylesheet())
+
+
+class TestHighlightMode(CanvasTestCase):
+    def set_mode(self, **settings):
+        with mock.patch.dict(waltz.canvas_tools.defaults, settings):
+            course = self.make_course()
+            return course, course.set_highlight_mode()
+
+    def test_classes_need_the_theme(self):
+        with self.assertRaisesRegex(WaltzException, 'highlight-theme-applied'):
+            self.set_mode(**{'highlight-mode': 'classes'})
+        # The stylesheet is left for the admin to add to the theme
+        self.assertTrue(os.path.exists(os.path.join(self.destination, '_styles',
+                                                    'highlight.css')))
+        course, mode = self.set_mode(**{'highlight-mode': 'classes',
+                                        'highlight-theme-applied': True})
+        self.assertEqual((mode, course.highlight_settings['mode']), ('classes', 'classes'))
+
+    def test_inline_needs_nothing(self):
+        course, mode = self.set_mode()
+        self.assertEqual(mode, 'inline')
+
+
+if __name__ == '__main__':
+    unittest.main()
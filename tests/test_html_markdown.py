@@ -0,0 +1,19 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from waltz.html_markdown_utilities import h2m
+
+DOCUMENTS = ['<h2>Lesson {0}</h2><p>Some <em>text</em> for lesson {0}.</p>'
+             '<ul><li>One</li><li>Two</li></ul>'.format(index)
+             for index in range(40)]
+
+
+class TestH2M(unittest.TestCase):
+    def test_threads_convert_like_one_thread(self):
+        expected = [h2m(document) for document in DOCUMENTS]
+        with ThreadPoolExecutor(8) as pool:
+            self.assertEqual(list(pool.map(h2m, DOCUMENTS)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
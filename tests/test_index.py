@@ -0,0 +1,74 @@
+import unittest
+
+from waltz.resources import ResourceID, WaltzException, WaltzNoResourceFound, Page
+
+from canvas_case import CanvasTestCase, COURSE_ID
+
+
+class TestResourceIndex(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lesson = self.server.add_page(COURSE_ID, 'Lesson 1', '<p>One</p>')
+        self.server.add_page(COURSE_ID, 'Lesson 10', '<p>Ten</p>')
+        self.loops = self.server.add_page(COURSE_ID, 'Lesson 2: Loops', '<p>Two</p>')
+        self.course = self.make_course()
+
+    def list_pages(self):
+        return list(Page.iter_resources_on_canvas(self.course))
+
+    def resolve(self, raw):
+        self.server.request_log.clear()
+        resource_id = ResourceID(self.course, raw)
+        resource_id.canvas_title
+        return resource_id
+
+    def test_names_are_searched_until_the_category_is_listed(self):
+        # A search only records what it found, which proves nothing missing
+        Page.find_resource_on_canvas(self.course, 'Lesson 10')
+        self.assertFalse(self.course.index.is_listed(Page))
+        with self.assertRaisesRegex(WaltzNoResourceFound, 'Ambiguous'):
+            self.resolve('pages/?Lesson 1')
+        self.assertEqual(dict(self.server.request_log), {('GET', 'list_pages'): 1})
+
+    def test_names_are_answered_from_the_index_after_a_listing(self):
+        self.list_pages()
+        self.assertTrue(self.course.index.is_listed(Page))
+        # Matched like a search on Canvas, before and after the listing
+        with self.assertRaisesRegex(WaltzNoResourceFound, 'Ambiguous'):
+            self.resolve('pages/?lesson 1')
+        loops = self.resolve('pages/?Loops')
+        self.assertEqual(loops.canvas_title, 'Lesson 2: Loops')
+        self.assertEqual(dict(self.server.request_log), {})
+        # The body is fetched once, when it is needed
+        self.assertEqual(loops.canvas_data['body'], '<p>Two</p>')
+        self.assertEqual(loops.canvas_data['body'], '<p>Two</p>')
+        self.assertEqual(dict(self.server.request_log), {('GET', 'get_page'): 1})
+
+    def test_new_names_are_searched_on_canvas(self):
+        self.list_pages()
+        self.server.add_page(COURSE_ID, 'Lesson 3: Recursion', '<p>Three</p>')
+        self.assertEqual(self.resolve('pages/?Recursion').canvas_title,
+                         'Lesson 3: Recursion')
+        with self.assertRaisesRegex(WaltzException, 'already exists'):
+            self.resolve('pages/+Lesson 10')
+        self.assertEqual(dict(self.server.request_log), {('GET', 'list_pages'): 1})
+
+    def test_deleted_resources_can_be_created_again(self):
+        self.list_pages()
+        del self.canvas['pages'][self.loops['url']]
+        self.assertIs(self.resolve('pages/+Lesson 2: Loops').canvas_data, True)
+        with self.assertRaisesRegex(WaltzNoResourceFound, 'deleted'):
+            self.resolve('pages/?Loops').canvas_data
+        self.assertEqual(self.course.index.find(Page, 'Loops'), [])
+
+    def test_renamed_resources_are_not_trusted(self):
+        self.list_pages()
+        self.canvas['pages'][self.loops['url']]['title'] = 'Lesson 2: Recursion'
+        with self.assertRaisesRegex(WaltzNoResourceFound, 'renamed'):
+            self.resolve('pages/?Loops').canvas_data
+        self.assertEqual(self.course.index.find(Page, 'Recursion')[0]['url'],
+                         self.loops['url'])
+
+
+if __name__ == '__main__':
+    unittest.main()
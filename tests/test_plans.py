@@ -0,0 +1,83 @@
+import os
+import unittest
+
+from waltz.resources import WaltzNoResourceFound, Page
+from waltz.plans import plan_push, find_known_state
+
+from canvas_case import CanvasTestCase, COURSE_ID, COURSE_NAME
+
+
+class TestPlans(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        from waltz.sync import pull_all_resources
+        self.lesson = self.server.add_page(COURSE_ID, 'Lesson 1', '<p>One</p>')
+        self.server.add_page(COURSE_ID, 'Lesson 10', '<p>Ten</p>')
+        self.server.add_page(COURSE_ID, 'Lesson 2: Loops', '<p>Two</p>')
+        pull_all_resources('pages/*', 'raw', self.destination, COURSE_NAME, True)
+        self.course = self.make_course()
+
+    def test_names_resolve_like_a_push(self):
+        # Like a Canvas search_term, names match every title containing them
+        with self.assertRaises(WaltzNoResourceFound):
+            find_known_state(self.course, 'pages/?Lesson 1')
+        self.assertEqual(find_known_state(self.course, 'pages/?2: Loops')['title'],
+                         'Lesson 2: Loops')
+        self.assertEqual(find_known_state(self.course, 'pages/:'+self.lesson['url'])['title'],
+                         'Lesson 1')
+
+    def test_local_files_match_by_filename(self):
+        before = self.server.request_count
+        plan = plan_push(self.course, 'pages/*')
+        self.assertEqual(self.server.request_count, before)
+        self.assertEqual(len(plan.resources), 3)
+
+    def test_apply_records_canvas_state(self):
+        path = os.path.join(self.destination, 'pages', 'Lesson 1.md')
+        with open(path, 'w') as page_file:
+            page_file.write('Changed')
+        plan = plan_push(self.course, 'pages/:'+self.lesson['url'])
+        plan.apply(self.course)
+        state = self.course.load_canvas_state(Page, 'Lesson 1.md')
+        self.assertIn('Changed', state['body'])
+        self.assertEqual(state['body'], self.canvas['pages'][self.lesson['url']]['body'])
+
+
+class TestQuizPlans(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        from waltz.sync import pull_all_resources
+        self.quiz = self.server.add_quiz(COURSE_ID, 'Exam', '<p>Exam</p>')
+        self.server.add_question(COURSE_ID, self.quiz['id'], 'Q1', '<p>One?</p>',
+                                 answers=[{'text': 'Yes', 'html': '', 'comments': '',
+                                           'comments_html': '', 'weight': 100}])
+        pull_all_resources('quizzes/*', 'raw', self.destination, COURSE_NAME, True)
+        self.course = self.make_course()
+
+    def operations(self, plan):
+        return [(operation['verb'], operation['description'])
+                for resource in plan.resources for operation in resource.operations]
+
+    def test_applied_questions_are_not_planned_again(self):
+        path = os.path.join(self.destination, 'quizzes', 'Exam.yaml')
+        with open(path) as quiz_file:
+            text = quiz_file.read()
+        with open(path, 'w') as quiz_file:
+            quiz_file.write(text + text[text.index('- question_name'):].replace('Q1', 'Q2'))
+        plan = plan_push(self.course, 'quizzes/*')
+        self.assertIn(('POST', 'Create question Q2'), self.operations(plan))
+        plan.apply(self.course)
+        # The recorded state now has both questions, so nothing is created
+        again = plan_push(self.course, 'quizzes/*')
+        self.assertEqual(self.operations(again), [('PUT', 'Update quizzes Exam'),
+                                                  ('PUT', 'Update question Q1'),
+                                                  ('PUT', 'Update question Q2')])
+        self.assertEqual(again.resources[0].operations[0]['changes'], [])
+        again.apply(self.course)
+        self.assertEqual(sorted(question['question_name'] for question in
+                                self.canvas['questions'][self.quiz['id']].values()),
+                         ['Q1', 'Q2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
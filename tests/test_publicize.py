@@ -0,0 +1,69 @@
+import os
+import unittest
+import multiprocessing
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+
+import waltz.canvas_tools
+import waltz.publicize
+from waltz.resources import WaltzNoResourceFound
+from waltz.publicize import publicize_all, publicize_file
+
+from canvas_case import CanvasTestCase, COURSE_ID, COURSE_NAME
+
+
+class RecordingPool(ProcessPoolExecutor):
+    sizes = []
+
+    def __init__(self, max_workers=None, **kwargs):
+        RecordingPool.sizes.append(max_workers)
+        super().__init__(max_workers=max_workers, **kwargs)
+
+
+class SpawningPool(ProcessPoolExecutor):
+    '''Starts fresh interpreters, as Windows and macOS do.'''
+    def __init__(self, max_workers=None, **kwargs):
+        kwargs['mp_context'] = multiprocessing.get_context('spawn')
+        super().__init__(max_workers=max_workers, **kwargs)
+
+
+class TestPublicize(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        from waltz.sync import pull_all_resources
+        quiz = self.server.add_quiz(COURSE_ID, 'Quiz 1', '<p>First</p>')
+        self.server.add_question(COURSE_ID, quiz['id'], 'Question 1', '<p>Why?</p>',
+                                 answers=[{'text': 'Because', 'html': '',
+                                           'comments': '', 'comments_html': '',
+                                           'weight': 100}])
+        pull_all_resources('quizzes/*', 'raw', self.destination, COURSE_NAME, True)
+        self.course = self.make_course()
+        self.path = os.path.join(self.destination, 'quizzes', 'Quiz 1.yaml')
+        RecordingPool.sizes = []
+
+    def test_unchanged_sources_are_skipped(self):
+        self.assertEqual(publicize_all(self.course, 'quizzes/*', jobs=1), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.destination, 'quizzes',
+                                                    'Quiz 1.public.yaml')))
+        self.assertEqual(publicize_all(self.course, 'quizzes/*', jobs=1), 0)
+
+    def test_missing_file_names_the_resource(self):
+        missing = os.path.join(self.destination, 'quizzes', 'Quiz 2.yaml')
+        with self.assertRaisesRegex(WaltzNoResourceFound, 'quizzes/\\?Quiz 2'):
+            publicize_file(self.course, 'quizzes', missing)
+
+    def test_pool_size_comes_from_its_own_setting(self):
+        with mock.patch.object(waltz.publicize, 'ProcessPoolExecutor', RecordingPool), \
+                mock.patch.dict(waltz.canvas_tools.defaults, {'publicize-workers': 2}):
+            publicize_all(self.course, 'quizzes/*')
+        self.assertEqual(RecordingPool.sizes, [2])
+
+    def test_spawned_workers_load_the_settings(self):
+        with mock.patch.object(waltz.publicize, 'ProcessPoolExecutor', SpawningPool):
+            self.assertEqual(publicize_all(self.course, 'quizzes/*', jobs=1), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.destination, 'quizzes',
+                                                    'Quiz 1.public.yaml')))
+
+
+if __name__ == '__main__':
+    unittest.main()
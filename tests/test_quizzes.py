@@ -0,0 +1,78 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import waltz.resources  # noqa: F401
+from waltz.quizzes import QUESTION_TYPES, QuizQuestion, Quiz
+
+
+def make_question(name='Q1', text='<p>What is 1 + 1?</p>'):
+    question_type = QUESTION_TYPES['multiple_choice_question']
+    return question_type(course=None, question_name=name, question_text=text,
+                         quiz_group_id=None, points_possible=1,
+                         correct_comments_html='', incorrect_comments_html='',
+                         neutral_comments_html='',
+                         answers=[{'text': '2', 'html': '', 'comments': '',
+                                   'comments_html': '', 'weight': 100}])
+
+
+class TestQuestionFingerprints(unittest.TestCase):
+    def test_content_ignores_name(self):
+        self.assertEqual(make_question('Q1').content_fingerprint,
+                         make_question('Q2').content_fingerprint)
+        self.assertNotEqual(make_question('Q1'), make_question('Q2'))
+
+    def test_equality_follows_changes(self):
+        first, second = make_question(), make_question()
+        self.assertEqual(first, second)
+        second.question_text = '<p>What is 2 + 2?</p>'
+        self.assertNotEqual(first, second)
+        first.question_text = second.question_text
+        self.assertEqual(first, second)
+
+    def test_questions_are_not_hashable(self):
+        with self.assertRaises(TypeError):
+            {make_question()}
+
+    def test_fingerprints_are_cached_until_changed(self):
+        first, second = make_question(), make_question()
+        with mock.patch('waltz.quizzes.json', wraps=json) as encoder:
+            for attempt in range(3):
+                self.assertEqual(first, second)
+            self.assertEqual(encoder.dumps.call_count, 2)
+            # Names are not part of the content
+            second.question_name = 'Q2'
+            self.assertEqual(first.content_fingerprint, second.content_fingerprint)
+            self.assertEqual(encoder.dumps.call_count, 2)
+
+    def test_bank_questions_are_found_by_their_new_content(self):
+        course = SimpleNamespace(course_name='fingerprint-test')
+        question = make_question()
+        question.course, question.bank_source = course, 'bank.yaml'
+        old = question.content_fingerprint
+        QuizQuestion.FINGERPRINTS[course.course_name] = {old: question}
+        self.addCleanup(QuizQuestion.FINGERPRINTS.pop, course.course_name)
+        question.question_text = '<p>What is 2 + 2?</p>'
+        self.assertEqual(QuizQuestion.FINGERPRINTS[course.course_name],
+                         {question.content_fingerprint: question})
+        edited = make_question(text='<p>What is 2 + 2?</p>')
+        self.assertIs(QuizQuestion.by_content(edited, course), question)
+
+
+class TestPushQuestion(unittest.TestCase):
+    def test_shared_questions_keep_their_group_name(self):
+        course = SimpleNamespace(course_name='test')
+        question = make_question()
+        question.quiz_group_id = 'Group A'
+        with mock.patch('waltz.quizzes.post') as post:
+            for group_id in (7, 8):
+                Quiz._push_question(course, SimpleNamespace(canvas_id=1), question,
+                                    {'Group A': group_id}, {})
+        self.assertEqual([call[1]['data']['question[quiz_group_id]']
+                          for call in post.call_args_list], [7, 8])
+        self.assertEqual(question.quiz_group_id, 'Group A')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import json
+import unittest
+from unittest import mock
+
+from waltz.resources import WaltzException
+from waltz.results import QuizResults, report_results
+
+from canvas_case import CanvasTestCase, COURSE_ID
+
+
+class TestQuizResults(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = self.make_course()
+
+    def add_exam(self, title, right):
+        '''
+        Adds a quiz with a question for each set of students in `right`,
+        the students who chose its correct answer.
+        '''
+        quiz = self.server.add_quiz(COURSE_ID, title, '<p>Exam</p>')
+        options = [{'text': text, 'html': '', 'comments': '', 'comments_html': '',
+                    'weight': 100 if text == 'Right' else 0}
+                   for text in ('Right', 'Wrong')]
+        questions = [self.server.add_question(COURSE_ID, quiz['id'],
+                                              'Question {}'.format(index), '<p>?</p>',
+                                              answers=[dict(option) for option in options])
+                     for index in range(len(right))]
+        for user_id in range(1, 5):
+            answers = []
+            for question, students in zip(questions, right):
+                correct = user_id in students
+                answers.append({'question_id': question['id'], 'correct': correct,
+                                'points': 1.0 if correct else 0.0,
+                                'answer_id': question['answers'][0 if correct else 1]['id']})
+            self.server.add_submission(COURSE_ID, quiz['assignment_id'], user_id,
+                                       sum(answer['points'] for answer in answers),
+                                       answers)
+        return quiz
+
+    def written(self, title):
+        path = os.path.join(self.destination, 'results', title+'.json')
+        if os.path.exists(path):
+            with open(path) as report_file:
+                return json.load(report_file)
+
+    def test_questions_are_analyzed(self):
+        quiz = self.add_exam('Exam', [{3, 4}, {2, 3, 4}])
+        report = QuizResults.download(self.course, quiz).analyze()
+        self.assertEqual(report['students'], 4)
+        self.assertEqual(report['scores']['mean'], 1.25)
+        first, second = report['questions']
+        self.assertEqual((first['difficulty'], second['difficulty']), (0.5, 0.75))
+        # The stronger students got both questions right
+        self.assertGreater(first['discrimination'], 0)
+        self.assertGreater(second['discrimination'], 0)
+        self.assertEqual(first['upper_lower'], 1.0)
+        self.assertEqual([(answer['text'], answer['correct'], answer['count'])
+                          for answer in first['answers']],
+                         [('Right', True, 2), ('Wrong', False, 2)])
+
+    def test_quizzes_without_assignments_are_skipped(self):
+        self.add_exam('Exam', [{3, 4}])
+        survey = self.server.add_quiz(COURSE_ID, 'Survey', '<p>Survey</p>')
+        survey['assignment_id'] = None
+        self.assertEqual(report_results(self.course, format='json'), 1)
+        self.assertEqual(self.written('Exam')['students'], 4)
+        self.assertIsNone(self.written('Survey'))
+
+    def test_failing_quizzes_do_not_stop_the_others(self):
+        self.add_exam('Broken', [{3, 4}])
+        self.add_exam('Exam', [{3, 4}])
+        download = QuizResults.download
+
+        def failing(course, quiz_json):
+            if quiz_json['title'] == 'Broken':
+                raise ValueError('Bad data')
+            return download(course, quiz_json)
+        with mock.patch.object(QuizResults, 'download', failing):
+            with self.assertRaisesRegex(WaltzException,
+                                        'Could not analyze 1 quizzes:\nBroken: ValueError'):
+                report_results(self.course, format='json')
+        self.assertEqual(self.written('Exam')['students'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
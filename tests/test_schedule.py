@@ -0,0 +1,86 @@
+import time
+import threading
+import unittest
+
+from waltz.resources import WaltzException
+from waltz.schedule import DependencyScheduler
+
+
+class TestDependencyScheduler(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+
+    def task(self, key, fail=False):
+        def action():
+            if fail:
+                raise ValueError(key)
+            self.order.append(key)
+        return action
+
+    def test_dependencies_run_first(self):
+        scheduler = DependencyScheduler(4)
+        scheduler.add('quiz', self.task('quiz'), ['group'])
+        scheduler.add('group', self.task('group'))
+        # Dependencies on tasks that were never added are already met
+        scheduler.add('page', self.task('page'), ['unknown'])
+        scheduler.run()
+        self.assertLess(self.order.index('group'), self.order.index('quiz'))
+        self.assertEqual(sorted(scheduler.finished), ['group', 'page', 'quiz'])
+
+    def test_failure_skips_only_its_dependents(self):
+        scheduler = DependencyScheduler(4)
+        scheduler.add('a', self.task('a', fail=True))
+        scheduler.add('b', self.task('b'), ['a'])
+        scheduler.add('c', self.task('c'), ['b'])
+        scheduler.add('d', self.task('d'))
+        scheduler.run()
+        self.assertEqual(scheduler.finished, ['d'])
+        self.assertEqual(list(scheduler.failed), ['a'])
+        self.assertIsInstance(scheduler.failed['a'], ValueError)
+        self.assertEqual(dict(scheduler.skipped), {'b': 'a', 'c': 'a'})
+        self.assertIn('c: skipped, since a failed', scheduler.describe_problems())
+
+    def test_cycles_are_refused_before_running(self):
+        scheduler = DependencyScheduler(4)
+        scheduler.add('a', self.task('a'), ['c'])
+        scheduler.add('b', self.task('b'), ['a'])
+        scheduler.add('c', self.task('c'), ['b'])
+        scheduler.add('d', self.task('d'))
+        with self.assertRaisesRegex(WaltzException, 'Circular'):
+            scheduler.run()
+        self.assertEqual(self.order, [])
+
+    def test_tasks_are_added_once(self):
+        scheduler = DependencyScheduler(4)
+        scheduler.add('a', self.task('a'))
+        with self.assertRaises(WaltzException):
+            scheduler.add('a', self.task('a'))
+
+    def test_nested_schedulers_stay_within_the_outer_limit(self):
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def leaf():
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+
+        def nested():
+            inner = DependencyScheduler(8)
+            for index in range(8):
+                inner.add(index, leaf)
+            inner.run()
+            self.assertEqual(len(inner.finished), 8)
+        outer = DependencyScheduler(2)
+        for index in range(4):
+            outer.add(index, nested)
+        outer.run()
+        self.assertEqual(len(outer.finished), 4)
+        self.assertLessEqual(active[1], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
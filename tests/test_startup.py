@@ -0,0 +1,38 @@
+import sys
+import subprocess
+import unittest
+
+from benchmarks.bench_startup import HEAVY_MODULES, ROOT, imported_modules
+
+# Runs --help in a fresh interpreter and prints every module it loaded
+LOADED_BY_HELP = '''
+import sys, runpy
+sys.argv = ['waltz', '--help']
+try:
+    runpy.run_module('waltz', run_name='__main__', alter_sys=True)
+except SystemExit:
+    pass
+print(' '.join(sys.modules))
+'''
+
+
+class TestStartup(unittest.TestCase):
+    def test_help_imports_no_heavy_modules(self):
+        loaded = imported_modules([sys.executable, '-m', 'waltz', '--help'])
+        self.assertIn('waltz', loaded)
+        heavy = {name.split('.')[0] for name in loaded}.intersection(HEAVY_MODULES)
+        self.assertEqual(heavy, set())
+
+    def test_help_loads_no_verbs(self):
+        output = subprocess.run([sys.executable, '-c', LOADED_BY_HELP], cwd=ROOT,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        # The help comes first, then the modules on the last line
+        loaded = set(output.splitlines()[-1].split())
+        self.assertIn('waltz', loaded)
+        self.assertEqual({name.split('.')[0] for name in loaded}.intersection(HEAVY_MODULES),
+                         set())
+        self.assertEqual({'waltz.sync', 'waltz.resources'}.intersection(loaded), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import unittest
+
+from canvas_case import CanvasTestCase, COURSE_ID, COURSE_NAME
+
+
+class TestFakeCanvas(CanvasTestCase):
+    def test_pagination_follows_link_headers(self):
+        from waltz.canvas_tools import get
+        self.server.per_page = 3
+        for index in range(10):
+            self.server.add_page(COURSE_ID, 'Lesson {}'.format(index), '<p>Body</p>')
+        before = self.server.request_count
+        pages = get('pages', all=True, course=COURSE_NAME)
+        self.assertEqual(len(pages), 10)
+        self.assertEqual(self.server.request_count - before, 4)
+
+
+class TestSync(CanvasTestCase):
+    def test_pull_then_push_page(self):
+        from waltz.sync import pull_all_resources, push_resource
+        page = self.server.add_page(COURSE_ID, 'Lesson 1', '<p>Old body</p>')
+        pull_all_resources('pages/*', 'raw', self.destination, COURSE_NAME, True)
+        path = os.path.join(self.destination, 'pages', 'Lesson 1.md')
+        self.assertTrue(os.path.exists(path))
+        with open(path) as page_file:
+            self.assertIn('Old body', page_file.read())
+        with open(path, 'w') as page_file:
+            page_file.write('New body')
+        push_resource('pages/:'+page['url'], 'raw', self.destination,
+                      COURSE_NAME, True)
+        self.assertIn('New body', self.canvas['pages'][page['url']]['body'])
+
+    def test_snapshot_titles_match_like_other_searches(self):
+        from waltz.snapshots import Snapshot
+        from waltz.sync import pull_all_resources, export_snapshot
+        from waltz.resources import WaltzException
+        for title in ('Lesson 1: Variables', 'Lesson 2: Loops'):
+            self.server.add_page(COURSE_ID, title, '<p>Body</p>')
+        course = self.make_course()
+        path = os.path.join(self.destination, 'course.snapshot')
+        with Snapshot(path) as snapshot:
+            course.snapshot = snapshot
+            pull_all_resources('pages/*', 'raw', self.destination, course, True)
+            exported = os.path.join(self.destination, 'exported')
+            self.assertEqual(export_snapshot('pages/?loops', exported, snapshot), 1)
+            self.assertEqual(os.listdir(os.path.join(exported, 'pages')),
+                             ['Lesson 2 Loops.md'])
+            with self.assertRaisesRegex(WaltzException, 'Ambiguous'):
+                export_snapshot('pages/?Lesson', exported, snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
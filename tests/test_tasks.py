@@ -0,0 +1,92 @@
+import os
+import sys
+import subprocess
+import unittest
+from unittest import mock
+
+import waltz.canvas_tools
+import waltz.tasks
+from waltz.canvas_tools import CanvasUnavailable
+from waltz.resources import WaltzException, WaltzNoResourceFound
+from waltz.tasks import TaskQueue, tasks_path, run_queued
+
+from canvas_case import CanvasTestCase, COURSE_ID
+
+
+class TestTaskQueue(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            self.server.add_page(COURSE_ID, 'Lesson {}'.format(index), '<p>Text</p>')
+        self.stack.enter_context(mock.patch.dict(
+            waltz.canvas_tools.defaults, {'task-backoff': 0}))
+        self.course = self.make_course()
+        self.queue = TaskQueue(tasks_path(self.destination))
+        self.addCleanup(self.queue.close)
+        self.pulled = []
+
+    def pulling(self, title=None, error=None, times=None):
+        '''
+        Records the pulled pages, failing the given number of times (or
+        always) for the page with the title.
+        '''
+        real = waltz.tasks.pull_task
+        failures = []
+
+        def pull_task(course, resource_id):
+            if resource_id.canvas_title == title and (times is None or
+                                                      len(failures) < times):
+                failures.append(resource_id)
+                raise error
+            self.pulled.append(resource_id.canvas_title)
+            return real(course, resource_id)
+        return mock.patch.object(waltz.tasks, 'pull_task', pull_task)
+
+    def task(self, run, title):
+        for task in self.queue.tasks(run):
+            if task['resource'] == 'pages/:lesson-{}'.format(title[-1]):
+                return task
+
+    def test_failed_tasks_are_resumed(self):
+        with self.pulling('Lesson 1', WaltzNoResourceFound('Gone')):
+            with self.assertRaisesRegex(WaltzException, 'Run 1 finished 2 tasks'):
+                run_queued(self.course, 'pull', ['pages/*'])
+        task = self.task(1, 'Lesson 1')
+        # Errors that will not go away are not retried
+        self.assertEqual((task['status'], task['attempts']), ('failed', 1))
+        self.assertIn('Gone', task['error'])
+        self.assertEqual(sorted(self.pulled), ['Lesson 0', 'Lesson 2'])
+        self.pulled = []
+        with self.pulling():
+            self.assertEqual(run_queued(self.course, 'pull', ['pages/*']), 1)
+        self.assertEqual(self.pulled, ['Lesson 1'])
+        self.assertEqual(self.queue.counts(1), {'done': 3})
+        self.assertTrue(os.path.exists(os.path.join(self.destination, 'pages',
+                                                    'Lesson 1.md')))
+
+    def test_unavailable_canvas_is_retried(self):
+        response = mock.Mock(status_code=503, reason='Service Unavailable')
+        error = CanvasUnavailable(response, 'pages/lesson-1')
+        with self.pulling('Lesson 1', error, times=1):
+            self.assertEqual(run_queued(self.course, 'pull', ['pages/*']), 3)
+        task = self.task(1, 'Lesson 1')
+        self.assertEqual((task['status'], task['attempts']), ('done', 2))
+
+    def test_runs_are_claimed_once(self):
+        run = self.queue.create_run('pull', 'pages/*', [{'key': 'a', 'resource': 'pages/:a'}])
+        # The run is still going in this process
+        with self.assertRaisesRegex(WaltzException, 'already running'):
+            self.queue.claim_run('pull', 'pages/*')
+        with self.assertRaisesRegex(WaltzException, 'already running'):
+            self.queue.create_run('pull', 'pages/*', [])
+        # Its process is gone, as after a crash
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        self.queue.connection.execute('UPDATE runs SET owner=?', (finished.pid,))
+        self.queue.connection.commit()
+        self.assertEqual(self.queue.claim_run('pull', 'pages/*'), run)
+        self.assertIsNone(self.queue.claim_run('pull', 'pages/:a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import unittest
+
+from waltz.watcher import resource_for_path, resource_id_for_file
+
+from canvas_case import CanvasTestCase, COURSE_ID, COURSE_NAME
+
+
+class TestResourceForPath(CanvasTestCase):
+    def setUp(self):
+        super().setUp()
+        from waltz.sync import pull_all_resources
+        self.lesson = self.server.add_page(COURSE_ID, 'Lesson 1: Intro', '<p>One</p>')
+        self.server.add_page(COURSE_ID, 'Lesson 1: Intro, again', '<p>Ten</p>')
+        pull_all_resources('pages/*', 'raw', self.destination, COURSE_NAME, True)
+        self.course = self.make_course()
+
+    def resolve(self, filename):
+        from waltz.resources import Page
+        path = os.path.join(self.destination, 'pages', filename)
+        verb, (category, filename) = resource_for_path(self.destination, path)
+        self.assertEqual(verb, 'push')
+        return resource_id_for_file(self.course, Page, filename)
+
+    def test_recorded_state_gives_the_id(self):
+        self.assertEqual(self.resolve('Lesson 1 Intro.md'),
+                         'pages/:'+self.lesson['url'])
+
+    def test_index_gives_the_id_without_recorded_state(self):
+        shutil.rmtree(os.path.join(self.destination, '_cache', 'canvas'))
+        before = self.server.request_count
+        self.assertEqual(self.resolve('Lesson 1 Intro.md'),
+                         'pages/:'+self.lesson['url'])
+        self.assertEqual(self.server.request_count, before)
+
+    def test_unknown_file_is_new(self):
+        self.assertEqual(self.resolve('Lesson 2.md'), 'pages/+Lesson 2')
+
+    def test_ignored_files(self):
+        for relative in ('_cache/pages/x.md', 'pages/.x.md', 'pages/x.public.yaml', 'x.md'):
+            self.assertIsNone(resource_for_path(
+                self.destination, os.path.join(self.destination, relative)))
+
+
+if __name__ == '__main__':
+    unittest.main()
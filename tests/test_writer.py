@@ -0,0 +1,67 @@
+import os
+import gzip
+import stat
+import tempfile
+import unittest
+from glob import glob
+
+from waltz.writer import write_atomically, DiskWriter, UMASK
+
+
+class TestWriteAtomically(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'pages', 'Lesson 1.md')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.path).st_mode)
+
+    def test_new_file_gets_the_umask_permissions(self):
+        self.assertTrue(write_atomically(self.path, b'First'))
+        self.assertEqual(self.mode(), 0o666 & ~UMASK)
+        with open(self.path, 'rb') as written:
+            self.assertEqual(written.read(), b'First')
+
+    def test_existing_permissions_are_kept(self):
+        write_atomically(self.path, b'First')
+        os.chmod(self.path, 0o640)
+        self.assertTrue(write_atomically(self.path, b'Second', durable=True))
+        self.assertEqual(self.mode(), 0o640)
+
+    def test_unchanged_contents_are_skipped(self):
+        write_atomically(self.path, b'First')
+        before = os.stat(self.path).st_mtime_ns
+        self.assertFalse(write_atomically(self.path, b'First'))
+        self.assertEqual(os.stat(self.path).st_mtime_ns, before)
+
+    def test_old_contents_are_backed_up(self):
+        backups = os.path.join(self.directory.name, '_backups')
+        write_atomically(self.path, b'First', backups)
+        write_atomically(self.path, b'Second', backups)
+        saved = glob(os.path.join(backups, '*.md.gz'))
+        self.assertEqual(len(saved), 1)
+        with gzip.open(saved[0]) as backup:
+            self.assertEqual(backup.read(), b'First')
+        self.assertEqual(glob(os.path.join(self.directory.name, 'pages', '.*.tmp')), [])
+
+
+class TestDiskWriter(unittest.TestCase):
+    def test_writes_in_the_background_and_reports_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = DiskWriter(batch_size=4)
+            for index in range(10):
+                writer.write(os.path.join(directory, '{}.md'.format(index)),
+                             str(index).encode('utf-8'))
+            writer.flush()
+            self.assertEqual(writer.written, 10)
+            # A directory cannot be replaced by a file
+            writer.write(directory, b'Oops')
+            with self.assertRaises(OSError):
+                writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,2 +1,11 @@
-import waltz.sync
-import waltz.resources
\ No newline at end of file
+import importlib
+
+# Submodules are loaded on first use, so that `python -m waltz --help` does
+# not have to import requests, markdown, jinja2, etc.
+LAZY_SUBMODULES = ('sync', 'resources')
+
+
+def __getattr__(name):
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module('waltz.'+name)
+    raise AttributeError("module 'waltz' has no attribute {!r}".format(name))
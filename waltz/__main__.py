@@ -1,15 +1,28 @@
 import argparse
-import waltz.sync
 
 parser = argparse.ArgumentParser(description='Sync resources')
-parser.add_argument('verb', choices=['pull', 'push', 'build', 'publicize'])
-parser.add_argument('--course', '-c', help='The specific course to perform operations on. Should be a valid course label, not the ID')
+parser.add_argument('verb', choices=['pull', 'push', 'build', 'publicize', 'export', 'watch', 'shift-dates', 'daemon', 'results'])
+parser.add_argument('--course', '-c', help='The specific course to perform operations on. Should be a valid course label, not the ID. Can be given more than once to work on several courses concurrently.', action='append', default=None)
+parser.add_argument('--all-courses', help='Perform the operation on every course in the settings file, concurrently.', action='store_true', default=False)
+parser.add_argument('--jobs', '-j', help='The most courses to work on at the same time. Defaults to the "max-concurrency" setting, or 4. For the push verb without an --id, the most resources pushed at the same time (defaults to the "push-concurrency" setting, or 8). For the results verb, the most quizzes downloaded at the same time (defaults to the "fetch-concurrency" setting, or 8).', type=int, default=None)
 parser.add_argument('--settings', '-s', help='The settings file to use. Defaults to "settings.yaml". If the file does not exist, it will be created.', default='settings/settings.yaml')
-parser.add_argument('--id', '-i', help='The specific resource ID to manipulate. If not specified, all resources are used', default=None)
+parser.add_argument('--id', '-i', help='The specific resource ID to manipulate. If not specified, all resources are used (the push verb pushes them in dependency order). For the pull, push and results verbs, can be given more than once to resolve several resources together. For the publicize verb, this may also be a category wildcard ("quizzes/*") or "all".', action='append', default=None)
 parser.add_argument('--destination', '-d', help='Where course files will be downloaded to', default=None)
-parser.add_argument('--format', '-f', help='What format to generate the result into.', choices=['html', 'json', 'raw', 'pdf', 'text', 'yaml'], default='raw')
+parser.add_argument('--format', '-f', help='What format to generate the result into. For the results verb, the format of the report written to results/ (raw prints it instead).', choices=['html', 'json', 'raw', 'pdf', 'text', 'yaml'], default='raw')
 parser.add_argument('--ignore', '-x', help='Ignores any cached files in processing the quiz results', action='store_true', default=False)
 parser.add_argument('--quiet', '-q', help='Silences the output', action='store_true', default=False)
+parser.add_argument('--snapshot', help='A single-file snapshot of the course. Pulls are stored in it instead of as separate files, and the export verb writes its contents out to the destination.', default=None)
+parser.add_argument('--debounce', help='For the watch verb, how many seconds of quiet to wait for before pushing a burst of changes.', type=float, default=1.0)
+parser.add_argument('--poll', help='For the watch verb, poll for changes instead of using inotify.', action='store_true', default=False)
+parser.add_argument('--plan', help='For the push verb, work out (offline, from the last pulled state) every request the push would make, without making any. Optionally saves the plan to the given file.', nargs='?', const=True, default=None)
+parser.add_argument('--apply', help='For the push verb, perform the requests in a previously saved plan file.', default=None)
+parser.add_argument('--offset', help='For the shift-dates verb, how far to move every date, like "+16w" or "-3d 2h".', default=None)
+parser.add_argument('--mapping', help='For the shift-dates verb, a YAML file mapping old days to new days (times of day are kept).', default=None)
+parser.add_argument('--queue', help='For the pull and push verbs with several (or all) resources, run one task per resource through a durable queue in _cache/tasks.sqlite, retrying failed tasks. If the run is interrupted or some tasks fail, running the same command again only runs the unfinished tasks. --jobs sets the number of workers (defaults to the "task-workers" setting, or 4).', action='store_true', default=False)
+parser.add_argument('--daemon', help='Run the command on a running Waltz daemon (see the daemon verb), which keeps the settings, templates and banks loaded between commands. Optionally, the URL of the daemon.', nargs='?', const='http://127.0.0.1:8765/', default=None)
+parser.add_argument('--port', help='For the daemon verb, the port to listen on (on 127.0.0.1).', type=int, default=8765)
 args = parser.parse_args()
 
+# Deferred until after argument parsing so --help stays fast
+import waltz.sync
 waltz.sync.main(args)
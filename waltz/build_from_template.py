@@ -54,4 +54,4 @@ if __name__ == '__main__':
     parser.add_argument('template', help='The path to the desired template file')
     args = parser.parse_args()
     
-    to_markdown(args.input, args.template)
\ No newline at end of file
+    to_markdown(args.input, args.template)
@@ -1,7 +1,8 @@
-import json
-import requests
-import os, sys
+import os
+import sys
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from waltz.yaml_setup import yaml
@@ -19,7 +20,6 @@ settings = {
 courses = {}
 defaults = {}
 def load_settings(path='settings.yaml', create_if_not_exists=True):
-    global courses, defaults
     # Create settings file if it doesn't exist
     if not os.path.exists(path):
         if create_if_not_exists:
@@ -32,99 +32,345 @@ def load_settings(path='settings.yaml', create_if_not_exists=True):
             raise Exception("The settings file was not found: "+repr(path))
 
     # Load in the settings file
-    new_settings = yaml_load(path)
+    use_settings(yaml_load(path))
+
+def use_settings(new_settings):
+    '''
+    Installs settings that were already loaded (e.g., those given to a
+    worker process by its parent).
+    '''
+    global courses, defaults
     settings.update(new_settings)
 
     # Shortcut to access courses
     courses = settings['courses']
     defaults = settings['defaults']
     
+NO_DEFAULT = object()
+
 def get_courses():
     return settings['courses']
 
-def get_setting(setting, course=None):
+def get_setting(setting, course=None, default=NO_DEFAULT):
+    '''
+    Looks up a setting for a course, falling back to the defaults. If a
+    default is given, it is returned when the setting is missing entirely.
+    '''
     if course is None:
+        if default is not NO_DEFAULT:
+            return defaults.get(setting, default)
         return defaults[setting]
     if course in courses:
         if setting in courses[course]:
             return courses[course][setting]
+        if default is not NO_DEFAULT:
+            return defaults.get(setting, default)
         return defaults[setting]
     raise Exception("Course not found in settings.yaml: {course}".format(course=course))
     
-def _canvas_request(verb, command, course, data, all, params, json):
+session = None
+def get_session():
+    '''
+    A single HTTP session is shared by every request, so that connections
+    to Canvas are kept alive and reused instead of reopened each time.
+    '''
+    global session
+    if session is None:
+        import requests
+        session = requests.Session()
+    return session
+
+request_limiter = None
+request_limiter_lock = threading.Lock()
+def get_request_limiter():
+    '''
+    Every request to Canvas, from any thread, holds this semaphore while it
+    is in flight, so that nested pools of workers can never have more than
+    the "max-requests" setting (or 8) requests open at once.
+    '''
+    global request_limiter
+    with request_limiter_lock:
+        if request_limiter is None:
+            request_limiter = threading.BoundedSemaphore(
+                get_setting('max-requests', default=8))
+    return request_limiter
+
+class CanvasUnavailable(Exception):
+    '''
+    Canvas could not answer a request right now: it failed (a 5xx status) or
+    throttled it (a 429, or Canvas's "Rate Limit Exceeded" 403). Trying
+    again later may work.
+    '''
+    def __init__(self, response, url):
+        super().__init__("{} {} from {}".format(response.status_code,
+                                                response.reason, url))
+        self.status_code = response.status_code
+
+def is_unavailable(response):
+    if response.status_code >= 500 or response.status_code == 429:
+        return True
+    return response.status_code == 403 and 'Rate Limit Exceeded' in response.text
+
+def send(verb, url, **kwargs):
+    '''
+    Makes one HTTP request (e.g., ``send(get_session().get, url)``) once
+    the request limiter lets it through. Raises CanvasUnavailable if Canvas
+    failed or throttled it.
+    '''
+    with get_request_limiter():
+        response = verb(url, **kwargs)
+    if is_unavailable(response):
+        raise CanvasUnavailable(response, url)
+    return response
+
+def _prepare_request(command, course, data, params, json):
+    '''
+    Returns:
+        (str, dict, dict, dict): The full URL, form data, query parameters
+            and headers for a request.
+    '''
+    if data is None:
+        data = {}
+    if params is None:
+        params = {}
+    headers = {}
+    if json is not None:
+        data = None
+        headers['Authorization'] = "Bearer "+get_setting('canvas-token')
+    else:
+        data['access_token'] = get_setting('canvas-token')
+    if course == 'default':
+        course = get_setting('course')
+    url = get_setting('canvas-url', course=course)
+    if course is not None:
+        course_id = courses[course]['id']
+        url += 'courses/{course_id}/'.format(course_id=course_id)
+    url += command
+    return url, data, params, headers
+
+def _decode(response, url):
     try:
-        if data is None:
-            data = {}
-        if params is None:
-            params = {}
-        headers = {}
-        if json is not None:
-            data = None
-            headers['Authorization'] = "Bearer "+get_setting('canvas-token')
-        else:
-            data['access_token'] = get_setting('canvas-token')
-        if course == 'default':
-            course = get_setting('course')
-        next_url = get_setting('canvas-url', course=course)
-        if course != None:
-            course_id = courses[course]['id']
-            next_url += 'courses/{course_id}/'.format(course_id=course_id)
-        next_url += command
-        if all:
-            data['per_page'] = 100
-            final_result = []
-            while True:
-                response = verb(next_url, data=data, params=params, json=json, headers=headers)
-                final_result += response.json()
-                if 'next' in response.links:
-                    next_url = response.links['next']['url']
-                else:
-                    return final_result
-        else:
-            response = verb(next_url, data=data, params=params, json=json, headers=headers)
-            if response.status_code == 204:
-                return response
-            return response.json()
-    except json.decoder.JSONDecodeError:
-        raise Exception("{}\n{}".format(response, next_url))
+        return response.json()
+    except ValueError:
+        # The json parameter shadows the module, so catch JSONDecodeError's base
+        raise Exception("{}\n{}".format(response, url))
+
+def _iter_responses(verb, command, course, data, params, json, prefetch):
+    '''
+    Yields the decoded JSON of each page of a paginated listing. While the
+    caller works on one page, the next one is already being fetched in a
+    background thread, so at most two pages are held at once.
+    '''
+    url, data, params, headers = _prepare_request(command, course, data,
+                                                  params, json)
+    if data is not None:
+        data['per_page'] = 100
+
+    def fetch(page_url):
+        return send(verb, page_url, data=data, params=params, json=json,
+                    headers=headers)
+    pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        response = fetch(url)
+        while True:
+            next_url = response.links.get('next', {}).get('url')
+            upcoming = None
+            if next_url is not None and pool is not None:
+                upcoming = pool.submit(fetch, next_url)
+            yield _decode(response, url)
+            if next_url is None:
+                return
+            response = upcoming.result() if upcoming else fetch(next_url)
+            url = next_url
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+def iter_pages(command, course='default', data=None, params=None, prefetch=True):
+    '''
+    Yields each page (a list of items) of a paginated Canvas listing as it
+    arrives. Error responses are yielded as they are (a dictionary).
+    '''
+    return _iter_responses(get_session().get, command, course, data, params,
+                           None, prefetch)
+
+def iter_all(command, course='default', data=None, params=None, prefetch=True):
+    '''
+    Yields the items of a paginated Canvas listing one at a time, fetching
+    the next page while the current one is processed.
+    '''
+    for page in iter_pages(command, course, data, params, prefetch):
+        if isinstance(page, dict):
+            raise Exception("Errors in Canvas data: "+repr(page))
+        for item in page:
+            yield item
+
+def _canvas_request(verb, command, course, data, all, params, json):
+    if all:
+        final_result = []
+        for page in _iter_responses(verb, command, course, data, params, json,
+                                    prefetch=False):
+            final_result += page
+        return final_result
+    url, data, params, headers = _prepare_request(command, course, data,
+                                                  params, json)
+    response = send(verb, url, data=data, params=params, json=json,
+                    headers=headers)
+    if response.status_code == 204:
+        return response
+    return _decode(response, url)
     
 def get(command, course='default', data=None, all=False, params=None, json=None):
-    return _canvas_request(requests.get, command, course, data, all, params, json)
+    return _canvas_request(get_session().get, command, course, data, all, params, json)
     
 def post(command, course='default', data=None, all=False, params=None, json=None):
-    return _canvas_request(requests.post, command, course, data, all, params, json)
+    return _canvas_request(get_session().post, command, course, data, all, params, json)
     
 def put(command, course='default', data=None, all=False, params=None, json=None):
-    return _canvas_request(requests.put, command, course, data, all, params, json)
+    return _canvas_request(get_session().put, command, course, data, all, params, json)
     
 def delete(command, course='default', data=None, all=False, params=None, json=None):
-    return _canvas_request(requests.delete, command, course, data, all, params, json)
+    return _canvas_request(get_session().delete, command, course, data, all, params, json)
+
+def graphql_url(course='default'):
+    '''
+    The GraphQL endpoint sits next to the REST API, so a canvas-url like
+    "https://school.instructure.com/api/v1/" becomes
+    "https://school.instructure.com/api/graphql".
+    '''
+    if course == 'default':
+        course = get_setting('course')
+    url = get_setting('canvas-url', course=course)
+    return url.rstrip('/').rsplit('/', 1)[0]+'/graphql'
+
+def post_graphql(query, variables=None, course='default'):
+    '''
+    Returns:
+        dict: The decoded response, with its "data" and any "errors".
+    '''
+    url = graphql_url(course)
+    headers = {'Authorization': "Bearer "+get_setting('canvas-token')}
+    response = send(get_session().post, url,
+                    json={'query': query, 'variables': variables or {}},
+                    headers=headers)
+    return _decode(response, url)
+
+class MultipartStream:
+    '''
+    A multipart/form-data body that is read a block at a time, so that the
+    file in it (e.g., a memory map) is sent without being copied into memory
+    whole. Even a read of everything (a negative size) returns a block at
+    most; the body ends at the first empty read.
+    Args:
+        on_read (callable): Called with the number of bytes of the file
+            sent, as they are sent.
+    '''
+    block_size = 1024 * 1024
+    
+    def __init__(self, fields, name, data, content_type, size, on_read=None):
+        import io
+        from uuid import uuid4
+        self.boundary = uuid4().hex
+        head = b''.join(
+            '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+                self.boundary, key, value).encode('utf-8')
+            for key, value in fields.items())
+        head += ('--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\n'
+                 'Content-Type: {}\r\n\r\n'.format(
+                     self.boundary, name.replace('"', '%22'), content_type).encode('utf-8'))
+        tail = '\r\n--{}--\r\n'.format(self.boundary).encode('utf-8')
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+        self.file = data
+        self.parts = [io.BytesIO(head), data, io.BytesIO(tail)]
+        self.length = len(head) + size + len(tail)
+        self.on_read = on_read
+    
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary='+self.boundary
+    
+    def __len__(self):
+        return self.length
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.block_size
+        chunks = []
+        wanted = size
+        while self.parts and wanted > 0:
+            chunk = self.parts[0].read(wanted)
+            if not chunk:
+                self.parts.pop(0)
+                continue
+            if self.parts[0] is self.file and self.on_read is not None:
+                self.on_read(len(chunk))
+            chunks.append(chunk)
+            wanted -= len(chunk)
+        return b''.join(chunks)
+
+def upload_file(name, data, content_type, course='default', size=None,
+                parent_folder_path=None, on_duplicate='overwrite', on_read=None):
+    '''
+    Uploads a file to the course's files with Canvas's three steps: ask
+    Canvas where the file should go, send it there, and follow the redirect
+    that confirms the upload.
+    Args:
+        data (bytes or file): The contents; a file object (or memory map)
+            is streamed, a block at a time.
+        size (int): The size of the contents, if data is not bytes.
+        on_read (callable): Called with the number of bytes sent, as they
+            are sent (see MultipartStream).
+    Returns:
+        dict: The Canvas JSON of the uploaded file.
+    '''
+    if size is None:
+        size = len(data)
+    ticket = {'name': name, 'size': size, 'content_type': content_type,
+              'on_duplicate': on_duplicate}
+    if parent_folder_path is not None:
+        ticket['parent_folder_path'] = parent_folder_path
+    ticket = post('files', course=course, data=ticket)
+    if 'upload_url' not in ticket:
+        raise Exception("Errors in Canvas data: "+repr(ticket))
+    session = get_session()
+    body = MultipartStream(ticket.get('upload_params', {}), name, data,
+                           content_type, size, on_read)
+    # The upload URL is already authorized, so the token is not sent to it
+    response = send(session.post, ticket['upload_url'], data=body,
+                    headers={'Content-Type': body.content_type},
+                    allow_redirects=False)
+    if 300 <= response.status_code < 400:
+        headers = {'Authorization': "Bearer "+get_setting('canvas-token')}
+        response = send(session.get, response.headers['Location'],
+                        headers=headers)
+    return _decode(response, ticket['upload_url'])
 
 def progress_loop(progress_id, DELAY=3):
     attempt = 0
     while True:
-        result = _canvas_request(requests.get, 'progress/{}'.format(progress_id), 
+        result = _canvas_request(get_session().get, 'progress/{}'.format(progress_id), 
                                  None, {'_dummy_counter': attempt}, 
-                                 False, None, dict)[0]
+                                 False, None, None)
         if result['workflow_state'] == 'completed':
             return True
         elif result['workflow_state'] == 'failed':
             return False
         else:
             print("In progress:", result['workflow_state'], result['message'], 
-                  str(int(round(result['completion']*10))/10)+"%")
+                  str(int(round((result['completion'] or 0)*10))/10)+"%")
             if not hasattr(result, 'from_cache') or not result.from_cache:
                 time.sleep(DELAY)
             attempt += 1
             
 def download_file(url, destination):
-    data = {'access_token': get_setting('canvas-token')}
-    r = requests.get(url)
-    f = open(destination, 'wb')
-    for chunk in r.iter_content(chunk_size=512 * 1024): 
-        if chunk: # filter out keep-alive new chunks
-            f.write(chunk)
-    f.close()
+    with get_request_limiter():
+        r = get_session().get(url)
+        f = open(destination, 'wb')
+        for chunk in r.iter_content(chunk_size=512 * 1024): 
+            if chunk: # filter out keep-alive new chunks
+                f.write(chunk)
+        f.close()
 
 CANVAS_DATE_STRING = "%Y-%m-%dT%H:%M:%SZ"
 
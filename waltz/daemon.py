@@ -0,0 +1,459 @@
+'''
+A long-running Waltz daemon with a local HTTP/JSON API.
+
+Every CLI command starts from scratch: it reloads the settings, rebuilds
+each course's Jinja environment, rereads the question and outcome banks and
+opens new connections to Canvas. `waltz daemon` keeps all of that warm
+between commands. Commands are submitted as jobs, run one at a time in the
+order they arrive, and their output is recorded as progress events that
+clients can stream:
+
+    POST /jobs               {"verb": "pull", "course": ["cs1014"], "id": [...]}
+                             starts a job (any CLI option can be given)
+    GET  /jobs               every job
+    GET  /jobs/<id>          one job
+    GET  /jobs/<id>/events   the job's progress, one JSON object per line,
+                             streamed until the job finishes (?after=N skips
+                             the first N events)
+    GET  /status             the daemon's pid, uptime and jobs
+    POST /shutdown           stops the daemon after the current job
+
+The settings file is reloaded, and a course's banks are reread, only when
+they change on disk. The CLI forwards a command to a running daemon with
+`--daemon`, from the directory it was given in. Only the most recent
+finished jobs (and their events) are kept.
+
+The daemon only listens on 127.0.0.1, and only answers requests that carry
+its token (as "Authorization: Bearer <token>"), which it writes to
+`daemon.token` next to its settings file when it starts; other local users
+and web pages cannot read it. Every POST must be sent as application/json.
+'''
+import os
+import hmac
+import json
+import time
+import queue
+import secrets
+import threading
+from glob import glob
+from itertools import count
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from waltz.canvas_tools import load_settings
+from waltz.resources import Course, Outcome, WaltzException
+from waltz.quizzes import QuizQuestion
+from waltz.utilities import global_settings, log
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_URL = 'http://{}:{}/'.format(DEFAULT_HOST, DEFAULT_PORT)
+DEFAULT_MAX_FINISHED_JOBS = 100
+VERBS = ('pull', 'push', 'build', 'publicize')
+# The CLI's defaults, for options that a job leaves out; "cwd" is the
+# directory the command was given in (see course_destination)
+JOB_DEFAULTS = {
+    'verb': None, 'course': None, 'all_courses': False, 'jobs': None,
+    'id': None, 'destination': None, 'format': 'raw', 'ignore': False,
+    'quiet': False, 'snapshot': None, 'debounce': 1.0, 'poll': False,
+    'plan': None, 'apply': None, 'offset': None, 'mapping': None,
+    'queue': False, 'cwd': None,
+}
+# Options that name local files, which the daemon may see from elsewhere
+PATH_OPTIONS = ('destination', 'snapshot', 'apply', 'mapping')
+
+
+class Job:
+    def __init__(self, id, options):
+        self.id = id
+        self.options = options
+        self.status = 'queued'
+        self.count = None
+        self.error = None
+        self.events = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def add_event(self, event):
+        with self.changed:
+            self.events.append(event)
+            self.changed.notify_all()
+
+    def start(self):
+        self.started = time.time()
+        self.status = 'running'
+        self.add_event({'type': 'status', 'status': 'running'})
+
+    def finish(self, count=None, error=None):
+        self.finished = time.time()
+        self.count, self.error = count, error
+        self.status = 'failed' if error else 'done'
+        self.add_event({'type': self.status, 'count': count, 'error': error})
+
+    def wait_for_events(self, after, timeout=None):
+        '''
+        Waits until there are events past the first `after`, or the job is
+        done.
+        Returns:
+            (list[dict], bool): The new events, and whether the job is done.
+        '''
+        with self.changed:
+            if len(self.events) <= after and not self.done:
+                self.changed.wait(timeout)
+            return self.events[after:], self.done
+
+    def summary(self):
+        return {'id': self.id, 'verb': self.options.get('verb'),
+                'options': self.options, 'status': self.status,
+                'count': self.count, 'error': self.error,
+                'events': len(self.events), 'created': self.created,
+                'started': self.started, 'finished': self.finished}
+
+
+class JobOutput:
+    '''A file-like object that turns each line written into a job event.'''
+    def __init__(self, job):
+        self.job = job
+        self.pending = ''
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        for line in lines:
+            self.job.add_event({'type': 'output', 'text': line})
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            self.job.add_event({'type': 'output', 'text': self.pending})
+            self.pending = ''
+
+
+def bank_signature(course):
+    '''The size and modification time of every question and outcome bank.'''
+    signature = []
+    for category in (QuizQuestion.canonical_category, Outcome.canonical_category):
+        search_path = os.path.join(course.root_directory, category, '**', '*.yaml')
+        for path in sorted(glob(search_path, recursive=True)):
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def token_path(settings_path):
+    return os.path.join(os.path.dirname(os.path.abspath(settings_path)),
+                        'daemon.token')
+
+
+def write_token(settings_path):
+    '''Writes a new token that only the current user can read.'''
+    token = secrets.token_hex(32)
+    path = token_path(settings_path)
+    if os.path.exists(path):
+        os.remove(path)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'w') as token_file:
+        token_file.write(token)
+    return token
+
+
+def read_token(settings_path):
+    path = token_path(settings_path)
+    try:
+        with open(path) as token_file:
+            return token_file.read().strip()
+    except FileNotFoundError:
+        raise WaltzException("No Waltz daemon token found at {}; is the daemon "
+                             "running with these settings?".format(path))
+
+
+class WaltzDaemon:
+    '''
+    Args:
+        max_finished (int): How many finished jobs are kept; older ones are
+            forgotten, along with their events.
+    '''
+    def __init__(self, settings_path, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 max_finished=DEFAULT_MAX_FINISHED_JOBS):
+        self.settings_path = settings_path
+        self.max_finished = max_finished
+        self.token = None
+        self.settings_mtime = None
+        self.courses = {}
+        self.bank_signatures = {}
+        self.jobs = OrderedDict()
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.started = time.time()
+        handler = type('WaltzDaemonHandler', (WaltzDaemonHandler,),
+                       {'daemon': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.worker = threading.Thread(target=self.work, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def submit(self, options):
+        unknown = set(options) - set(JOB_DEFAULTS)
+        if unknown:
+            raise WaltzException("Unknown options: "+", ".join(sorted(unknown)))
+        if options.get('verb') not in VERBS:
+            raise WaltzException("The verb must be one of: "+", ".join(VERBS))
+        with self.lock:
+            job = Job(str(next(self.ids)), options)
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def status(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        statuses = {}
+        for job in jobs:
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started,
+                'jobs': statuses, 'courses': len(self.courses)}
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            self.run_job(job)
+            self.forget_finished()
+
+    def forget_finished(self):
+        '''Forgets the oldest finished jobs beyond max_finished.'''
+        with self.lock:
+            finished = [id for id, job in self.jobs.items() if job.done]
+            for id in finished[:max(0, len(finished)-self.max_finished)]:
+                del self.jobs[id]
+
+    def refresh_settings(self):
+        mtime = os.stat(self.settings_path).st_mtime_ns
+        if mtime != self.settings_mtime:
+            load_settings(self.settings_path, create_if_not_exists=False)
+            self.settings_mtime = mtime
+
+    def warm_course(self, args, course_name):
+        '''
+        Returns the course's Course from an earlier job, after forgetting
+        its banks if they changed since.
+        '''
+        from waltz.sync import course_destination
+        destination = course_destination(args, course_name)
+        key = (course_name, os.path.abspath(destination))
+        if key not in self.courses:
+            self.courses[key] = Course(destination, course_name)
+        course = self.courses[key]
+        signature = bank_signature(course)
+        if self.bank_signatures.get(key) != signature:
+            QuizQuestion.CACHE.pop(course_name, None)
+            QuizQuestion.FINGERPRINTS.pop(course_name, None)
+            Outcome.CACHE.pop(course_name, None)
+            self.bank_signatures[key] = signature
+        return course
+
+    def run_job(self, job):
+        import argparse
+        from waltz.sync import run_course, select_courses
+        job.start()
+        output = JobOutput(job)
+        try:
+            with redirect_stdout(output):
+                self.refresh_settings()
+                args = argparse.Namespace(**dict(JOB_DEFAULTS, **job.options))
+                global_settings['quiet'] = args.quiet
+                total = 0
+                for course_name in select_courses(args):
+                    course = self.warm_course(args, course_name)
+                    total += run_course(args, course_name, course=course)
+            output.flush()
+            job.finish(count=total)
+        except Exception as e:
+            output.flush()
+            job.finish(error="{}: {}".format(type(e).__name__, e))
+
+    def serve_forever(self):
+        self.refresh_settings()
+        self.token = write_token(self.settings_path)
+        self.worker.start()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self.queue.put(None)
+            self.worker.join()
+            os.remove(token_path(self.settings_path))
+
+    def shutdown(self):
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+class WaltzDaemonHandler(BaseHTTPRequestHandler):
+    daemon = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        # Clients may hang up partway through a stream of events
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json({'errors': [{'message': message}]}, status=status)
+
+    def find_job(self, id):
+        with self.daemon.lock:
+            return self.daemon.jobs.get(id)
+
+    def authorized(self):
+        '''Checks the request's token, answering it with a 401 if it is wrong.'''
+        given = self.headers.get('Authorization', '')
+        expected = 'Bearer {}'.format(self.daemon.token)
+        if self.daemon.token and hmac.compare_digest(given.encode('utf-8'),
+                                                     expected.encode('utf-8')):
+            return True
+        self.send_error_json(401, "Missing or wrong daemon token")
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        split = urlsplit(self.path)
+        parts = [part for part in split.path.split('/') if part]
+        query = dict(parse_qsl(split.query))
+        if parts == ['status']:
+            return self.send_json(self.daemon.status())
+        if parts == ['jobs']:
+            with self.daemon.lock:
+                jobs = list(self.daemon.jobs.values())
+            return self.send_json([job.summary() for job in jobs])
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.find_job(parts[1])
+            if job is None:
+                return self.send_error_json(404, "No such job: "+parts[1])
+            if len(parts) == 2:
+                return self.send_json(job.summary())
+            if parts[2] == 'events':
+                return self.stream_events(job, int(query.get('after', 0)))
+        self.send_error_json(404, "No route for GET "+split.path)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.strip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not self.authorized():
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type != 'application/json':
+            return self.send_error_json(415, "Requests must be application/json")
+        if path == 'jobs':
+            try:
+                job = self.daemon.submit(json.loads(body.decode('utf-8') or '{}'))
+            except (ValueError, WaltzException) as e:
+                return self.send_error_json(400, str(e))
+            return self.send_json(job.summary())
+        if path == 'shutdown':
+            self.send_json({'status': 'stopping'})
+            return self.daemon.shutdown()
+        self.send_error_json(404, "No route for POST /"+path)
+
+    def write_chunk(self, data):
+        self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii')+data+b'\r\n')
+        self.wfile.flush()
+
+    def stream_events(self, job, after):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        done = False
+        while not done:
+            events, done = job.wait_for_events(after, timeout=15)
+            if events:
+                after += len(events)
+                self.write_chunk(b''.join(json.dumps(event).encode('utf-8')+b'\n'
+                                          for event in events))
+        self.write_chunk(b'')
+
+
+def serve(args):
+    daemon = WaltzDaemon(args.settings, port=args.port or DEFAULT_PORT)
+    print("Waltz daemon listening on", daemon.url)
+    daemon.serve_forever()
+
+
+def job_options(args):
+    '''The options of a CLI command, as a job for the daemon.'''
+    options = {key: value for key, value in vars(args).items()
+               if key in JOB_DEFAULTS and value != JOB_DEFAULTS[key]}
+    options['cwd'] = os.getcwd()
+    for key in PATH_OPTIONS:
+        if options.get(key):
+            options[key] = os.path.abspath(options[key])
+    if isinstance(options.get('plan'), str):
+        options['plan'] = os.path.abspath(options['plan'])
+    return options
+
+
+def forward_to_daemon(args):
+    '''
+    Runs a CLI command on a running daemon instead, printing its progress as
+    it happens. The daemon uses its own settings file.
+    Returns:
+        int: How many resources were handled.
+    '''
+    import requests
+    url = args.daemon.rstrip('/')
+    headers = {'Authorization': 'Bearer '+read_token(args.settings)}
+    try:
+        response = requests.post(url+'/jobs', json=job_options(args),
+                                 headers=headers)
+    except requests.ConnectionError:
+        raise WaltzException("No Waltz daemon is running at "+url)
+    job = response.json()
+    if 'errors' in job:
+        raise WaltzException("The daemon refused the job: "+job['errors'][0]['message'])
+    log("Submitted job", job['id'], "to", url)
+    with requests.get('{}/jobs/{}/events'.format(url, job['id']), stream=True,
+                      headers=headers) as events:
+        for line in events.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line.decode('utf-8'))
+            if event['type'] == 'output':
+                print(event['text'])
+            elif event['type'] == 'failed':
+                raise WaltzException("Job {} failed: {}".format(job['id'], event['error']))
+            elif event['type'] == 'done':
+                return event['count']
+    raise WaltzException("Lost track of job {} on the daemon".format(job['id']))
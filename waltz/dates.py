@@ -0,0 +1,228 @@
+'''
+Semester date shifting.
+
+Moves the `due_at`, `unlock_at` and `lock_at` dates of every assignment and
+quiz, either by a fixed offset ("+16w", "-3d 2h") or with a mapping file that
+pairs old calendar days with new ones (keeping each time of day). The new
+dates are worked out from the local YAML files and sent to Canvas with the
+bulk assignment dates endpoint in a few batched requests, instead of a full
+PUT for every resource. The local files are only rewritten once Canvas has
+the new dates, so a run that fails part way can simply be run again without
+shifting anything twice.
+'''
+import io
+import os
+import re
+from glob import glob
+from datetime import datetime, timedelta
+
+from waltz.yaml_setup import yaml
+from waltz.canvas_tools import iter_all, put, progress_loop
+from waltz.utilities import (log, make_safe_filename, FRIENDLY_DATE_FORMAT,
+                             from_friendly_date)
+from waltz.resources import ResourceID, WaltzException, Assignment
+from waltz.quizzes import Quiz
+
+DATE_FIELDS = ('due_at', 'unlock_at', 'lock_at')
+# How many assignments are sent in each bulk update request
+BATCH_SIZE = 50
+OFFSET_UNITS = {'w': 'weeks', 'd': 'days', 'h': 'hours', 'm': 'minutes'}
+OFFSET_PART = re.compile(r'([+-]?\d+)\s*([wdhm]?)')
+
+
+def parse_offset(text):
+    '''
+    Args:
+        text (str): Like "+16w", "-3d 2h" or "7" (days).
+    Returns:
+        timedelta: The offset.
+    '''
+    text = text.strip()
+    sign = -1 if text.startswith('-') else 1
+    text = text.lstrip('+-')
+    parts = OFFSET_PART.findall(text)
+    if not parts or OFFSET_PART.sub('', text).strip():
+        raise WaltzException("Could not understand the offset: "+repr(text))
+    offset = timedelta()
+    for amount, unit in parts:
+        offset += timedelta(**{OFFSET_UNITS[unit or 'd']: abs(int(amount))})
+    return sign * offset
+
+
+def load_date_mapping(path):
+    '''
+    Reads a YAML file that maps old days to new days, like:
+
+        August 24 2020: January 18 2021
+        Sept 7 2020: January 25 2021
+
+    Returns:
+        dict[date, date]: The mapping.
+    '''
+    from dateutil import parser
+    with open(path) as mapping_file:
+        mapping = yaml.load(mapping_file) or {}
+    return {parser.parse(str(old)).date(): parser.parse(str(new)).date()
+            for old, new in mapping.items()}
+
+
+def shift_friendly_date(friendly_date, offset=None, mapping=None):
+    '''
+    Shifts a date in the local files' format. The shift is done on the local
+    wall-clock time, so a 9am deadline stays at 9am across DST changes.
+    Returns:
+        str: The shifted date, or '' if there was no date.
+    '''
+    if not friendly_date:
+        return ''
+    from dateutil import parser
+    local = parser.parse(friendly_date)
+    if mapping and local.date() in mapping:
+        local = datetime.combine(mapping[local.date()], local.time())
+    elif offset is not None:
+        local += offset
+    else:
+        log("No mapping for", friendly_date, "- left unchanged")
+    return local.strftime(FRIENDLY_DATE_FORMAT)
+
+
+def local_files(course, resource_id=None):
+    '''
+    Returns:
+        list[(type, str)]: The resource type and path of every local file
+            whose dates should be shifted.
+    '''
+    if resource_id is None:
+        resource_types = [Assignment, Quiz]
+        pattern = '*'
+    else:
+        category, command, name, resource_type = ResourceID._parse_type(resource_id)
+        if resource_type not in (Assignment, Quiz):
+            raise WaltzException("Only assignments and quizzes have dates: "+resource_id)
+        resource_types = [resource_type]
+        pattern = '*' if command == '*' else make_safe_filename(name)
+    found = []
+    for resource_type in resource_types:
+        search_path = os.path.join(course.root_directory,
+                                   resource_type.canonical_category, '**',
+                                   pattern+resource_type.extension)
+        for path in sorted(glob(search_path, recursive=True)):
+            if not path.endswith('.public.yaml'):
+                found.append((resource_type, path))
+    return found
+
+
+def shift_file(path, offset=None, mapping=None):
+    '''
+    Shifts the dates of a local YAML file, without saving it yet.
+    Returns:
+        (dict, dict): The shifted YAML data, and the new dates (in Canvas'
+            format) for the fields that have one, or no dates at all if
+            none of them changed.
+    '''
+    with open(path) as resource_file:
+        yaml_data = yaml.load(resource_file)
+    timing = yaml_data['settings']['timing']
+    new_dates = {}
+    changed = False
+    for field in DATE_FIELDS:
+        shifted = shift_friendly_date(timing.get(field), offset, mapping)
+        changed = changed or shifted != (timing.get(field) or '')
+        timing[field] = shifted
+        if shifted:
+            new_dates[field] = from_friendly_date(shifted)
+    return yaml_data, new_dates if changed else {}
+
+
+class AssignmentIds:
+    '''
+    Finds the Canvas assignment behind each local file: first from the
+    recorded Canvas state, then (only if needed) from one listing of all the
+    course's assignments, which also covers the assignments behind quizzes.
+    '''
+    def __init__(self, course):
+        self.course = course
+        self.listing = None
+
+    def _list(self):
+        if self.listing is None:
+            self.listing = {Assignment: {}, Quiz: {}}
+            for assignment in iter_all('assignments',
+                                       course=self.course.course_name):
+                owner = Quiz if assignment.get('quiz_id') else Assignment
+                filename = make_safe_filename(assignment['name'])
+                self.listing[owner][filename] = assignment['id']
+        return self.listing
+
+    def find(self, resource_type, path):
+        filename = os.path.basename(path)
+        title = filename[:-len(resource_type.extension)]
+        state = self.course.load_canvas_state(resource_type, filename)
+        if state is not None:
+            if resource_type is Quiz and state.get('assignment_id'):
+                return state['assignment_id']
+            if resource_type is Assignment:
+                return state['id']
+        return self._list()[resource_type].get(title)
+
+
+def bulk_update_dates(course, updates):
+    '''
+    Sends new dates to Canvas, BATCH_SIZE assignments per request, and waits
+    for each batch's progress to complete.
+
+    Args:
+        updates (dict[int, dict]): The new dates for each assignment id.
+    '''
+    ids = sorted(updates)
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = [{'id': id, 'all_dates': [dict(updates[id], base=True)]}
+                 for id in ids[start:start+BATCH_SIZE]]
+        progress = put('assignments/bulk_update', json=batch,
+                       course=course.course_name)
+        if 'errors' in progress:
+            raise WaltzException("Errors in Canvas data: "+repr(progress))
+        log("Sent dates for", len(batch), "assignments")
+        if not progress_loop(progress['id'], DELAY=1):
+            raise WaltzException("Canvas failed to update dates: "+repr(progress))
+
+
+def shift_dates(course, offset=None, mapping=None, resource_id=None):
+    '''
+    Shifts the dates of local assignments and quizzes (all of them, or those
+    matching the resource ID): updates Canvas in bulk, and then saves the
+    local files.
+    Returns:
+        int: How many resources were shifted.
+    '''
+    if offset is None and mapping is None:
+        raise WaltzException("Shifting dates needs an --offset or a --mapping file.")
+    ids = AssignmentIds(course)
+    updates, shifted_files, states = {}, [], []
+    for resource_type, path in local_files(course, resource_id):
+        yaml_data, new_dates = shift_file(path, offset, mapping)
+        # Files without any dates are left alone
+        if not new_dates:
+            continue
+        shifted_files.append((path, yaml_data))
+        assignment_id = ids.find(resource_type, path)
+        if assignment_id is None:
+            log("Not on Canvas yet, so only shifted locally:", path)
+            continue
+        # Quizzes and their assignments share the same dates
+        if updates.get(assignment_id, new_dates) != new_dates:
+            raise WaltzException("Conflicting dates for assignment {}; is it "
+                                 "both a quiz and an assignment locally?"
+                                 .format(assignment_id))
+        updates[assignment_id] = new_dates
+        states.append((resource_type, os.path.basename(path), new_dates))
+    bulk_update_dates(course, updates)
+    for path, yaml_data in shifted_files:
+        out = io.BytesIO()
+        yaml.dump(yaml_data, out)
+        course.write_file(path, out.getvalue())
+        log("Shifted", os.path.relpath(path, course.root_directory))
+    # Keep the recorded Canvas state in step, for later push plans
+    for resource_type, filename, new_dates in states:
+        course.update_canvas_state(resource_type, filename, new_dates)
+    return len(shifted_files)
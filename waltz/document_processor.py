@@ -1,42 +1,45 @@
 """
-HeaderID Extension for Python-Markdown
+Document Extension for Python-Markdown
 ======================================
-Auto-generate id attributes for HTML headers.
-See <https://pythonhosted.org/Markdown/extensions/header_id.html>
-for documentation.
-Original code Copyright 2007-2011 [Waylan Limberg](http://achinghead.com/).
-All changes Copyright 2011-2014 The Python Markdown Project
-License: [BSD](http://www.opensource.org/licenses/bsd-license.php)
+Finishes off a converted document in a single pass over its element tree:
+tables get Bootstrap's table classes, and top-level headers get id
+attributes. The set of used header IDs is local to each run, so there is no
+shared state to reset between documents.
 """
-from __future__ import absolute_import
-from __future__ import unicode_literals
 from markdown.extensions import Extension
 from markdown.treeprocessors import Treeprocessor
 from markdown.util import parseBoolValue
 from markdown.extensions.toc import slugify, unique, stashedHTML2text
-import warnings
 
-class HeaderIdTreeprocessor(Treeprocessor):
-    """ Assign IDs to headers. """
-    IDs = set()
+HEADERS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+
+class DocumentTreeprocessor(Treeprocessor):
+    """ Decorate tables and assign IDs to headers. """
     def run(self, doc):
         start_level, force_id = self._get_meta()
         slugify = self.config['slugify']
         sep = self.config['separator']
+        table_class = self.config['table_class']
+        ids = set()
         for elem in doc:
-            if elem.tag in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+            if elem.tag in HEADERS:
                 if force_id:
                     if "id" in elem.attrib:
                         id = elem.get('id')
                     else:
                         id = stashedHTML2text(''.join(elem.itertext()), self.md)
                         id = slugify(id, sep)
-                    elem.set('id', unique(id, self.IDs))
+                    elem.set('id', unique(id, ids))
                 if start_level:
                     level = int(elem.tag[-1]) + start_level
                     if level > 6:
                         level = 6
                     elem.tag = 'h%d' % level
+            # Tables can be nested anywhere below the top level
+            for child in elem.iter('table'):
+                child.set("class", table_class)
+
     def _get_meta(self):
         """ Return meta data suported by this ext as a tuple """
         level = int(self.config['level']) - 1
@@ -47,32 +50,33 @@ class HeaderIdTreeprocessor(Treeprocessor):
             if 'header_forceid' in self.md.Meta:
                 force = parseBoolValue(self.md.Meta['header_forceid'][0])
         return level, force
-class HeaderIdExtension(Extension):
+
+
+class DocumentExtension(Extension):
     def __init__(self, *args, **kwargs):
         # set defaults
         self.config = {
             'level': ['1', 'Base level for headers.'],
             'forceid': ['True', 'Force all headers to have an id.'],
             'separator': ['-', 'Word separator.'],
-            'slugify': [slugify, 'Callable to generate anchors']
+            'slugify': [slugify, 'Callable to generate anchors'],
+            'table_class': ['table table-striped table-bordered',
+                            'Classes given to every table.'],
         }
-        super(HeaderIdExtension, self).__init__(*args, **kwargs)
-        warnings.warn(
-            'The HeaderId Extension is pending deprecation. Use the TOC Extension instead.',
-            PendingDeprecationWarning
-        )
+        super(DocumentExtension, self).__init__(*args, **kwargs)
+
     def extendMarkdown(self, md, md_globals):
         md.registerExtension(self)
-        self.processor = HeaderIdTreeprocessor()
+        self.processor = DocumentTreeprocessor()
         self.processor.md = md
         self.processor.config = self.getConfigs()
         if 'attr_list' in md.treeprocessors.keys():
             # insert after attr_list treeprocessor
-            md.treeprocessors.add('headerid', self.processor, '>attr_list')
+            md.treeprocessors.add('document', self.processor, '>attr_list')
         else:
             # insert after 'prettify' treeprocessor.
-            md.treeprocessors.add('headerid', self.processor, '>prettify')
-    def reset(self):
-        self.processor.IDs = set()
+            md.treeprocessors.add('document', self.processor, '>prettify')
+
+
 def makeExtension(*args, **kwargs):
-    return HeaderIdExtension(*args, **kwargs)
+    return DocumentExtension(*args, **kwargs)
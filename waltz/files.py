@@ -0,0 +1,377 @@
+'''
+Course files, like images and datasets.
+
+Files are kept under `files/` next to the course, in the same folders they
+have on Canvas, and are matched to Canvas by name. Uploads go through
+Canvas's three steps (see canvas_tools.upload_file), streaming each file
+from a memory map instead of reading it into memory; downloads are
+streamed to disk the same way.
+
+Canvas does not report checksums, so a manifest in `_cache/files.json`
+records the size and MD5 checksum of every file as Waltz last uploaded or
+downloaded it, along with the Canvas file's id and `updated_at`. A file
+whose size and checksum match the Canvas copy is skipped. Up to
+"file-concurrency" (4) files are transferred at once, with a progress bar
+if tqdm is installed.
+'''
+import os
+import json
+import mmap
+import hashlib
+import tempfile
+import threading
+import mimetypes
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+from waltz.canvas_tools import (get, get_session, get_setting, get_request_limiter,
+                                upload_file)
+from waltz.resources import Resource, ResourceID, WaltzException
+from waltz.writer import write_atomically
+from waltz.utilities import (ensure_dir, global_settings, log, indent4,
+                             make_datetime_filename, make_safe_filename)
+
+DEFAULT_FILE_CONCURRENCY = 4
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_LOCK = threading.Lock()
+
+
+class File(Resource):
+    category_names = ["file", "files"]
+    canvas_name = 'files'
+    canonical_category = 'files'
+    canvas_title_field = 'display_name'
+    canvas_id_field = 'id'
+    # Local files keep their own extensions
+    extension = ''
+    __slots__ = ('id', 'display_name', 'filename', 'size', 'url', 'folder_id',
+                 'updated_at')
+
+    @classmethod
+    def from_json(cls, course, json_data):
+        return cls(**json_data, course=course)
+
+
+def manifest_path(course):
+    return os.path.join(course.root_directory, '_cache', 'files.json')
+
+
+def load_manifest(course):
+    path = manifest_path(course)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def update_manifest(course, entries):
+    '''
+    Records the given entries, by their paths, keeping every other one. The
+    manifest is written right away (even during a write-behind), since it is
+    read back by the next transfer.
+    '''
+    with MANIFEST_LOCK:
+        manifest = load_manifest(course)
+        manifest.update(entries)
+        data = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+        write_atomically(manifest_path(course), data)
+
+
+def manifest_key(course, path):
+    return os.path.relpath(path, course.root_directory).replace(os.sep, '/')
+
+
+@contextmanager
+def open_mapped(path, size):
+    '''
+    Yields a read-only memory map of the file (or, since empty files cannot
+    be mapped, empty bytes), so that its pages are only read as needed.
+    '''
+    if not size:
+        yield b''
+        return
+    with open(path, 'rb') as source:
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def local_checksum(path, entry=None):
+    '''
+    The file's checksum is reused from its manifest entry if the file's size
+    and modification time have not changed since.
+    Returns:
+        (int, int, str): The size, modification time and MD5 checksum.
+    '''
+    stat = os.stat(path)
+    if (entry is not None and entry.get('size') == stat.st_size and
+            entry.get('mtime') == stat.st_mtime_ns):
+        return stat.st_size, stat.st_mtime_ns, entry['md5']
+    digest = hashlib.md5()
+    with open_mapped(path, stat.st_size) as data:
+        digest.update(data)
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+def matches_canvas(entry, canvas_data, size, md5):
+    '''Whether a local file with this size and checksum is the Canvas copy.'''
+    if not isinstance(canvas_data, dict) or canvas_data.get('size') != size:
+        return False
+    return (entry is not None and entry.get('md5') == md5 and
+            str(entry.get('id')) == str(canvas_data['id']) and
+            entry.get('updated_at') == canvas_data.get('updated_at'))
+
+
+def manifest_entry(path, md5, canvas_data):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'md5': md5,
+            'id': canvas_data['id'], 'updated_at': canvas_data.get('updated_at')}
+
+
+def folder_paths(course):
+    '''
+    Returns:
+        dict[int, str]: The path of each Canvas folder, relative to the
+            course's files (the root folder is '').
+    '''
+    folders = get('folders', all=True, course=course.course_name)
+    if 'errors' in folders:
+        raise WaltzException("Errors in Canvas data: "+repr(folders))
+    paths = {}
+    for folder in folders:
+        parts = folder['full_name'].split('/', 1)
+        paths[folder['id']] = parts[1] if len(parts) > 1 else ''
+    return paths
+
+
+class Progress:
+    '''
+    Reports the bytes transferred by many files at once as a progress bar,
+    or else (for a single file, a quiet run, or without tqdm) as a line per
+    finished file.
+    '''
+    def __init__(self, verb, files, total):
+        self.verb = verb
+        self.files = files
+        self.finished = 0
+        self.lock = threading.Lock()
+        self.bar = None
+        if files > 1 and tqdm is not None and not global_settings['quiet']:
+            self.bar = tqdm(total=total, unit='B', unit_scale=True,
+                            desc="{} {} files".format(verb, files))
+
+    def advance(self, count):
+        if self.bar is not None:
+            self.bar.update(count)
+
+    def done(self, name):
+        with self.lock:
+            self.finished += 1
+            if self.bar is None:
+                log("Finished", self.verb.lower(),
+                    "{}/{}:".format(self.finished, self.files), name)
+
+    def close(self):
+        if self.bar is not None:
+            self.bar.close()
+
+
+def transfer_all(verb, transfer, items, sizes, jobs):
+    '''
+    Runs the transfer of every item, `jobs` at a time.
+    Returns:
+        dict: The manifest entry of each item that was transferred, by its
+            key, and a list of the errors of the rest.
+    '''
+    progress = Progress(verb, len(items), sum(sizes))
+    entries, errors = {}, []
+
+    def run(item):
+        try:
+            key, entry = transfer(item, progress.advance)
+        except Exception as e:
+            errors.append("{}: {}: {}".format(item.raw, type(e).__name__, e))
+            return
+        entries[key] = entry
+        progress.done(key)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(run, items))
+    finally:
+        progress.close()
+    return entries, errors
+
+
+def file_concurrency(course, jobs=None):
+    if jobs is not None:
+        return jobs
+    return get_setting('file-concurrency', course=course.course_name,
+                       default=DEFAULT_FILE_CONCURRENCY)
+
+
+def local_file_ids(course):
+    '''
+    Matches every local file to its Canvas copy by name, from a single
+    listing; files that are not on Canvas yet are new.
+    '''
+    on_canvas = {make_safe_filename(File.identify_title(data)): data
+                 for data in File.iter_resources_on_canvas(course)}
+    resource_ids = []
+    for filename in sorted(File.scan_disk(course.root_directory)):
+        if filename.startswith('.'):
+            continue
+        if make_safe_filename(filename) != filename:
+            log("Skipping file with an unsafe name:", filename)
+            continue
+        resource_ids.append(ResourceID.from_canvas_data(course, "files/?"+filename,
+                                                        on_canvas.get(filename)))
+    ResourceID.find_all_on_disk(course, resource_ids)
+    return resource_ids
+
+
+def push_files(course, resource_ids=None, jobs=None):
+    '''
+    Uploads the local files whose size or checksum differ from their Canvas
+    copy, streaming each from a memory map.
+    Args:
+        resource_ids (list[ResourceID]): The files to push, or None for
+            every local file.
+    Returns:
+        int: How many files were uploaded.
+    '''
+    if resource_ids is None:
+        resource_ids = local_file_ids(course)
+    files_root = os.path.join(course.root_directory, File.canonical_category)
+    manifest = load_manifest(course)
+    uploads, checksums = [], {}
+    for resource_id in resource_ids:
+        if not os.path.exists(resource_id.path):
+            raise WaltzException("No local file found for: "+resource_id.raw)
+        key = manifest_key(course, resource_id.path)
+        size, mtime, md5 = local_checksum(resource_id.path, manifest.get(key))
+        if not matches_canvas(manifest.get(key), resource_id.canvas_data, size, md5):
+            uploads.append(resource_id)
+            checksums[resource_id.raw] = (size, md5)
+    log("Uploading", len(uploads), "of", len(resource_ids), "files.")
+
+    def upload(resource_id, on_read):
+        size, md5 = checksums[resource_id.raw]
+        # A file on Canvas keeps its name, even if it is not a safe filename
+        if isinstance(resource_id.canvas_data, dict):
+            name = File.identify_title(resource_id.canvas_data)
+        else:
+            name = os.path.basename(resource_id.path)
+        folder = os.path.relpath(os.path.dirname(resource_id.path), files_root)
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        with open_mapped(resource_id.path, size) as data:
+            result = upload_file(name, data, content_type,
+                                 course=course.course_name, size=size,
+                                 parent_folder_path=None if folder == '.' else
+                                 folder.replace(os.sep, '/'),
+                                 on_read=on_read)
+        if 'errors' in result:
+            raise WaltzException("Errors in Canvas data: "+repr(result))
+        resource_id.canvas_data = result
+        course.index.record(File, [result])
+        return (manifest_key(course, resource_id.path),
+                manifest_entry(resource_id.path, md5, result))
+    entries, errors = transfer_all("Uploading", upload, uploads,
+                                   [checksums[resource_id.raw][0] for resource_id in uploads],
+                                   file_concurrency(course, jobs))
+    update_manifest(course, entries)
+    if errors:
+        raise WaltzException("Uploaded {} files, but {} failed:\n{}".format(
+            len(entries), len(errors), indent4("\n".join(errors))))
+    return len(entries)
+
+
+def download(course, url, path, on_read):
+    '''
+    Streams a download into a temporary file beside the path, and then
+    moves it into place; a different old file is moved into the backups.
+    Returns:
+        str: The MD5 checksum of the downloaded file.
+    '''
+    headers = {'Authorization': "Bearer "+get_setting('canvas-token')}
+    digest = hashlib.md5()
+    ensure_dir(path)
+    directory, filename = os.path.split(path)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.'+filename+'.',
+                                             suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as out:
+            with get_request_limiter(), get_session().get(url, headers=headers,
+                                                          stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    out.write(chunk)
+                    digest.update(chunk)
+                    on_read(len(chunk))
+        md5 = digest.hexdigest()
+        if os.path.exists(path):
+            if local_checksum(path)[2] == md5:
+                os.remove(temporary)
+                return md5
+            backup_path = os.path.join(course.backups,
+                                       File.identify_filename(filename),
+                                       make_datetime_filename()+os.path.splitext(path)[1])
+            ensure_dir(backup_path)
+            os.replace(path, backup_path)
+            log("Backed up file: ", path)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return md5
+
+
+def pull_files(course, resource_ids=None, jobs=None):
+    '''
+    Downloads the Canvas files whose local copy is missing or differs.
+    Args:
+        resource_ids (list[ResourceID]): The files to pull, or None for
+            every file on Canvas.
+    Returns:
+        int: How many files were downloaded.
+    '''
+    if resource_ids is None:
+        resource_ids = [ResourceID.from_canvas_data(course, "files/:{}".format(
+                            File.identify_id(data)), data)
+                        for data in File.iter_resources_on_canvas(course)]
+        ResourceID.find_all_on_disk(course, resource_ids)
+    manifest = load_manifest(course)
+    downloads = []
+    for resource_id in resource_ids:
+        key = manifest_key(course, resource_id.path)
+        if os.path.exists(resource_id.path):
+            size, mtime, md5 = local_checksum(resource_id.path, manifest.get(key))
+            if matches_canvas(manifest.get(key), resource_id.canvas_data, size, md5):
+                continue
+        downloads.append(resource_id)
+    log("Downloading", len(downloads), "of", len(resource_ids), "files.")
+    # New files go into the folder they are in on Canvas
+    folders = folder_paths(course) if any(resource_id.is_new for resource_id in downloads) else {}
+
+    def pull(resource_id, on_read):
+        canvas_data = resource_id.canvas_data
+        path = resource_id.path
+        folder = folders.get(canvas_data.get('folder_id'))
+        if resource_id.is_new and folder:
+            path = os.path.join(course.root_directory, File.canonical_category,
+                                folder, resource_id.filename)
+        md5 = download(course, canvas_data['url'], path, on_read)
+        return manifest_key(course, path), manifest_entry(path, md5, canvas_data)
+    entries, errors = transfer_all("Downloading", pull, downloads,
+                                   [resource_id.canvas_data.get('size') or 0
+                                    for resource_id in downloads],
+                                   file_concurrency(course, jobs))
+    update_manifest(course, entries)
+    if errors:
+        raise WaltzException("Downloaded {} files, but {} failed:\n{}".format(
+            len(entries), len(errors), indent4("\n".join(errors))))
+    return len(entries)
@@ -0,0 +1,179 @@
+'''
+An optional GraphQL backend for fetching resources from Canvas.
+
+With the "fetch-backend: graphql" setting, resource types that declare
+`graphql_fields` are listed and looked up through Canvas's GraphQL endpoint
+instead of REST. A listing takes one request per 100 resources, and looking
+up many ids takes one request per 50, instead of one each. The results are
+translated into the JSON the REST API returns, so nothing else can tell
+which backend was used. Searches by name still use REST's `search_term`,
+which needs a single request without listing the whole course.
+
+GraphQL does not provide everything Waltz needs. Types without
+`graphql_fields` always use REST; quizzes are one, since their settings,
+questions and groups only exist in the REST API. If the endpoint is missing
+or rejects a query (e.g., a field this Canvas does not know), the operation
+falls back to REST, even partway through a listing.
+'''
+from waltz.canvas_tools import get_setting, post_graphql, to_canvas_date, iter_pages
+from waltz.resources import WaltzException
+from waltz.utilities import log
+
+PAGE_SIZE = 100
+BATCH_SIZE = 50
+
+
+class GraphQLError(WaltzException):
+    pass
+
+
+def enabled(course, resource_type):
+    '''Whether the resource type should be fetched through GraphQL.'''
+    if resource_type.graphql_fields is None:
+        return False
+    return get_setting('fetch-backend', course=course.course_name,
+                       default='rest') == 'graphql'
+
+
+def selection(resource_type):
+    '''The GraphQL fields to ask for, with nested fields in braces.'''
+    nested = {}
+    fields = []
+    for path in resource_type.graphql_fields.values():
+        if '.' in path:
+            parent, child = path.split('.', 1)
+            if parent not in nested:
+                nested[parent] = []
+                fields.append(parent)
+            nested[parent].append(child)
+        elif path not in fields:
+            fields.append(path)
+    return " ".join(field if field not in nested else
+                    "{} {{ {} }}".format(field, " ".join(nested[field]))
+                    for field in fields)
+
+
+def _convert(field, value):
+    # Canvas's REST API has numeric ids and UTC dates
+    if value is None:
+        return None
+    if field == 'id' or field.endswith('_id'):
+        return int(value) if str(value).isdigit() else value
+    if field.endswith('_at'):
+        from dateutil import parser, tz
+        return to_canvas_date(parser.parse(value).astimezone(tz.tzutc()))
+    return value
+
+
+def to_rest(resource_type, node):
+    '''Translates a GraphQL node into the JSON the REST API would return.'''
+    result = {}
+    for field, path in resource_type.graphql_fields.items():
+        value = node
+        for part in path.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        result[field] = _convert(field, value)
+    return result
+
+
+def run_query(course, query, variables):
+    response = post_graphql(query, variables, course=course.course_name)
+    if not isinstance(response, dict) or response.get('errors') or 'data' not in response:
+        raise GraphQLError("GraphQL query failed: "+repr(response))
+    return response['data']
+
+
+def course_variable(course):
+    return str(get_setting('id', course=course.course_name))
+
+
+def list_page(course, resource_type, after=None):
+    '''
+    Returns:
+        (list[dict], str): The REST JSON of a page of the listing, and the
+            cursor of the next page (None on the last page).
+    '''
+    query = '''query WaltzList($course: ID!, $after: String) {{
+      course(id: $course) {{
+        {connection}(first: {size}, after: $after) {{
+          nodes {{ {fields} }}
+          pageInfo {{ hasNextPage endCursor }}
+        }}
+      }}
+    }}'''.format(connection=resource_type.graphql_connection, size=PAGE_SIZE,
+                 fields=selection(resource_type))
+    data = run_query(course, query, {'course': course_variable(course),
+                                     'after': after})
+    if data.get('course') is None:
+        raise GraphQLError("Course not found through GraphQL: "+course.course_name)
+    connection = data['course'][resource_type.graphql_connection]
+    page = [to_rest(resource_type, node) for node in connection['nodes']]
+    info = connection['pageInfo']
+    return page, info['endCursor'] if info['hasNextPage'] else None
+
+
+def iter_resource_pages(course, resource_type):
+    '''
+    Returns:
+        generator or None: The pages of the listing, like
+            canvas_tools.iter_pages, or None if GraphQL cannot list this
+            type (so that REST can be used instead).
+    '''
+    try:
+        first, after = list_page(course, resource_type)
+    except GraphQLError as e:
+        log("Listing", resource_type.canvas_name, "with REST instead:", e)
+        return None
+
+    def pages(page, after):
+        seen = set()
+        while True:
+            seen.update(resource_type.identify_id(result) for result in page)
+            yield page
+            if after is None:
+                return
+            try:
+                page, after = list_page(course, resource_type, after)
+            except GraphQLError as e:
+                error = e
+                break
+        # The rest of the listing comes from REST, without what was yielded
+        log("Listing the rest of", resource_type.canvas_name, "with REST instead:",
+            error)
+        for page in iter_pages(resource_type.canvas_name, course=course.course_name):
+            if 'errors' in page:
+                yield page
+                return
+            yield [result for result in page
+                   if resource_type.identify_id(result) not in seen]
+    return pages(first, after)
+
+
+def get_resources(course, resource_type, ids):
+    '''
+    Looks up many resources at once, BATCH_SIZE per query.
+    Returns:
+        dict or None: The REST JSON of each id that was found, or None if
+            GraphQL cannot look up this type.
+    '''
+    found = {}
+    ids = [str(id) for id in ids]
+    try:
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start+BATCH_SIZE]
+            query = "query WaltzGet({}) {{ {} }}".format(
+                ", ".join("$i{}: ID!".format(index) for index in range(len(batch))),
+                " ".join("r{index}: {node}(id: $i{index}) {{ {fields} }}".format(
+                    index=index, node=resource_type.graphql_node,
+                    fields=selection(resource_type))
+                    for index in range(len(batch))))
+            data = run_query(course, query, {'i{}'.format(index): id
+                                             for index, id in enumerate(batch)})
+            for index, id in enumerate(batch):
+                node = data.get('r{}'.format(index))
+                if node is not None:
+                    found[id] = to_rest(resource_type, node)
+    except GraphQLError as e:
+        log("Looking up", resource_type.canvas_name, "with REST instead:", e)
+        return None
+    return found
@@ -0,0 +1,225 @@
+"""
+Highlight Cache Extension for Python-Markdown
+=============================================
+Remembers the HTML that Pygments produced for each code block, so that
+unchanged code is never highlighted twice. Blocks are keyed by their source,
+language and every formatter option, and kept in a SQLite file (normally
+`_cache/highlight.sqlite` next to the course), which is shared by every
+document converted with it. The least recently used blocks are evicted once
+the cache holds more than `max_entries` of them.
+
+Each Course opens its own cache (see Course.cache_highlighting), which is
+given to this extension by m2h. The extension wraps the fenced_code and
+codehilite processors so that they only highlight the blocks missing from
+the cache; without a cache, they behave like the originals. When
+highlighting with CSS classes, the spans of classes without any style are
+dropped (see waltz.stylesheet).
+"""
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHiliteExtension, HiliteTreeprocessor
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+
+from waltz.utilities import ensure_dir
+
+DEFAULT_MAX_ENTRIES = 5000
+
+
+class HighlightCache:
+    '''
+    Args:
+        path (str): The SQLite file holding the highlighted blocks.
+        max_entries (int): How many blocks are kept when the cache is flushed.
+    '''
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        ensure_dir(path)
+        self.connection = sqlite3.connect(path, timeout=30,
+                                          check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS blocks (
+            key TEXT PRIMARY KEY, html TEXT NOT NULL, used REAL NOT NULL)''')
+        self.connection.commit()
+        # Blocks seen during this run, and which of them are not stored yet
+        self.memory = {}
+        self.added = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.hits += 1
+                return self.memory[key]
+            row = self.connection.execute('SELECT html FROM blocks WHERE key=?',
+                                          (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.memory[key] = row[0]
+            return row[0]
+
+    def put(self, key, html):
+        with self.lock:
+            self.memory[key] = html
+            self.added.add(key)
+
+    def flush(self):
+        '''
+        Stores the new blocks, marks every block used in this run as recently
+        used, and evicts the least recently used blocks beyond the limit.
+        '''
+        with self.lock:
+            if not self.memory:
+                return
+            # Later uses within this run count as more recent
+            now = time.time()
+            used = {key: now + index*1e-6
+                    for index, key in enumerate(self.memory)}
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO blocks (key, html, used) VALUES (?, ?, ?)',
+                [(key, self.memory[key], used[key]) for key in self.added])
+            self.connection.executemany(
+                'UPDATE blocks SET used=? WHERE key=?',
+                [(used[key], key) for key in self.memory if key not in self.added])
+            self.connection.execute('''DELETE FROM blocks WHERE key NOT IN (
+                SELECT key FROM blocks ORDER BY used DESC LIMIT ?)''', (self.max_entries,))
+            self.connection.commit()
+            self.memory = {}
+            self.added = set()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def cache_key(*options):
+    '''A key for a highlighted block: its source and every option that shapes it.'''
+    try:
+        from pygments import __version__ as pygments_version
+    except ImportError:
+        pygments_version = None
+    options = list(options) + [pygments_version]
+    return hashlib.sha1(json.dumps(options).encode('utf-8')).hexdigest()
+
+
+class CachedHighlighting:
+    '''
+    Lets the standard processor highlight code blocks, but only the blocks
+    that the cache does not have yet: the others are swapped for their HTML
+    beforehand. The blocks it highlights are stored in Markdown's htmlStash
+    in document order, so they are matched back up with their keys to be
+    finished (see waltz.stylesheet) and cached.
+    '''
+    def __init__(self, md, cache=None):
+        super(CachedHighlighting, self).__init__(md)
+        self.cache = cache
+
+    def reuse(self, key):
+        '''Returns the placeholder of a cached block, or None.'''
+        html = self.cache.get(key) if self.cache is not None else None
+        if html is None:
+            return None
+        return self.markdown.htmlStash.store(html, safe=True)
+
+    def store_highlighted(self, keys, first, style, noclasses, use_pygments):
+        '''Finishes and caches the blocks stashed from index `first` on.'''
+        stash = self.markdown.htmlStash
+        for key, index in zip(keys, range(first, stash.html_counter)):
+            html, safe = stash.rawHtmlBlocks[index]
+            if use_pygments and not noclasses:
+                from waltz.stylesheet import strip_unstyled_spans
+                html = strip_unstyled_spans(html, style)
+                stash.rawHtmlBlocks[index] = (html, safe)
+            if self.cache is not None:
+                self.cache.put(key, html)
+
+
+class CachedFencedBlockPreprocessor(CachedHighlighting, FencedBlockPreprocessor):
+    """ Fenced code blocks, highlighted through the cache. """
+    CONFIG = ('linenums', 'guess_lang', 'css_class', 'pygments_style',
+              'use_pygments', 'noclasses')
+
+    def run(self, lines):
+        config = None
+        for ext in self.markdown.registeredExtensions:
+            if isinstance(ext, CodeHiliteExtension):
+                config = {name: ext.config[name][0] for name in self.CONFIG}
+                break
+        if config is None:
+            return super(CachedFencedBlockPreprocessor, self).run(lines)
+        keys = []
+
+        def replace(match):
+            key = cache_key(match.group('code'), match.group('lang'),
+                            match.group('hl_lines'),
+                            *[config[name] for name in self.CONFIG])
+            placeholder = self.reuse(key)
+            if placeholder is None:
+                keys.append(key)
+                return match.group(0)
+            return '\n{}\n'.format(placeholder)
+        text = self.FENCED_BLOCK_RE.sub(replace, "\n".join(lines))
+        first = self.markdown.htmlStash.html_counter
+        lines = super(CachedFencedBlockPreprocessor, self).run(text.split("\n"))
+        self.store_highlighted(keys, first, config['pygments_style'],
+                               config['noclasses'], config['use_pygments'])
+        return lines
+
+
+class CachedHiliteTreeprocessor(CachedHighlighting, HiliteTreeprocessor):
+    """ Indented code blocks, highlighted through the cache. """
+    CONFIG = ('linenums', 'guess_lang', 'css_class', 'pygments_style',
+              'noclasses', 'use_pygments')
+
+    def run(self, root):
+        keys = []
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code':
+                key = cache_key(block[0].text, self.markdown.tab_length,
+                                *[self.config[name] for name in self.CONFIG])
+                placeholder = self.reuse(key)
+                if placeholder is None:
+                    keys.append(key)
+                else:
+                    # Just as the standard processor leaves a highlighted block
+                    block.clear()
+                    block.tag = 'p'
+                    block.text = placeholder
+        first = self.markdown.htmlStash.html_counter
+        super(CachedHiliteTreeprocessor, self).run(root)
+        self.store_highlighted(keys, first, self.config['pygments_style'],
+                               self.config['noclasses'], self.config['use_pygments'])
+
+
+class HighlightCacheExtension(Extension):
+    '''
+    Args:
+        cache (HighlightCache): Where highlighted blocks are reused from and
+            stored; without one, blocks are highlighted as usual.
+    '''
+    def __init__(self, cache=None, **kwargs):
+        self.cache = cache
+        super(HighlightCacheExtension, self).__init__(**kwargs)
+
+    def extendMarkdown(self, md, md_globals):
+        md.registerExtension(self)
+        # Both processors keep their place in the pipeline
+        if 'fenced_code_block' in md.preprocessors.keys():
+            md.preprocessors['fenced_code_block'] = CachedFencedBlockPreprocessor(
+                md, self.cache)
+        if 'hilite' in md.treeprocessors.keys():
+            hiliter = CachedHiliteTreeprocessor(md, self.cache)
+            hiliter.config = md.treeprocessors['hilite'].config
+            md.treeprocessors['hilite'] = hiliter
+
+
+def makeExtension(*args, **kwargs):
+    return HighlightCacheExtension(*args, **kwargs)
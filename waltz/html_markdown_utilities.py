@@ -1,14 +1,21 @@
-from html2text import HTML2Text
-from markdown import markdown
-
 # HTML to MARKDOWN
 # h2m
+import threading
+
+# html2text and markdown are imported on first use; they are only needed by
+# verbs that actually convert content. HTML2Text keeps parsing state on
+# itself, so every thread gets its own converter.
+converters = threading.local()
 
-html_to_markdown = HTML2Text()
-html_to_markdown.single_line_break= False
-html_to_markdown.skip_internal_links = False
-html_to_markdown._skip_a_class_check = False
-html_to_markdown._class_stack = []
+def make_html_to_markdown():
+    from html2text import HTML2Text
+    converter = HTML2Text()
+    converter.single_line_break= False
+    converter.skip_internal_links = False
+    converter._skip_a_class_check = False
+    converter._class_stack = []
+    converter.tag_callback = handle_custom_tags
+    return converter
 
 def handle_custom_tags(self, tag, attrs, start):
     if self._skip_a_class_check:
@@ -68,11 +75,12 @@ def handle_custom_tags(self, tag, attrs, start):
     else:
         return False
 
-html_to_markdown.tag_callback = handle_custom_tags
-
 def h2m(html):
     if not html:
         return ""
+    html_to_markdown = getattr(converters, 'html_to_markdown', None)
+    if html_to_markdown is None:
+        html_to_markdown = converters.html_to_markdown = make_html_to_markdown()
     m = html_to_markdown.handle(html)
     in_fenced_code = False
     skip = 0
@@ -103,16 +111,35 @@ my_extras = {
     'header-ids': True,
     'tables': True
 }
-def markdowner(text, extension_directory='waltz.'):
+# Code is highlighted either with inline styles on every token ("inline"),
+# or with short class names that a shared stylesheet styles ("classes").
+# Each Course keeps its own copy (see Course.set_highlight_mode).
+HIGHLIGHT_MODES = ('inline', 'classes')
+DEFAULT_HIGHLIGHT_SETTINGS = {'mode': 'inline', 'style': 'default',
+                              'css_class': 'codehilite'}
+
+def markdowner(text, course=None, extension_directory='waltz.'):
+    '''
+    Args:
+        course (Course): Whose highlight settings and cache, if any, are used.
+    '''
+    from markdown import markdown
+    settings = (course.highlight_settings if course is not None
+                else DEFAULT_HIGHLIGHT_SETTINGS)
+    cache_extension = extension_directory+'highlight_cache:HighlightCacheExtension'
     return markdown(text, extensions=[
         'fenced_code', 'attr_list',
         'tables', 'codehilite',
+        cache_extension,
         extension_directory+'iconfonts:IconFontsExtension',
-        extension_directory+'headerid:HeaderIdExtension',
-        extension_directory+'decorate_tables:TableDecoratorExtension'
+        extension_directory+'document_processor:DocumentExtension'
     ], extension_configs={
         'codehilite': {
-        'noclasses': True
+        'noclasses': settings['mode'] == 'inline',
+        'pygments_style': settings['style'],
+        'css_class': settings['css_class']
+    }, cache_extension: {
+        'cache': course.highlight_cache if course is not None else None
     }})
 
 m2h = markdowner
@@ -0,0 +1,135 @@
+'''
+A persistent index of the titles and ids of a course's resources on Canvas.
+
+The index lives in `_cache/index.sqlite` next to the course, and lets `?name`
+resource IDs be resolved without searching Canvas. It is kept up to date
+from what Waltz already downloads: every listing (e.g., during a pull)
+refreshes the rows of its category, removing resources that are gone, and
+every live search, pull and push records what it saw. Only rows whose title
+or `updated_at` changed are rewritten.
+
+Names are matched like everywhere else (see resources.find_by_title): any
+title containing the name, ignoring case. They are only answered from the
+index once a category has been listed completely, and only when something
+matches; otherwise Canvas is searched, in case the resource is new.
+'''
+import os
+import time
+import sqlite3
+import threading
+
+from waltz.utilities import ensure_dir
+
+
+class ResourceIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        ensure_dir(path)
+        self.connection = sqlite3.connect(path, timeout=30,
+                                          check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS resources (
+            category TEXT NOT NULL, id TEXT NOT NULL, title TEXT NOT NULL,
+            lower_title TEXT NOT NULL, updated_at TEXT,
+            PRIMARY KEY (category, id))''')
+        # The categories that were listed completely, and when
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS listings (
+            category TEXT PRIMARY KEY, listed_at REAL NOT NULL)''')
+        self.connection.commit()
+
+    @staticmethod
+    def _row(resource_type, json_data):
+        return (resource_type.canonical_category,
+                str(resource_type.identify_id(json_data)),
+                resource_type.identify_title(json_data),
+                resource_type.identify_title(json_data).lower(),
+                json_data.get('updated_at'))
+
+    def is_listed(self, resource_type):
+        '''Whether the category was ever listed completely (see finish_listing).'''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM listings WHERE category=?',
+                (resource_type.canonical_category,)).fetchone()
+        return row is not None
+
+    def find(self, resource_type, name):
+        '''
+        Returns:
+            list[dict]: A stand-in for the Canvas JSON of every indexed
+                resource whose title contains the name (ignoring case),
+                holding just its title, id and `updated_at`.
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                '''SELECT id, title, updated_at FROM resources
+                   WHERE category=? AND instr(lower_title, ?) > 0''',
+                (resource_type.canonical_category, name.lower())).fetchall()
+        return [{resource_type.canvas_id_field: id,
+                 resource_type.canvas_title_field: title,
+                 'updated_at': updated_at}
+                for id, title, updated_at in rows]
+
+    def listing(self, resource_type):
+        '''
+        Returns:
+            list[dict]: A stand-in (as in find) for every indexed resource
+                of the type.
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                '''SELECT id, title, updated_at FROM resources
+                   WHERE category=? ORDER BY title''',
+                (resource_type.canonical_category,)).fetchall()
+        return [{resource_type.canvas_id_field: id,
+                 resource_type.canvas_title_field: title,
+                 'updated_at': updated_at}
+                for id, title, updated_at in rows]
+
+    def record(self, resource_type, items):
+        '''Adds or updates the given Canvas JSON items.'''
+        rows = [self._row(resource_type, item) for item in items]
+        with self.lock:
+            self.connection.executemany(
+                '''INSERT OR IGNORE INTO resources
+                   (category, id, title, lower_title, updated_at)
+                   VALUES (?, ?, ?, ?, ?)''', rows)
+            self.connection.executemany(
+                '''UPDATE resources SET title=?, lower_title=?, updated_at=?
+                   WHERE category=? AND id=?
+                   AND (title != ? OR updated_at IS NOT ?)''',
+                [(title, lower_title, updated_at, category, id, title, updated_at)
+                 for category, id, title, lower_title, updated_at in rows])
+            self.connection.commit()
+
+    def forget(self, resource_type, id):
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM resources WHERE category=? AND id=?',
+                (resource_type.canonical_category, str(id)))
+            self.connection.commit()
+
+    def finish_listing(self, resource_type, ids):
+        '''
+        After a complete listing of a category, removes the resources that
+        were not in it.
+        '''
+        category = resource_type.canonical_category
+        seen = {str(id) for id in ids}
+        with self.lock:
+            known = [id for (id,) in self.connection.execute(
+                'SELECT id FROM resources WHERE category=?', (category,))]
+            self.connection.executemany(
+                'DELETE FROM resources WHERE category=? AND id=?',
+                [(category, id) for id in known if id not in seen])
+            self.connection.execute(
+                'INSERT OR REPLACE INTO listings (category, listed_at) VALUES (?, ?)',
+                (category, time.time()))
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def index_path(root_directory):
+    return os.path.join(root_directory, '_cache', 'index.sqlite')
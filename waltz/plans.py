@@ -0,0 +1,332 @@
+'''
+Offline push plans (dry runs).
+
+A plan loads resources from disk, compares them against the last Canvas
+state that was recorded locally (by a pull or push, or in a snapshot), and
+lists every request that a real push would make: the reads it would do
+first, and the create/update/delete operations it would issue. No network
+access is needed to build a plan. Plans can be saved as JSON and applied
+later, which replays the write operations without recomputing anything.
+'''
+import os
+import json
+import math
+from glob import glob
+
+from waltz.canvas_tools import post, put, delete
+from waltz.resources import (ResourceID, WaltzException, WaltzNoResourceFound,
+                             RESOURCE_TYPES)
+from waltz.files import File
+from waltz.utilities import make_safe_filename, indent4
+
+VERBS = {'POST': post, 'PUT': put, 'DELETE': delete}
+
+
+class ResourcePlan:
+    '''The reads and writes needed to push a single resource.'''
+    # Placeholder for the Canvas id of a resource that does not exist yet
+    RESOURCE = '{resource}'
+    PAGE_SIZE = 100
+
+    def __init__(self, resource_id, reads=None, operations=None):
+        self.resource_id = resource_id
+        self.reads = reads or []
+        self.operations = operations or []
+
+    @classmethod
+    def listing_requests(cls, count):
+        return max(1, int(math.ceil(count / cls.PAGE_SIZE)))
+
+    @staticmethod
+    def reference(name):
+        '''A value that will only be known once an earlier operation has run.'''
+        return {'$ref': name}
+
+    def add_read(self, description, count=1):
+        self.reads.append([description, count])
+
+    def add(self, verb, endpoint, data, description, changes=None,
+            provides=None):
+        '''
+        Args:
+            provides (tuple): A reference name and the path into the response
+                where its value can be found, for later operations to use.
+        '''
+        operation = {'verb': verb, 'endpoint': endpoint, 'data': data,
+                     'description': description}
+        if changes is not None:
+            operation['changes'] = changes
+        if provides is not None:
+            operation['provides'] = {'name': provides[0], 'path': provides[1]}
+        self.operations.append(operation)
+
+    @property
+    def estimated_requests(self):
+        return sum(count for _, count in self.reads) + len(self.operations)
+
+    def to_json(self):
+        return {'resource_id': self.resource_id, 'reads': self.reads,
+                'operations': self.operations}
+
+    def describe(self):
+        lines = ["{} ({} requests)".format(self.resource_id, self.estimated_requests)]
+        for description, count in self.reads:
+            lines.append(indent4("READ   {} x{}".format(description, count)))
+        for operation in self.operations:
+            line = "{:<6} {}  [{}]".format(operation['verb'],
+                                           operation['description'],
+                                           operation['endpoint'])
+            if operation.get('changes'):
+                line += "\n" + indent4(indent4("changes: " + ", ".join(operation['changes'])))
+            lines.append(indent4(line))
+        return "\n".join(lines)
+
+    def _resolve(self, value, references):
+        if isinstance(value, dict) and '$ref' in value:
+            if value['$ref'] not in references:
+                raise WaltzException("Plan reference was never provided: "+value['$ref'])
+            return references[value['$ref']]
+        return value
+
+    def apply(self, course_name):
+        '''
+        Returns:
+            dict: The Canvas JSON of the resource, as returned by its first
+                operation (which creates or updates it).
+        '''
+        references = {}
+        resource = None
+        for operation in self.operations:
+            endpoint = operation['endpoint']
+            if self.RESOURCE in endpoint:
+                endpoint = endpoint.replace(self.RESOURCE,
+                                            str(references['resource']))
+            data = operation['data']
+            if data is not None:
+                data = {key: self._resolve(value, references)
+                        for key, value in data.items()}
+            result = VERBS[operation['verb']](endpoint, data=data,
+                                              course=course_name)
+            if isinstance(result, dict) and 'errors' in result:
+                raise WaltzException("Errors in Canvas data: "+repr(result))
+            if resource is None:
+                resource = result
+            provides = operation.get('provides')
+            if provides:
+                value = result
+                for step in provides['path']:
+                    value = value[step]
+                references[provides['name']] = value
+        return resource
+
+
+class PushPlan:
+    '''A serializable plan for pushing one or more resources of a course.'''
+    def __init__(self, course_name, resources=None):
+        self.course_name = course_name
+        self.resources = resources or []
+
+    @property
+    def estimated_requests(self):
+        return sum(resource.estimated_requests for resource in self.resources)
+
+    def describe(self):
+        sections = [resource.describe() for resource in self.resources]
+        sections.append("Estimated requests: {}".format(self.estimated_requests))
+        return "\n".join(sections)
+
+    def to_json(self):
+        return {'course': self.course_name,
+                'estimated_requests': self.estimated_requests,
+                'resources': [resource.to_json() for resource in self.resources]}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['course'], [ResourcePlan(**resource)
+                                    for resource in data['resources']])
+
+    def save(self, path):
+        with open(path, 'w') as out:
+            json.dump(self.to_json(), out, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as plan_file:
+            return cls.from_json(json.load(plan_file))
+
+    def apply(self, course):
+        '''
+        Performs every operation, and records the Canvas data each resource
+        ends up with, as a real push would. The first operation only returns
+        the resource itself, so its parts (like a quiz's questions and
+        groups) are fetched again before they are recorded.
+        '''
+        for resource in self.resources:
+            canvas_data = resource.apply(self.course_name)
+            if isinstance(canvas_data, dict):
+                resource_id = ResourceID.from_canvas_data(
+                    course, resource.resource_id, canvas_data)
+                resource_id.resource_type.extra_pull(course, resource_id)
+                course.record_canvas_state(resource_id)
+
+
+def recorded_states(course, resource_type):
+    '''
+    Returns:
+        list[dict]: The last recorded Canvas data of every resource of the
+            type.
+    '''
+    if course.snapshot is not None:
+        return [entry.canvas_data for entry in
+                course.snapshot.entries(resource_type.canonical_category)]
+    return list(course.iter_canvas_states(resource_type))
+
+
+def find_known_state(course, raw):
+    '''
+    Resolves a resource ID against the recorded Canvas data the same way a
+    push resolves it against Canvas: `?name` matches any title containing
+    the name (and must match just one), and `+name` must match none.
+    Returns:
+        dict or None: The last recorded Canvas data for the resource ID.
+    '''
+    category, command, name, resource_type = ResourceID._parse_type(raw)
+    if command == ':':
+        if course.snapshot is not None:
+            entry = course.snapshot.by_id(resource_type.canonical_category, name)
+            return entry.canvas_data if entry else None
+        return course.find_canvas_state_by_id(resource_type, name)
+    resource_id = ResourceID(course, raw)
+    resource_id._resolve_from_listing(recorded_states(course, resource_type))
+    return None if resource_id.canvas_data is True else resource_id.canvas_data
+
+
+def find_file_state(course, resource_type, filename):
+    '''
+    Matches a local file to the recorded Canvas data of the resource whose
+    title makes its filename, the way pushing a whole course matches them.
+    Returns:
+        dict or None: The last recorded Canvas data for the file.
+    '''
+    if course.snapshot is not None:
+        found = [data for data in recorded_states(course, resource_type)
+                 if make_safe_filename(resource_type.identify_title(data)) +
+                 resource_type.extension == filename]
+        return found[0] if len(found) == 1 else None
+    return course.load_canvas_state(resource_type, filename)
+
+
+def _simplify(value):
+    if isinstance(value, bool):
+        return str(value).lower()
+    if value in (None, ''):
+        return ''
+    return str(value)
+
+
+def changed_fields(json_data, canvas_data):
+    '''
+    Compares a PUT payload (like {'quiz[title]': ...}) with the known Canvas
+    JSON and names the fields that would actually change.
+    '''
+    changes = []
+    for key, value in json_data.items():
+        field = key.split('[', 1)[-1].rstrip(']') if '[' in key else key
+        if field not in canvas_data:
+            continue
+        if _simplify(value) != _simplify(canvas_data[field]):
+            changes.append(field)
+    return changes
+
+
+def plan_resource(course, raw, filename=None):
+    '''
+    Args:
+        filename (str): The local file of the resource, when it was found
+            by listing the files of its category; it is then matched to its
+            recorded Canvas data by filename instead of by resolving `raw`.
+    '''
+    category, command, name, resource_type = ResourceID._parse_type(raw)
+    if resource_type is File:
+        raise WaltzException("Files cannot be planned, since they are compared "
+                             "by checksum when pushed: "+raw)
+    if filename is None:
+        known = find_known_state(course, raw)
+    else:
+        known = find_file_state(course, resource_type, filename)
+    if command == '+' and known is not None:
+        raise WaltzException("Resource {} already exists".format(name))
+    if command in '?:' and known is None:
+        raise WaltzNoResourceFound("No recorded Canvas state for {}; pull it "
+                                   "first (or use a snapshot).".format(raw))
+    resource_id = ResourceID.from_canvas_data(course, raw, known)
+    plan = ResourcePlan(raw)
+    # The reads that push_resource does before changing anything
+    if command == ':':
+        plan.add_read("Get {}/{}".format(resource_type.canvas_name, name))
+    else:
+        plan.add_read("Search {} for {!r}".format(resource_type.canvas_name, name))
+    # Load the local copy and work out what would be sent
+    resource = course.from_disk(resource_id)
+    if resource is None:
+        raise WaltzException("No local file found for: "+raw)
+    json_data = course.to_json(resource_id, resource)
+    if resource_id.canvas_id is None:
+        plan.add('POST', resource_type.canvas_name, json_data,
+                 "Create {} {}".format(category, resource_id.canvas_title),
+                 provides=('resource', [resource_type.canvas_id_field]))
+    else:
+        plan.add('PUT', "{}/{}".format(resource_type.canvas_name, resource_id.canvas_id),
+                 json_data,
+                 "Update {} {}".format(category, resource_id.canvas_title),
+                 changes=changed_fields(json_data, known))
+    resource.plan_extra_push(plan, course, resource_id)
+    return plan
+
+
+def local_resource_ids(course, raw):
+    '''Expands "category/*" into a "?title" resource ID per local file.'''
+    return [resource_id for resource_id, filename in local_resources(course, raw)]
+
+
+def local_resources(course, raw):
+    '''
+    Like local_resource_ids, but with the filename of each resource ID.
+    Returns:
+        list[(str, str)]: Each resource ID, with its filename (or None if
+            the ID was given instead of found).
+    '''
+    category, command, name, resource_type = ResourceID._parse_type(raw)
+    if command != '*':
+        return [(raw, None)]
+    search_path = os.path.join(course.root_directory,
+                               resource_type.canonical_category,
+                               '**', '*'+resource_type.extension)
+    ids = []
+    for path in sorted(glob(search_path, recursive=True)):
+        filename = os.path.basename(path)
+        if filename.endswith('.public.yaml') or not os.path.isfile(path):
+            continue
+        # Files keep their own extensions, so theirs is empty
+        title = filename[:len(filename)-len(resource_type.extension)]
+        ids.append(("{}/?{}".format(category, title), filename))
+    return ids
+
+
+def plan_push(course, raw=None):
+    '''
+    Builds a plan for pushing a resource ID (which may be "category/*") or a
+    list of them, or every local resource if no ID is given.
+    '''
+    if raw is None:
+        raws = [category+"/*" for category, resource_type in sorted(RESOURCE_TYPES.items())
+                if resource_type is not File]
+    elif isinstance(raw, str):
+        raws = [raw]
+    else:
+        raws = list(raw)
+    plan = PushPlan(course.course_name)
+    for pattern in raws:
+        for resource_id, filename in local_resources(course, pattern):
+            plan.resources.append(plan_resource(course, resource_id, filename))
+    return plan
@@ -0,0 +1,185 @@
+'''
+Publicizing many resources at once.
+
+Public versions are built only from local files: each resource is found on
+disk, loaded with `from_disk`, converted with `to_public` in a pool of
+worker processes (see the "publicize-workers" setting), and written next to
+its source as `.public.yaml`. A manifest in `_cache/publicize.json` records
+the checksums of every source and public file, so that unchanged sources
+are skipped on the next run.
+'''
+import os
+import json
+import hashlib
+from glob import glob
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from waltz.resources import (RESOURCE_CATEGORIES, RESOURCE_TYPES, Course,
+                             ResourceID, WaltzException, WaltzNoResourceFound)
+from waltz.canvas_tools import get_setting, settings, use_settings
+from waltz.utilities import global_settings, log
+
+
+def publicizable_categories():
+    '''Returns the categories whose resources have a public version.'''
+    return [category for category, resource_type in sorted(RESOURCE_TYPES.items())
+            if hasattr(resource_type, 'to_public')]
+
+
+def local_sources(course, raw=None):
+    '''
+    Args:
+        raw (str): A "category/*" resource ID, or None (or "all") for every
+            category that can be publicized.
+    Returns:
+        list[(str, str)]: The category and path of every local source file.
+    '''
+    if raw is None or raw == 'all':
+        categories = publicizable_categories()
+    else:
+        category, command, name, resource_type = ResourceID._parse_type(raw)
+        if not hasattr(resource_type, 'to_public'):
+            raise WaltzException("{} cannot be publicized: {}".format(
+                resource_type.canonical_category, raw))
+        categories = [category]
+    sources = []
+    for category in categories:
+        resource_type = RESOURCE_CATEGORIES[category]
+        search_path = os.path.join(course.root_directory,
+                                   resource_type.canonical_category,
+                                   '**', '*'+resource_type.extension)
+        for path in sorted(glob(search_path, recursive=True)):
+            if not path.endswith('.public.yaml'):
+                sources.append((category, path))
+    return sources
+
+
+def public_path(path):
+    return str(Path(path).with_suffix('.public.yaml'))
+
+
+def checksum(path):
+    with open(path, 'rb') as source_file:
+        return hashlib.sha1(source_file.read()).hexdigest()
+
+
+def manifest_path(course):
+    return os.path.join(course.root_directory, '_cache', 'publicize.json')
+
+
+def load_manifest(course):
+    path = manifest_path(course)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(course, manifest):
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+    course.write_file(manifest_path(course), data)
+
+
+def local_resource_id(course, category, path):
+    '''Builds a resource ID for a local file, without asking Canvas.'''
+    resource_type = RESOURCE_CATEGORIES[category]
+    title = os.path.basename(path)[:-len(resource_type.extension)]
+    return ResourceID.from_canvas_data(course, "{}/?{}".format(category, title),
+                                       None)
+
+
+def publicize_file(course, category, path):
+    resource_id = local_resource_id(course, category, path)
+    resource = course.from_disk(resource_id)
+    if resource is None:
+        raise WaltzNoResourceFound("No local {} found for {} (expected {})".format(
+            resource_id.resource_type.canvas_name, resource_id.raw,
+            resource_id.path))
+    public_resource = course.to_public(resource_id, resource)
+    course.publicize(resource_id, public_resource)
+
+
+def _start_worker(parent_settings, quiet):
+    '''
+    Workers may be fresh interpreters (the "spawn" start method, as on
+    Windows and macOS), so they are given the parent's settings.
+    '''
+    use_settings(parent_settings)
+    global_settings['quiet'] = quiet
+
+
+def _publicize_in_worker(root_directory, course_name, highlight_settings,
+                         category, path):
+    '''
+    Workers convert with the parent course's highlighting settings. They do
+    not share its highlight cache, whose connection must stay with it.
+    Returns:
+        str: A description of the error, or None if the file was publicized.
+    '''
+    course = Course(root_directory, course_name)
+    course.highlight_settings = highlight_settings
+    try:
+        publicize_file(course, category, path)
+    except Exception as e:
+        return "{}: {}".format(type(e).__name__, e)
+    return None
+
+
+def publicize_workers(course):
+    '''
+    The "publicize-workers" setting: how many processes convert resources at
+    the same time. Defaults to None, for the number of CPUs.
+    '''
+    return get_setting('publicize-workers', course=course.course_name,
+                       default=None)
+
+
+def publicize_all(course, raw=None, jobs=None):
+    '''
+    Publicizes every local resource matched by `raw` (see local_sources)
+    whose source changed since it was last publicized.
+    Args:
+        jobs (int): How many processes convert resources at the same time
+            (defaults to the "publicize-workers" setting).
+    Returns:
+        int: How many resources were publicized.
+    '''
+    manifest = load_manifest(course)
+    stale = []
+    for category, path in local_sources(course, raw):
+        key = os.path.relpath(path, course.root_directory)
+        digest = checksum(path)
+        entry = manifest.get(key)
+        public = public_path(path)
+        # Public files that were edited or removed are also rebuilt
+        if (entry is None or entry['sha1'] != digest or
+                not os.path.exists(public) or
+                checksum(public) != entry.get('public_sha1')):
+            stale.append((category, path, key, digest))
+    log("Publicizing", len(stale), "changed resources.")
+    if not stale:
+        return 0
+    failures = []
+    if jobs is None:
+        jobs = publicize_workers(course)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_start_worker,
+                             initargs=(settings, global_settings['quiet'])) as pool:
+        futures = [pool.submit(_publicize_in_worker, course.root_directory,
+                               course.course_name, course.highlight_settings,
+                               category, path)
+                   for category, path, key, digest in stale]
+        for (category, path, key, digest), future in zip(stale, futures):
+            error = future.result()
+            if error is None:
+                public = public_path(path)
+                manifest[key] = {'sha1': digest, 'public_sha1': checksum(public),
+                                 'public': os.path.relpath(public,
+                                                           course.root_directory)}
+            else:
+                failures.append("{}\n{}".format(key, error))
+    save_manifest(course, manifest)
+    if failures:
+        raise WaltzException("Could not publicize {} resources:\n{}".format(
+            len(failures), "\n".join(failures)))
+    return len(stale)
@@ -1,44 +1,103 @@
-import re
 import os
-import difflib
 from glob import glob
-import gzip
 import json
-from collections import OrderedDict
-from pprint import pprint
+import hashlib
+from functools import partial
 
 from ruamel.yaml.comments import CommentedMap
-from ruamel.yaml.scalarstring import walk_tree, preserve_literal
+from ruamel.yaml.scalarstring import walk_tree
 
 from waltz.html_markdown_utilities import h2m, m2h
 
 from waltz.yaml_setup import yaml
 from waltz.canvas_tools import get, put, post, delete
 
-from waltz.utilities import (ensure_dir, make_safe_filename, indent4,
-                             make_datetime_filename,
-                             to_friendly_date, from_friendly_date)
-from waltz.resources import Resource
+from waltz.utilities import (indent4, log, to_friendly_date, from_friendly_date)
+from waltz.resources import Resource, WaltzException
 
 class QuizQuestion(Resource):
     category_name = ["quiz_question", "quiz_questions",
                      "question", "questions"]
     canonical_category = 'questions'
+    __slots__ = ('id', 'quiz_id', 'quiz_group_id', 'quiz_group_name',
+                 'position', 'question_name', 'question_text',
+                 'points_possible', 'correct_comments', 'incorrect_comments',
+                 'neutral_comments', 'correct_comments_html',
+                 'incorrect_comments_html', 'neutral_comments_html',
+                 'answers', 'matching_answer_incorrect_matches', 'matches',
+                 'variables', 'formulas', 'assessment_question_id',
+                 'bank_source', '_content_fingerprint')
     CACHE = {}
+    # Bank questions by content fingerprint, for each course
+    FINGERPRINTS = {}
     QUESTION_GROUP_CACHE_ID = {}
+    # Parts of the Canvas payload that do not change what a question says
+    FINGERPRINT_EXCLUDED = ('question[question_name]', 'question[quiz_group_id]')
+    # Fields that can change without changing the content fingerprint
+    UNFINGERPRINTED_FIELDS = ('question_name', 'quiz_group_id', 'quiz_group_name',
+                              'bank_source', 'course', '_content_fingerprint')
     
     def __init__(self, **kwargs):
-        for key, value in list(kwargs.items()):
-            setattr(self, key, value)
-            del kwargs[key]
+        object.__setattr__(self, '_content_fingerprint', None)
+        Resource.__init__(self, **kwargs)
         self.bank_source = False
-        return
     
+    def __setattr__(self, name, value):
+        Resource.__setattr__(self, name, value)
+        if name in self.UNFINGERPRINTED_FIELDS:
+            return
+        old_fingerprint = self._content_fingerprint
+        if old_fingerprint is not None:
+            object.__setattr__(self, '_content_fingerprint', None)
+            # Bank questions stay findable by what they say now
+            course = getattr(self, 'course', None)
+            if self.bank_source and course is not None:
+                fingerprints = QuizQuestion.FINGERPRINTS.get(course.course_name)
+                if fingerprints is not None:
+                    if fingerprints.get(old_fingerprint) is self:
+                        del fingerprints[old_fingerprint]
+                    fingerprints.setdefault(self.content_fingerprint, self)
+    
+    @staticmethod
+    def _normalize(value):
+        # Canvas sends 100.0 where the YAML has 100, and None where it has ''
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if value is None:
+            return ''
+        return value
+    
+    @property
+    def content_fingerprint(self):
+        '''
+        A digest of what the question says: its type, text, points, comments
+        and answers (as they would be sent to Canvas), but not its name or
+        group. It is kept until one of those fields is set again (fields
+        like the answers are replaced, never changed in place).
+        '''
+        if self._content_fingerprint is None:
+            payload = {key: self._normalize(value)
+                       for key, value in self.to_json(None, None).items()
+                       if key not in self.FINGERPRINT_EXCLUDED}
+            encoded = json.dumps(payload, sort_keys=True, default=str)
+            object.__setattr__(self, '_content_fingerprint',
+                               hashlib.sha1(encoded.encode('utf-8')).hexdigest())
+        return self._content_fingerprint
+    
+    @property
+    def fingerprint(self):
+        '''The content fingerprint, combined with the question's name.'''
+        return "{}:{}".format(self.question_name, self.content_fingerprint)
+    
+    # Questions are mutable, so they compare by fingerprint but are not
+    # hashable; index them by their fingerprint instead (see FINGERPRINTS)
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
             return False
         else:
-            return vars(self) == vars(other)
+            return self.fingerprint == other.fingerprint
+    
+    __hash__ = None
             
     def to_public(self, force=False):
         if self.bank_source and not force:
@@ -114,6 +173,11 @@ class QuizQuestion(Resource):
         if bank_question is not None:
             QuizQuestion.update_bank(course, question_name,
                                      bank_question.bank_source, new_question)
+        else:
+            renamed = cls.by_content(new_question, course)
+            if renamed is not None:
+                log("Question", repr(question_name), "matches bank question",
+                    repr(renamed.question_name), "in", renamed.bank_source)
         
         return new_question
             
@@ -121,41 +185,47 @@ class QuizQuestion(Resource):
     def update_bank(cls, course, question_name, bank_source, new_question):
         course.backup_bank(bank_source)
         course_cache = cls.CACHE[course.course_name]
+        fingerprints = cls.FINGERPRINTS[course.course_name]
+        old_question = course_cache[question_name]
+        if fingerprints.get(old_question.content_fingerprint) is old_question:
+            del fingerprints[old_question.content_fingerprint]
+        new_question.bank_source = bank_source
         course_cache[question_name] = new_question
+        fingerprints.setdefault(new_question.content_fingerprint, new_question)
         # Grab the names of the old questions
         kept_question_names = []
         with open(bank_source) as bank_file:
             questions = yaml.load(bank_file)
             for question in questions:
-                question_name = question['question_name']
-                kept_question_names.append(['question_name'])
+                kept_question_names.append(question['question_name'])
         # Get the actual up-to-date questions
         questions = [course_cache[name].to_disk(force=True)
                      for name in kept_question_names]
         # Dump them back into the file
         walk_tree(questions)
-        with open(bank_source, 'w') as bank_file:
-            yaml.dump(questions, out)
+        with open(bank_source, 'wb') as bank_file:
+            yaml.dump(questions, bank_file)
     
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         pass
     
     @classmethod
     def from_disk(cls, course, yaml_data, resource_id):
+        # Bank questions are referred to by name
+        if isinstance(yaml_data, str):
+            return QuizQuestion.by_name(yaml_data, course)
         question_type = yaml_data['question_type']
         actual_class = QUESTION_TYPES[question_type]
-        yaml_data['question_text'] = m2h(yaml_data['question_text'])
+        yaml_data['question_text'] = m2h(yaml_data['question_text'], course)
         # Fix simplifications of comments
         for label in ['correct_comments', 'incorrect_comments', 'neutral_comments']:
-            yaml_data[label+"_html"] = m2h(yaml_data.pop(label, ""))
+            yaml_data[label+"_html"] = m2h(yaml_data.pop(label, ""), course)
         yaml_data['quiz_group_id'] = yaml_data.pop('group', None)
+        yaml_data['quiz_group_name'] = yaml_data['quiz_group_id']
         # Fix answers
-        actual_class._custom_from_disk(yaml_data)
+        actual_class._custom_from_disk(yaml_data, course)
         # Load the appropriate type
-        if isinstance(yaml_data, str):
-            return QuizQuestion.by_name(yaml_data['question_name'], course)
-        else:
-            return actual_class(course=course, **yaml_data)
+        return actual_class(course=course, **yaml_data)
     
     def push(self, course, quiz_id, name_map, json_data):
         '''
@@ -165,11 +235,11 @@ class QuizQuestion(Resource):
         '''
         if self.question_name in name_map:
             id = name_map[self.question_name]
-            result = put("quizzes/{quiz}/questions/{question}/".format(
+            put("quizzes/{quiz}/questions/{question}/".format(
                 quiz=quiz_id, question=id
             ), data=json_data, course=course.course_name)
         else:
-            result = post("quizzes/{quiz}/questions/".format(
+            post("quizzes/{quiz}/questions/".format(
                 quiz=quiz_id
             ), data=json_data, course=course.course_name)
     
@@ -181,22 +251,37 @@ class QuizQuestion(Resource):
                                        QuizQuestion.canonical_category, 
                                        '**', '*.yaml')
         QuizQuestion.CACHE[course.course_name] = {}
+        QuizQuestion.FINGERPRINTS[course.course_name] = {}
         for bank in glob(category_folder, recursive=True):
             with open(bank) as bank_file:
                 questions = yaml.load(bank_file)
                 for question in questions:
                     question_name = question['question_name']
-                    new_question = QuizQuestion.from_disk(question)
-                    new_question.bank_source = os.path.dirname(bank)
+                    new_question = QuizQuestion.from_disk(course, question, None)
+                    new_question.bank_source = bank
                     QuizQuestion.CACHE[course.course_name][question_name] = new_question
+                    QuizQuestion.FINGERPRINTS[course.course_name].setdefault(
+                        new_question.content_fingerprint, new_question)
     
     @staticmethod
     def by_name(question_name, course):
         if course.course_name not in QuizQuestion.CACHE:
             QuizQuestion.load_bank(course)
         return QuizQuestion.CACHE[course.course_name].get(question_name, None)
+    
+    @staticmethod
+    def by_content(question, course):
+        '''
+        Finds a bank question that says the same thing as the given question,
+        even under another name.
+        '''
+        if course.course_name not in QuizQuestion.FINGERPRINTS:
+            QuizQuestion.load_bank(course)
+        fingerprints = QuizQuestion.FINGERPRINTS[course.course_name]
+        return fingerprints.get(question.content_fingerprint)
 
 class MultipleChoiceQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'multiple_choice_question'
     
     def to_disk(self, force=False):
@@ -224,12 +309,12 @@ class MultipleChoiceQuestion(QuizQuestion):
         return result
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['answers'] = [
-            {'comments_html': m2h(answer.get('comment', "")),
+            {'comments_html': m2h(answer.get('comment', ""), course),
              'weight': 100 if 'correct' in answer else 0,
              'html': m2h(answer['correct'] if 'correct' in answer
-                     else answer['wrong'])}
+                     else answer['wrong'], course)}
             for answer in yaml_data['answers']]
         return yaml_data
     
@@ -243,6 +328,7 @@ class MultipleChoiceQuestion(QuizQuestion):
         return result
         
 class TrueFalseQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'true_false_question'
     
     def to_disk(self, force=False):
@@ -261,12 +347,12 @@ class TrueFalseQuestion(QuizQuestion):
         return QuizQuestion.to_public(self, force)
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['answers'] = [
-            {'comments_html': m2h(yaml_data.get('true_comment', "")),
+            {'comments_html': m2h(yaml_data.get('true_comment', ""), course),
              'weight': 100 if yaml_data['answer'] else 0,
              'text': 'True'},
-            {'comments_html': m2h(yaml_data.get('false_comment', "")),
+            {'comments_html': m2h(yaml_data.get('false_comment', ""), course),
              'weight': 100 if not yaml_data['answer'] else 0,
              'text': 'False'}]
         return yaml_data
@@ -281,6 +367,7 @@ class TrueFalseQuestion(QuizQuestion):
         return result
 
 class ShortAnswerQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'short_answer_question'
 
     def to_disk(self, force=False):
@@ -299,9 +386,9 @@ class ShortAnswerQuestion(QuizQuestion):
         return QuizQuestion.to_public(self, force)
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['answers'] = [
-            {'comments_html': m2h(answer.get('comment', "")),
+            {'comments_html': m2h(answer.get('comment', ""), course),
              'text': answer['text']}
             for answer in yaml_data['answers']]
         return yaml_data
@@ -316,6 +403,7 @@ class ShortAnswerQuestion(QuizQuestion):
         return result
         
 class FillInMultipleBlanks(QuizQuestion):
+    __slots__ = ()
     question_type = 'fill_in_multiple_blanks_question'
 
     def to_disk(self, force=False):
@@ -337,9 +425,9 @@ class FillInMultipleBlanks(QuizQuestion):
         return QuizQuestion.to_public(self, force)
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['answers'] = [
-            {'comments_html': m2h(answer.get('comment', "")),
+            {'comments_html': m2h(answer.get('comment', ""), course),
              'text': answer['text'],
              'blank_id': blank_id}
             for blank_id, answers in yaml_data['answers'].items()
@@ -357,6 +445,7 @@ class FillInMultipleBlanks(QuizQuestion):
         return result
 
 class MultipleAnswersQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'multiple_answers_question'
     
     def to_disk(self, force=False):
@@ -384,12 +473,12 @@ class MultipleAnswersQuestion(QuizQuestion):
         return result
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['answers'] = [
-            {'comments_html': m2h(answer.get('comment', "")),
+            {'comments_html': m2h(answer.get('comment', ""), course),
              'weight': 100 if 'correct' in answer else 0,
              'html': m2h(answer['correct'] if 'correct' in answer
-                     else answer['wrong'])}
+                     else answer['wrong'], course)}
             for answer in yaml_data['answers']]
         return yaml_data
     
@@ -404,6 +493,7 @@ class MultipleAnswersQuestion(QuizQuestion):
         return result
 
 class MultipleDropDownsQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'multiple_dropdowns_question'
 
     def to_disk(self, force=False):
@@ -436,9 +526,9 @@ class MultipleDropDownsQuestion(QuizQuestion):
         return result
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['answers'] = [
-            {'comments_html': m2h(answer.get('comment', "")),
+            {'comments_html': m2h(answer.get('comment', ""), course),
              'text': answer['correct'] if 'correct' in answer
                      else answer['wrong'],
              'weight': 100 if 'correct' in answer else 0,
@@ -458,6 +548,7 @@ class MultipleDropDownsQuestion(QuizQuestion):
         return result
 
 class MatchingQuestions(QuizQuestion):
+    __slots__ = ()
     question_type = 'matching_question'
 
     def to_disk(self, force=False):
@@ -483,9 +574,9 @@ class MatchingQuestions(QuizQuestion):
         return result
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         yaml_data['matching_answer_incorrect_matches'] = yaml_data.pop('incorrect_matches', '')
-        yaml_data['answers'] = [{'comments_html': m2h(answer.get('comment', '')),
+        yaml_data['answers'] = [{'comments_html': m2h(answer.get('comment', ''), course),
                                  'left': answer['left'],
                                  'right': answer['right']}
                                 for answer in yaml_data['answers']]
@@ -504,6 +595,7 @@ class MatchingQuestions(QuizQuestion):
         return result
 
 class NumericalQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'numerical_question'
     
     def to_disk(self, force=False):
@@ -530,13 +622,13 @@ class NumericalQuestion(QuizQuestion):
         return QuizQuestion.to_public(self, force)
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         answers = []
         for answer in yaml_data['answers']:
             numerical_answer_type = ('exact_answer' if 'exact' in answer else
                                      'range_answer' if 'start' in answer else
                                      'precision_answer')
-            a = {'comments_html': m2h(answer.get('comment', "")),
+            a = {'comments_html': m2h(answer.get('comment', ""), course),
                  'numerical_answer_type': numerical_answer_type}
             if numerical_answer_type == 'exact_answer':
                 a['exact'] = answer['exact']
@@ -569,6 +661,7 @@ class NumericalQuestion(QuizQuestion):
         return result
 
 class EssayQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'essay_question'
 
     def to_disk(self, force=False):
@@ -578,13 +671,14 @@ class EssayQuestion(QuizQuestion):
         return QuizQuestion.to_public(self, force)
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         return yaml_data
     
     def to_json(self, course, resource_id):
         return QuizQuestion.to_json(self, course, resource_id)
 
 class TextOnlyQuestion(QuizQuestion):
+    __slots__ = ()
     question_type = 'text_only_question'
 
     def to_disk(self, force=False):
@@ -594,7 +688,7 @@ class TextOnlyQuestion(QuizQuestion):
         return QuizQuestion.to_public(self, force)
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         return yaml_data
     
     def to_json(self, course, resource_id):
@@ -618,11 +712,8 @@ QUESTION_TYPES = {
 class QuizGroup(Resource):
     category_name = ["quiz_group", "quiz_groups"]
     canonical_category = 'quiz_groups'
-    
-    def __init__(self, **kwargs):
-        for key, value in list(kwargs.items()):
-            setattr(self, key, value)
-            del kwargs[key]
+    __slots__ = ('id', 'quiz_id', 'name', 'pick_count', 'question_points',
+                 'position', 'assessment_question_bank_id')
     
     def to_public(self, force=False):
         result = self.to_disk(force)
@@ -677,6 +768,16 @@ class Quiz(Resource):
     canonical_category = 'quizzes'
     canvas_title_field = 'title'
     extension = '.yaml'
+    __slots__ = ('id', 'title', 'description', 'html_url', 'published',
+                 'quiz_type', 'points_possible', 'allowed_attempts',
+                 'scoring_policy', 'due_at', 'unlock_at', 'lock_at',
+                 'one_question_at_a_time', 'shuffle_answers', 'time_limit',
+                 'cant_go_back', 'show_correct_answers',
+                 'show_correct_answers_last_attempt',
+                 'show_correct_answers_at', 'hide_correct_answers_at',
+                 'hide_results', 'one_time_results', 'access_code',
+                 'ip_filter', 'assignment_id', 'updated_at', 'questions',
+                 'groups')
     
     def to_disk(self, resource_id):
         '''Suitable YAML for yaml.dump'''
@@ -710,7 +811,9 @@ class Quiz(Resource):
         if self.ip_filter:
             result['settings']['secrecy']['ip_filter'] = self.ip_filter
         result['groups'] = [g.to_disk() for g in self.groups]
-        result['questions'] = [q.to_disk() for q in self.questions]
+        # Bank questions are only referred to by name
+        result['questions'] = [q.question_name if q.bank_source else q.to_disk()
+                               for q in self.questions]
         return result
     
     def to_public(self, resource_id):
@@ -734,7 +837,9 @@ class Quiz(Resource):
         result['settings']['secrecy']['hide_results'] = self.hide_results
         result['settings']['secrecy']['one_time_results'] = self.one_time_results
         result['groups'] = [g.to_public() for g in self.groups]
-        result['questions'] = [q.to_public() for q in self.questions]
+        # Bank questions are only referred to by name
+        result['questions'] = [q.question_name if q.bank_source else q.to_public()
+                               for q in self.questions]
         return result
     
     @classmethod
@@ -766,16 +871,30 @@ class Quiz(Resource):
                       course=course.course_name)
                   for gid in group_ids]
         group_map = {group['name']: group['id'] for group in groups}
-        for group in self.groups:
-            json_data = group.to_json(course, resource_id)
-            group.push(course, quiz_id, json_data, group_map)
-        # Push all the questions
         name_map = {q['question_name']: q['id'] for q in questions}
+        # Each group is pushed before the questions in it, and new questions
+        # are created in order; everything else is pushed at the same time
+        from waltz.schedule import DependencyScheduler, push_concurrency
+        scheduler = DependencyScheduler(push_concurrency(course))
+        for group in self.groups:
+            scheduler.add(('group', group.name), partial(
+                group.push, course, quiz_id, group.to_json(course, resource_id),
+                group_map))
+        previous_new = None
+        for index, question in enumerate(self.questions):
+            depends_on = [('group', question.quiz_group_id)]
+            if question.question_name not in name_map:
+                if previous_new is not None:
+                    depends_on.append(previous_new)
+                previous_new = ('question', index)
+            scheduler.add(('question', index), partial(
+                self._push_question, course, resource_id, question,
+                group_map, name_map), depends_on)
+        scheduler.run()
+        if scheduler.failed:
+            raise WaltzException("Could not push every part of quiz {}:\n{}".format(
+                resource_id.canvas_title, indent4(scheduler.describe_problems())))
         for question in self.questions:
-            if question.quiz_group_id is not None:
-                question.quiz_group_id = group_map[question.quiz_group_id]
-            json_data = question.to_json(course, resource_id)
-            question.push(course, quiz_id, name_map, json_data)
             if question.question_name in name_map:
                 del name_map[question.question_name]
         # Delete any old questions
@@ -787,6 +906,10 @@ class Quiz(Resource):
         # Reorder questions as needed
         questions = get('quizzes/{qid}/questions/'.format(qid=quiz_id),
                         course=course.course_name, all=True)
+        # Remember what Canvas looks like now, for later offline comparisons
+        resource_id.canvas_data['questions'] = questions
+        resource_id.canvas_data['groups'] = [{'id': id, 'name': name}
+                                             for name, id in group_map.items()]
         return
         # TODO: Figure out how to get around the fact that Canvas doesn't
         #   allow you to download an ordering, so uploading an ordering is irrelevant.
@@ -801,6 +924,74 @@ class Quiz(Resource):
               course=course.course_name))
   
     
+    @staticmethod
+    def _push_question(course, resource_id, question, group_map, name_map):
+        # Bank questions are shared between quizzes, so the group's id only
+        # goes into this request
+        json_data = question.to_json(course, resource_id)
+        if question.quiz_group_id is not None:
+            json_data['question[quiz_group_id]'] = group_map[question.quiz_group_id]
+        question.push(course, resource_id.canvas_id, name_map, json_data)
+    
+    def plan_extra_push(self, plan, course, resource_id):
+        '''
+        Mirrors extra_push, using the recorded Canvas state of the quiz's
+        questions and groups instead of fetching them.
+        '''
+        if resource_id.canvas_data is True:
+            known_questions, known_groups = [], []
+            quiz_id = plan.RESOURCE
+        else:
+            known_questions = resource_id.canvas_data.get('questions', [])
+            known_groups = resource_id.canvas_data.get('groups', [])
+            quiz_id = resource_id.canvas_id
+        group_ids = {question['quiz_group_id'] for question in known_questions
+                     if question['quiz_group_id'] is not None}
+        # Once by extra_pull for the backup, and once more by extra_push
+        for purpose in ("(backup)", "(push)"):
+            if resource_id.canvas_data is True and purpose == "(backup)":
+                continue
+            plan.add_read("List the quiz's questions "+purpose,
+                          plan.listing_requests(len(known_questions)))
+            if group_ids:
+                plan.add_read("Get the quiz's groups "+purpose, len(group_ids))
+        # Push all the groups
+        group_map = {group['name']: group['id'] for group in known_groups}
+        for group in self.groups:
+            json_data = group.to_json(course, resource_id)
+            if group.name in group_map:
+                plan.add('PUT', "quizzes/{quiz}/groups/{group}/".format(
+                             quiz=quiz_id, group=group_map[group.name]),
+                         json_data, "Update group "+group.name)
+            else:
+                plan.add('POST', "quizzes/{quiz}/groups/".format(quiz=quiz_id),
+                         json_data, "Create group "+group.name,
+                         provides=('group:'+group.name, ['quiz_groups', 0, 'id']))
+        # Push all the questions
+        name_map = {q['question_name']: q['id'] for q in known_questions}
+        for question in self.questions:
+            json_data = question.to_json(course, resource_id)
+            group_name = question.quiz_group_id
+            if group_name is not None:
+                json_data['question[quiz_group_id]'] = group_map.get(
+                    group_name, plan.reference('group:'+group_name))
+            if question.question_name in name_map:
+                plan.add('PUT', "quizzes/{quiz}/questions/{question}/".format(
+                             quiz=quiz_id, question=name_map[question.question_name]),
+                         json_data, "Update question "+question.question_name)
+                del name_map[question.question_name]
+            else:
+                plan.add('POST', "quizzes/{quiz}/questions/".format(quiz=quiz_id),
+                         json_data, "Create question "+question.question_name)
+        # Delete any old questions
+        for leftover_name, leftover_id in name_map.items():
+            plan.add('DELETE', 'quizzes/{qid}/questions/{question_id}'.format(
+                         qid=quiz_id, question_id=leftover_id),
+                     None, "Delete question "+leftover_name)
+        # extra_push lists the questions once more (reordering is disabled)
+        plan.add_read("List the quiz's questions again",
+                      plan.listing_requests(len(self.questions)))
+    
     def to_json(self, course, resource_id):
         ''' Suitable for PUT request on API'''
         return {
@@ -831,7 +1022,7 @@ class Quiz(Resource):
     @classmethod
     def from_disk(cls, course, yaml_data, resource_id):
         # Fix configuration on simpler attributes
-        yaml_data['description'] = m2h(yaml_data['description'])
+        yaml_data['description'] = m2h(yaml_data['description'], course)
         yaml_data['settings'].update(yaml_data['settings'].pop('timing'))
         yaml_data['settings'].update(yaml_data['settings'].pop('secrecy'))
         yaml_data.update(yaml_data.pop('settings'))
@@ -852,18 +1043,46 @@ class Quiz(Resource):
     
     @classmethod
     def from_json(cls, course, json_data):
+        questions, groups = cls.fetch_parts(course, json_data)
+        return cls.from_parts(course, json_data, questions, groups)
+    
+    @classmethod
+    def fetch_parts(cls, course, json_data):
+        '''
+        Downloads the questions and groups of a quiz. This only makes
+        requests, so it is safe to run for several quizzes at once.
+        Returns:
+            (list, list): The Canvas JSON of the questions and of the groups.
+        '''
         questions = get('quizzes/{qid}/questions'.format(qid=json_data['id']), 
                         course=course.course_name, all=True)
+        if isinstance(questions, dict):
+            raise WaltzException("Errors in Canvas data: "+repr(questions))
         group_ids = {question['quiz_group_id'] for question in questions}
-        groups = [QuizGroup.from_json(course,
-                                      get('quizzes/{qid}/groups/{gid}'.format(qid=json_data['id'], gid=gid),
-                                          course=course.course_name))
+        groups = [get('quizzes/{qid}/groups/{gid}'.format(qid=json_data['id'], gid=gid),
+                      course=course.course_name)
                   for gid in group_ids
                   if gid is not None]
+        return questions, groups
+    
+    @classmethod
+    def from_parts(cls, course, json_data, questions, groups):
+        '''
+        Converts a quiz from already downloaded parts (see fetch_parts).
+        The conversions are not thread-safe, so only one thread should call
+        this at a time.
+        '''
+        groups = [QuizGroup.from_json(course, group) for group in groups]
         group_map = {group.id: group.name for group in groups}
+        raw_questions = questions
         questions = [QuizQuestion.from_json(course, question, group_map)
                      for question in sorted(questions, key=sort_quiz_question)]
-        return cls(**json_data, questions=questions, course=course, groups=groups)
+        quiz = cls(**json_data, questions=questions, course=course, groups=groups)
+        # Keep the full Canvas state alongside the quiz's own JSON
+        json_data['questions'] = raw_questions
+        json_data['groups'] = [{'id': group.id, 'name': group.name}
+                               for group in groups]
+        return quiz
 
 def sort_quiz_question(q):
     if q['quiz_group_id']:
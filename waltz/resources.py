@@ -1,27 +1,26 @@
-import re
+import io
 import os
-import difflib
 from glob import glob
 import gzip
 import json
+import threading
 from collections import OrderedDict
-from pprint import pprint
+from contextlib import contextmanager
 from pathlib import Path
 
-from jinja2 import Environment, FileSystemLoader
-
 from ruamel.yaml.comments import CommentedMap
-from ruamel.yaml.scalarstring import walk_tree, preserve_literal
+from ruamel.yaml.scalarstring import walk_tree
 
-from waltz.html_markdown_utilities import h2m, m2h
+from waltz.html_markdown_utilities import h2m, m2h, DEFAULT_HIGHLIGHT_SETTINGS
 
 from waltz.yaml_setup import yaml
-from waltz.canvas_tools import get, put, post, get_setting
-from waltz.canvas_tools import from_canvas_date, to_canvas_date
+from waltz.canvas_tools import get, put, post, get_setting, iter_pages
 
 from waltz.utilities import (ensure_dir, make_safe_filename, indent4,
                              make_datetime_filename, log,
                              to_friendly_date, from_friendly_date)
+from waltz.writer import DiskWriter, write_atomically
+from waltz.index import ResourceIndex, index_path
 
 class WaltzException(Exception):
     pass
@@ -29,13 +28,116 @@ class WaltzException(Exception):
 class WaltzNoResourceFound(WaltzException):
     pass
 
+def find_by_title(name, listing, identify_title):
+    '''
+    Finds what a `?name` resource ID matches: everything in the listing
+    whose title contains the name, ignoring case.
+    Returns:
+        list: The matching items of the listing.
+    '''
+    name = name.lower()
+    return [item for item in listing if name in identify_title(item).lower()]
+
 class ResourceID:
+    '''
+    Resource IDs are resolved lazily: Canvas is only asked about a resource
+    when its data (or title, or id) is first needed, and the disk is only
+    searched when its path is. Many IDs can be resolved at once, with fewer
+    requests, by `resolve_all`.
+    '''
     def __init__(self, course, raw):
         self.course = course
         self.raw = raw
         self.category, self.command, self.name, self.resource_type = ResourceID._parse_type(raw)
-        self._get_canvas_data()
-        self._get_disk_path()
+        self._canvas_data = None
+        # Whether the Canvas data is only the index's stand-in (see
+        # _find_canvas_resource), to be fetched in full when it is needed
+        self._partial = False
+        self._path = None
+    
+    @classmethod
+    def from_canvas_data(cls, course, raw, canvas_data):
+        '''
+        Builds a resource ID from Canvas data that is already known (e.g.,
+        recorded during an earlier pull), without any network access. If the
+        data is None, the resource is treated as not yet existing on Canvas.
+        '''
+        resource_id = cls(course, raw)
+        resource_id.canvas_data = True if canvas_data is None else canvas_data
+        return resource_id
+    
+    @classmethod
+    def resolve_all(cls, course, raws):
+        '''
+        Resolves many resource IDs together. The IDs are grouped by category,
+        and a category with any `?` or `+` IDs is listed from Canvas once,
+        instead of being searched once per ID; a category of only `:` IDs is
+        looked up all at once (see get_resources_on_canvas). The local files
+        of each category are found with a single directory scan.
+        Args:
+            raws (list[str]): The resource IDs to resolve.
+        Returns:
+            list[ResourceID]: The resolved resource IDs, in the same order.
+        '''
+        resource_ids = [cls(course, raw) for raw in raws]
+        by_type = OrderedDict()
+        for resource_id in resource_ids:
+            if resource_id.command not in ('+', '?', ':'):
+                raise WaltzException("Unknown command: "+repr(resource_id.command))
+            by_type.setdefault(resource_id.resource_type, []).append(resource_id)
+        failures = []
+        for resource_type, group in by_type.items():
+            if all(resource_id.command == ':' for resource_id in group):
+                found = resource_type.get_resources_on_canvas(
+                    course, [resource_id.name for resource_id in group])
+                for resource_id in group:
+                    if resource_id.name in found:
+                        resource_id.canvas_data = found[resource_id.name]
+                    else:
+                        failures.append("No {} resource found for: {}".format(
+                            resource_type.canvas_name, resource_id.raw))
+                continue
+            listing = list(resource_type.iter_resources_on_canvas(course))
+            for resource_id in group:
+                try:
+                    resource_id._resolve_from_listing(listing)
+                except WaltzException as e:
+                    failures.append(str(e))
+        if failures:
+            raise WaltzException("Could not resolve {} resource IDs:\n{}".format(
+                len(failures), "\n".join(failures)))
+        cls.find_all_on_disk(course, resource_ids)
+        return resource_ids
+    
+    @staticmethod
+    def find_all_on_disk(course, resource_ids):
+        '''
+        Finds the local files of many resolved resource IDs, with a single
+        directory scan per category.
+        '''
+        by_type = OrderedDict()
+        for resource_id in resource_ids:
+            by_type.setdefault(resource_id.resource_type, []).append(resource_id)
+        for resource_type, group in by_type.items():
+            found = resource_type.scan_disk(course.root_directory)
+            for resource_id in group:
+                resource_id._is_new, resource_id._path = resource_type.choose_disk_path(
+                    course.root_directory, resource_id.filename,
+                    found.get(resource_id.filename, []))
+    
+    def _resolve_from_listing(self, listing):
+        '''Resolves the ID from a complete listing of its category.'''
+        if self.command == ':':
+            found = [data for data in listing
+                     if str(self.resource_type.identify_id(data)) == self.name]
+            # Some resources can be looked up by more than the listed id
+            self.canvas_data = found[0] if found else self._get_canvas_resource()
+            return
+        potentials = find_by_title(self.name, listing, self.resource_type.identify_title)
+        if self.command == '+':
+            self.canvas_data = self._check_new(potentials)
+        else:
+            self.canvas_data = self._check_found(potentials)
     
     @staticmethod
     def _parse_type(raw):
@@ -52,8 +154,50 @@ class ResourceID:
             command, name = action[0], action[1:]
             return category, command, name, resource_type
     
-    def _new_canvas_resource(self):
-        potentials = self.resource_type.find_resource_on_canvas(self.course, self.name)
+    @property
+    def canvas_data(self):
+        '''The resource's Canvas JSON, or True if it is not on Canvas yet.'''
+        if self._canvas_data is None:
+            self._get_canvas_data()
+        if self._partial:
+            self._get_full_canvas_data()
+        return self._canvas_data
+    
+    @canvas_data.setter
+    def canvas_data(self, canvas_data):
+        self._canvas_data = canvas_data
+        self._partial = False
+        self._parse_canvas_data()
+    
+    @property
+    def canvas_title(self):
+        if self._canvas_data is None:
+            self._get_canvas_data()
+        return self._canvas_title
+    
+    @property
+    def canvas_id(self):
+        if self._canvas_data is None:
+            self._get_canvas_data()
+        return self._canvas_id
+    
+    @property
+    def filename(self):
+        return make_safe_filename(self.canvas_title)+self.resource_type.extension
+    
+    @property
+    def path(self):
+        if self._path is None:
+            self._get_disk_path()
+        return self._path
+    
+    @property
+    def is_new(self):
+        if self._path is None:
+            self._get_disk_path()
+        return self._is_new
+    
+    def _check_new(self, potentials):
         if not potentials:
             return True
         else:
@@ -62,8 +206,7 @@ class ResourceID:
                 indent4("\n".join(Resource.get_names_from_json(potentials)))
             ))
     
-    def _find_canvas_resource(self):
-        potentials = self.resource_type.find_resource_on_canvas(self.course, self.name)
+    def _check_found(self, potentials):
         if not potentials:
             raise WaltzNoResourceFound("No {} resource found for: {}".format(
                 self.resource_type.canvas_name, self.raw
@@ -76,6 +219,59 @@ class ResourceID:
         else:
             return potentials[0]
     
+    def _new_canvas_resource(self):
+        # Always checked on Canvas, since a stale index could lead to a
+        # second copy of the resource
+        potentials = self.resource_type.find_resource_on_canvas(self.course, self.name)
+        return self._check_new(potentials)
+    
+    def _find_canvas_resource(self):
+        '''
+        Returns:
+            (dict, bool): The Canvas data of the one resource matching the
+                name, and whether it is only the index's stand-in.
+        '''
+        potentials = self._find_indexed_resources()
+        if potentials:
+            return self._check_found(potentials), True
+        potentials = self.resource_type.find_resource_on_canvas(self.course, self.name)
+        return self._check_found(potentials), False
+    
+    def _find_indexed_resources(self):
+        '''
+        The index's stand-ins for the resources matching the name, once its
+        category was listed completely (and an empty list before).
+        '''
+        index = self.course.index
+        if not index.is_listed(self.resource_type):
+            return []
+        return index.find(self.resource_type, self.name)
+    
+    def _get_full_canvas_data(self):
+        '''
+        Fetches the whole resource that the index only knew the title and id
+        of. If it was deleted or renamed since it was indexed, the index is
+        corrected and the resource ID has to be resolved again.
+        '''
+        self._partial = False
+        try:
+            found = self.resource_type.get_resource_on_canvas(self.course, self._canvas_id)
+        except WaltzNoResourceFound:
+            self.course.index.forget(self.resource_type, self._canvas_id)
+            raise WaltzNoResourceFound("{} resource {} was deleted from Canvas; try "
+                                       "again to search for {}".format(
+                                           self.resource_type.canvas_name,
+                                           self._canvas_title, self.raw))
+        self.course.index.record(self.resource_type, [found])
+        if not find_by_title(self.name, [found], self.resource_type.identify_title):
+            raise WaltzNoResourceFound("{} resource {} was renamed on Canvas to {}; try "
+                                       "again to search for {}".format(
+                                           self.resource_type.canvas_name,
+                                           self._canvas_title,
+                                           self.resource_type.identify_title(found),
+                                           self.raw))
+        self.canvas_data = found
+    
     def _get_canvas_resource(self):
         return self.resource_type.get_resource_on_canvas(self.course, self.name)
     
@@ -87,26 +283,25 @@ class ResourceID:
         if self.command.startswith("+"):
             self.canvas_data = self._new_canvas_resource()
         elif self.command.startswith("?"):
-            self.canvas_data = self._find_canvas_resource()
+            canvas_data, partial = self._find_canvas_resource()
+            self.canvas_data = canvas_data
+            self._partial = partial
         elif self.command.startswith(":"):
             self.canvas_data = self._get_canvas_resource()
         else:
             raise WaltzException("Unknown command: "+repr(self.command))
-        self._parse_canvas_data()
     
     def _parse_canvas_data(self):
-        if self.canvas_data is True:
-            self.canvas_title = self.name
-            self.canvas_id = None
+        if self._canvas_data is True:
+            self._canvas_title = self.name
+            self._canvas_id = None
         else:
-            self.canvas_title = self.resource_type.identify_title(self.canvas_data)
-            self.canvas_id = self.resource_type.identify_id(self.canvas_data)
+            self._canvas_title = self.resource_type.identify_title(self._canvas_data)
+            self._canvas_id = self.resource_type.identify_id(self._canvas_data)
     
     def _get_disk_path(self):
-        extension = self.resource_type.extension
-        self.filename = make_safe_filename(self.canvas_title)+extension
         print(self.filename)
-        self.is_new, self.path = self.resource_type.find_resource_on_disk(self.course.root_directory, self.filename)
+        self._is_new, self._path = self.resource_type.find_resource_on_disk(self.course.root_directory, self.filename)
 
 
 class Course:
@@ -114,9 +309,31 @@ class Course:
         self.root_directory = root_directory
         self.backups = os.path.join(root_directory, '_backups')
         self.templates = os.path.join(root_directory, '_templates')
+        from jinja2 import Environment, FileSystemLoader
         self.env = Environment(loader=FileSystemLoader(self.templates))
         self.setup_filters()
         self.course_name = course_name
+        # When set (to a waltz.snapshots.Snapshot), pulled resources are
+        # stored there instead of as loose files.
+        self.snapshot = None
+        # When set (see write_behind), files are written in the background
+        self.writer = None
+        # When set (see cache_highlighting), highlighted code is reused
+        self.highlight_cache = None
+        # How code is highlighted (see set_highlight_mode)
+        self.highlight_settings = dict(DEFAULT_HIGHLIGHT_SETTINGS)
+        # Opened on first use (see the index property)
+        self._index = None
+        # Local files are loaded one at a time, even during concurrent
+        # pushes, since loading fills shared caches (like question banks)
+        self.load_lock = threading.RLock()
+    
+    @property
+    def index(self):
+        '''The persistent title and id index of the course (see waltz.index).'''
+        if self._index is None:
+            self._index = ResourceIndex(index_path(self.root_directory))
+        return self._index
     
     def setup_filters(self):
         self.env.filters['load_outcome'] = Outcome.load_outcome_by_name(self)
@@ -153,17 +370,127 @@ class Course:
     def to_disk(self, resource_id, resource):
         resource_data = resource.to_disk(resource_id)
         walk_tree(resource_data)
-        # Make a backup of the local version
-        backed_up = self.backup_resource(resource_id, resource_data)
-        if backed_up:
-            log("Backed up file: ", resource_id.path)
-        ensure_dir(resource_id.path)
-        if resource_id.path.endswith('.yaml'):
-            with open(resource_id.path, 'wb') as out:
-                yaml.dump(resource_data, out)
+        if self.snapshot is not None:
+            self.to_snapshot(resource_id, resource_data)
+            return
+        # Any different local version is backed up before being replaced
+        resource_path = resource_id.resource_type.identify_filename(resource_id.filename)
+        self.write_file(resource_id.path,
+                        self.serialize(resource_id.path, resource_data),
+                        os.path.join(self.backups, resource_path))
+    
+    def write_file(self, path, data, backup_directory=None):
+        '''
+        Writes the bytes atomically, skipping unchanged files. While a
+        write-behind writer is active, the write happens in the background.
+        '''
+        if self.writer is not None:
+            self.writer.write(path, data, backup_directory)
         else:
-            with open(resource_id.path, 'w') as out:
-                out.write(resource_data)
+            write_atomically(path, data, backup_directory, self.durable_writes)
+    
+    @property
+    def durable_writes(self):
+        '''
+        Whether each file is synced to disk before being moved into place;
+        off by default, since a sync per file makes large pulls much slower.
+        '''
+        return get_setting('durable-writes', course=self.course_name, default=False)
+    
+    @contextmanager
+    def write_behind(self):
+        '''
+        Queues file writes for a background writer until the block ends,
+        when they are all flushed to disk.
+        '''
+        if self.writer is not None:
+            yield self.writer
+            return
+        self.writer = DiskWriter(durable=self.durable_writes)
+        try:
+            yield self.writer
+        finally:
+            writer, self.writer = self.writer, None
+            writer.close()
+    
+    def cache_highlighting(self):
+        '''
+        Makes conversions reuse highlighted code blocks from
+        `_cache/highlight.sqlite`, unless the "highlight-cache" setting is off.
+        '''
+        if not get_setting('highlight-cache', course=self.course_name, default=True):
+            return
+        from waltz.highlight_cache import HighlightCache, DEFAULT_MAX_ENTRIES
+        size = get_setting('highlight-cache-size', course=self.course_name,
+                           default=DEFAULT_MAX_ENTRIES)
+        path = os.path.join(self.root_directory, '_cache', 'highlight.sqlite')
+        self.stop_caching_highlighting()
+        self.highlight_cache = HighlightCache(path, size)
+    
+    def set_highlight_mode(self):
+        '''
+        Applies the "highlight-mode" setting: "inline" styles every token of
+        highlighted code, while "classes" uses short class names that the
+        shared stylesheet (see waltz.stylesheet) styles. Canvas strips
+        stylesheets from pages, so "classes" also needs the
+        "highlight-theme-applied: true" setting, once an admin has added
+        the stylesheet to the account's theme.
+        Returns:
+            str: The highlight mode.
+        '''
+        from waltz.html_markdown_utilities import HIGHLIGHT_MODES
+        mode = get_setting('highlight-mode', course=self.course_name, default='inline')
+        if mode not in HIGHLIGHT_MODES:
+            raise WaltzException("Unknown highlight-mode: {!r} (expected one of {})"
+                                 .format(mode, ", ".join(HIGHLIGHT_MODES)))
+        style = get_setting('highlight-style', course=self.course_name, default='default')
+        if mode == 'classes' and not get_setting('highlight-theme-applied',
+                                                 course=self.course_name, default=False):
+            from waltz.stylesheet import write_stylesheet
+            path, _ = write_stylesheet(self, style, DEFAULT_HIGHLIGHT_SETTINGS['css_class'])
+            raise WaltzException(
+                "highlight-mode: classes only works once the stylesheet is in the "
+                "account's theme, since Canvas removes stylesheets from pages.\n"
+                "Ask an admin to add {} to the theme's custom CSS, then set "
+                "highlight-theme-applied: true (or use highlight-mode: inline).".format(path))
+        self.highlight_settings = dict(DEFAULT_HIGHLIGHT_SETTINGS,
+                                       mode=mode, style=style)
+        return mode
+    
+    def push_stylesheet(self):
+        '''Uploads the highlighting stylesheet if it is needed and has changed.'''
+        if self.highlight_settings['mode'] != 'classes':
+            return False
+        from waltz.stylesheet import push_stylesheet
+        return push_stylesheet(self, self.highlight_settings['style'],
+                               self.highlight_settings['css_class'])
+    
+    def stop_caching_highlighting(self):
+        '''Stores the newly highlighted blocks and closes the cache.'''
+        if self.highlight_cache is not None:
+            cache, self.highlight_cache = self.highlight_cache, None
+            cache.close()
+    
+    def to_snapshot(self, resource_id, resource_data):
+        path = os.path.relpath(resource_id.path, self.root_directory)
+        category = resource_id.resource_type.canonical_category
+        changed = self.snapshot.store(category, resource_id.canvas_id,
+                                      resource_id.canvas_title, path,
+                                      resource_id.canvas_data,
+                                      self.serialize(resource_id.path, resource_data))
+        if changed:
+            log("Updated snapshot entry: ", path)
+    
+    def serialize(self, path, resource_data):
+        '''
+        Returns:
+            bytes: The resource data exactly as it would be written to path.
+        '''
+        if path.endswith('.yaml'):
+            out = io.BytesIO()
+            yaml.dump(resource_data, out)
+            return out.getvalue()
+        return resource_data.encode('utf-8')
     
     def from_disk(self, resource_id):
         '''
@@ -174,13 +501,14 @@ class Course:
         '''
         if not os.path.exists(resource_id.path):
             return None
-        if resource_id.path.endswith('.yaml'):
-            with open(resource_id.path) as resource_file:
-                resource_yaml = yaml.load(resource_file)
-        else:
-            with open(resource_id.path) as resource_file:
-                resource_yaml = resource_file.read()
-        return resource_id.resource_type.from_disk(self, resource_yaml, resource_id)
+        with self.load_lock:
+            if resource_id.path.endswith('.yaml'):
+                with open(resource_id.path) as resource_file:
+                    resource_yaml = yaml.load(resource_file)
+            else:
+                with open(resource_id.path) as resource_file:
+                    resource_yaml = resource_file.read()
+            return resource_id.resource_type.from_disk(self, resource_yaml, resource_id)
     
     def from_json(self, resource_id, json_data):
         '''`Canvas<ResourceType>` can be converted to `ResourceType`
@@ -200,18 +528,60 @@ class Course:
             id = resource_id.resource_type.identify_id(resource_id.canvas_data)
         rtype = resource_id.resource_type
         resource_id.canvas_data =  rtype.put_on_canvas(self.course_name, id, json_data)
-        resource_id._parse_canvas_data()
     
     def publicize(self, resource_id, public_data):
         walk_tree(public_data)
         path = str(Path(resource_id.path).with_suffix('.public.yaml'))
-        ensure_dir(path)
-        if path.endswith('.yaml'):
-            with open(path, 'wb') as out:
-                yaml.dump(public_data, out)
-        else:
-            with open(path, 'w') as out:
-                out.write(public_data)
+        self.write_file(path, self.serialize(path, public_data))
+    
+    def canvas_state_path(self, resource_type, filename):
+        return os.path.join(self.root_directory, '_cache', 'canvas',
+                            resource_type.identify_filename(filename)+'.json.gz')
+    
+    def record_canvas_state(self, resource_id):
+        '''
+        Remembers the most recent Canvas data seen for a resource, so that
+        later operations (like push plans) can work without asking Canvas.
+        '''
+        if resource_id.canvas_data is True:
+            return
+        self.index.record(resource_id.resource_type, [resource_id.canvas_data])
+        self.save_canvas_state(resource_id.resource_type, resource_id.filename,
+                               resource_id.canvas_data)
+    
+    def save_canvas_state(self, resource_type, filename, canvas_data):
+        path = self.canvas_state_path(resource_type, filename)
+        # A fixed mtime keeps unchanged states byte-for-byte identical
+        data = gzip.compress(json.dumps(canvas_data).encode('utf-8'), mtime=0)
+        self.write_file(path, data)
+    
+    def update_canvas_state(self, resource_type, filename, changes):
+        '''Applies known changes to the recorded Canvas state, if there is any.'''
+        canvas_data = self.load_canvas_state(resource_type, filename)
+        if canvas_data is not None:
+            canvas_data.update(changes)
+            self.save_canvas_state(resource_type, filename, canvas_data)
+    
+    def load_canvas_state(self, resource_type, filename):
+        path = self.canvas_state_path(resource_type, filename)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding="utf-8") as state_file:
+            return json.load(state_file)
+    
+    def iter_canvas_states(self, resource_type):
+        '''Yields the recorded Canvas data of every resource of the type.'''
+        search_path = os.path.join(self.root_directory, '_cache', 'canvas',
+                                   resource_type.canonical_category, '**', '*.json.gz')
+        for path in sorted(glob(search_path, recursive=True)):
+            with gzip.open(path, 'rt', encoding="utf-8") as state_file:
+                yield json.load(state_file)
+    
+    def find_canvas_state_by_id(self, resource_type, id):
+        for data in self.iter_canvas_states(resource_type):
+            if str(resource_type.identify_id(data)) == str(id):
+                return data
+        return None
     
     def backup_json(self, resource_id, json_data):
         resource_path = resource_id.resource_type.identify_filename(resource_id.filename)
@@ -222,43 +592,87 @@ class Course:
         with gzip.open(backup_path, 'wt', encoding="utf-8") as out:
             json.dump(json_data, out)
     
-    def backup_resource(self, resource_id, new_version):
-        extension = resource_id.resource_type.extension
-        resource_path = resource_id.resource_type.identify_filename(resource_id.filename)
-        backup_directory = os.path.join(self.backups, resource_path)
-        ensure_dir(backup_directory+"/")
-        timestamped_filename = make_datetime_filename() + extension +'.gz'
-        backup_path = os.path.join(backup_directory, timestamped_filename)
-        if not os.path.exists(resource_id.path):
-            return False
-        with open(resource_id.path, 'r') as original_file:
-            contents = original_file.read()
-        if contents == new_version:
-            return False
-        with gzip.open(backup_path, 'wb') as out:
-            out.write(contents.encode())
-        return True
-    
     def backup_bank(self, bank_source):
-        backup_directory = os.path.join(self.backups, bank_source)
+        backup_directory = os.path.join(self.backups,
+                                        os.path.relpath(bank_source, self.root_directory))
         ensure_dir(backup_directory+"/")
         timestamped_filename = make_datetime_filename() + '.yaml' +'.gz'
         backup_path = os.path.join(backup_directory, timestamped_filename)
-        with open(resource_id.path, 'rb') as original_file:
+        with open(bank_source, 'rb') as original_file:
             contents = original_file.read()
         with gzip.open(backup_path, 'wb') as out:
             out.write(contents)
 
+SLOT_CACHE = {}
+def declared_fields(resource_type):
+    '''Every field named in the __slots__ of a class and its parents.'''
+    if resource_type not in SLOT_CACHE:
+        fields = []
+        for parent in reversed(resource_type.__mro__):
+            slots = parent.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            fields.extend(slot for slot in slots if slot not in fields)
+        SLOT_CACHE[resource_type] = tuple(fields)
+    return SLOT_CACHE[resource_type]
+
 class Resource:
+    '''
+    Resources declare the fields they actually use in `__slots__`, so that
+    they do not each carry a `__dict__`. Any other keyword (like the many
+    Canvas JSON fields that Waltz never reads) goes into the
+    `unmatched_parameters` overflow dictionary, which stays None when empty.
+    '''
+    __slots__ = ('course', 'unmatched_parameters')
     title = "Untitled Instance"
     canvas_title_field = 'title'
     canvas_id_field = 'id'
+    # For the optional GraphQL backend (see waltz.graphql_backend): the
+    # GraphQL path of each REST field, or None to always use REST
+    graphql_fields = None
+    graphql_connection = None
+    graphql_node = None
     
     def __init__(self, **kwargs):
-        for key, value in list(kwargs.items()):
-            setattr(self, key, value)
-            del kwargs[key]
-        self.unmatched_parameters = kwargs
+        self.unmatched_parameters = None
+        for key, value in kwargs.items():
+            try:
+                setattr(self, key, value)
+            except AttributeError:
+                # Class-level constants (like question_type) need no copy
+                if getattr(type(self), key, None) == value:
+                    continue
+                if self.unmatched_parameters is None:
+                    self.unmatched_parameters = {}
+                self.unmatched_parameters[key] = value
+    
+    def __getattr__(self, name):
+        # Only reached when the regular lookup fails
+        if name != 'unmatched_parameters':
+            unmatched = self.unmatched_parameters
+            if unmatched is not None and name in unmatched:
+                return unmatched[name]
+        raise AttributeError("{!r} object has no attribute {!r}"
+                             .format(type(self).__name__, name))
+    
+    def as_dict(self):
+        '''
+        Returns:
+            dict: Every field that has been set, declared or not.
+        '''
+        result = {}
+        for field in declared_fields(type(self)):
+            # Private fields (like cached values) are not part of the resource
+            if field == 'unmatched_parameters' or field.startswith('_'):
+                continue
+            try:
+                result[field] = object.__getattribute__(self, field)
+            except AttributeError:
+                pass
+        if self.unmatched_parameters:
+            result.update(self.unmatched_parameters)
+        result.update(getattr(self, '__dict__', {}))
+        return result
     
     def to_json(self, course, resource_id):
         raise NotImplementedError("The to_json method has not been implemented.")
@@ -275,12 +689,16 @@ class Resource:
         raise NotImplementedError("The from_disk method has not been implemented.")
     
     @classmethod
-    def _custom_from_disk(cls, yaml_data):
+    def _custom_from_disk(cls, yaml_data, course):
         pass
     
     def extra_push(self, course, resource_id):
         pass
     
+    def plan_extra_push(self, plan, course, resource_id):
+        '''Records the requests that extra_push would make, without making them.'''
+        pass
+    
     @classmethod
     def extra_pull(cls, course, resource_id):
         pass
@@ -298,14 +716,44 @@ class Resource:
     
     @classmethod
     def find_resource_on_canvas(cls, course, resource_name):
+        # Even with GraphQL, which has no search, since a search is one request
         results = get(cls.canvas_name, params={"search_term": resource_name},
                       course=course.course_name, all=True)
         if 'errors' in results:
             raise WaltzException("Errors in Canvas data: "+repr(results))
+        course.index.record(cls, results)
         return results
     
+    @classmethod
+    def iter_resources_on_canvas(cls, course):
+        '''
+        Yields every resource of this type on Canvas as its page of the
+        listing arrives, instead of waiting for the whole listing. The
+        course's index is refreshed from the listing along the way.
+        '''
+        from waltz import graphql_backend
+        pages = None
+        if graphql_backend.enabled(course, cls):
+            pages = graphql_backend.iter_resource_pages(course, cls)
+        if pages is None:
+            pages = iter_pages(cls.canvas_name, course=course.course_name)
+        ids = []
+        for page in pages:
+            if 'errors' in page:
+                raise WaltzException("Errors in Canvas data: "+repr(page))
+            course.index.record(cls, page)
+            for result in page:
+                ids.append(cls.identify_id(result))
+                yield result
+        course.index.finish_listing(cls, ids)
+    
     @classmethod
     def get_resource_on_canvas(cls, course, resource_name):
+        from waltz import graphql_backend
+        if graphql_backend.enabled(course, cls):
+            found = graphql_backend.get_resources(course, cls, [resource_name])
+            if found:
+                return found[str(resource_name)]
         data = get('{}/{}'.format(cls.canvas_name, resource_name),
                    course=course.course_name)
         print(resource_name)
@@ -313,17 +761,68 @@ class Resource:
             raise WaltzNoResourceFound("Errors in Canvas data: "+repr(data))
         return data
     
+    @classmethod
+    def get_resources_on_canvas(cls, course, ids):
+        '''
+        Looks up many resources by id: with a single batched query through
+        GraphQL, or else from one listing of the category.
+        Returns:
+            dict: The Canvas JSON of each id (as a string) that was found.
+        '''
+        from waltz import graphql_backend
+        ids = [str(id) for id in ids]
+        if graphql_backend.enabled(course, cls):
+            found = graphql_backend.get_resources(course, cls, ids)
+            if found is not None:
+                course.index.record(cls, list(found.values()))
+                return found
+        if len(ids) == 1:
+            try:
+                return {ids[0]: cls.get_resource_on_canvas(course, ids[0])}
+            except WaltzNoResourceFound:
+                return {}
+        wanted = set(ids)
+        found = {}
+        for data in cls.iter_resources_on_canvas(course):
+            id = str(cls.identify_id(data))
+            if id in wanted:
+                found[id] = data
+        # Some resources can be looked up by more than the listed id
+        for id in wanted.difference(found):
+            try:
+                found[id] = cls.get_resource_on_canvas(course, id)
+            except WaltzNoResourceFound:
+                pass
+        return found
+    
     @classmethod
     def find_resource_on_disk(cls, root, filename):
         search_path = os.path.join(root, cls.canonical_category, '**', filename)
         potentials = glob(search_path, recursive=True)
+        return cls.choose_disk_path(root, filename, potentials)
+    
+    @classmethod
+    def scan_disk(cls, root):
+        '''
+        Returns:
+            dict[str, list[str]]: The paths of every file in this category's
+                folder, by filename.
+        '''
+        found = {}
+        for directory, folders, filenames in os.walk(os.path.join(root, cls.canonical_category)):
+            for filename in filenames:
+                found.setdefault(filename, []).append(os.path.join(directory, filename))
+        return found
+    
+    @classmethod
+    def choose_disk_path(cls, root, filename, potentials):
         if not potentials:
             return True, os.path.join(root, cls.canonical_category, filename)
         elif len(potentials) == 1:
             return False, potentials[0]
         else:
             raise ValueError("Category {} has two files with same name:\n{}"
-                .format(self.canonical_category, '\n'.join(potentials)))
+                .format(cls.canonical_category, '\n'.join(potentials)))
     
     @classmethod
     def identify_filename(cls, filename):
@@ -374,6 +873,8 @@ class Page(Resource):
     canvas_title_field = 'title'
     canvas_id_field = 'url'
     extension = '.md'
+    __slots__ = ('title', 'url', 'body', 'published', 'html_url', 'page_id',
+                 'updated_at')
     
     @classmethod
     def from_json(cls, course, json_data):
@@ -389,7 +890,7 @@ class Page(Resource):
     @classmethod
     def from_disk(cls, course, resource_data, resource_id):
         # Fix configuration on simpler attributes
-        return cls(body=m2h(resource_data), course=course,
+        return cls(body=m2h(resource_data, course), course=course,
                    title=resource_id.canvas_title)
     
     def to_json(self, course, resource_id):
@@ -441,6 +942,23 @@ class Assignment(Resource):
     canvas_title_field = 'name'
     canvas_id_field = 'id'
     extension = '.yaml'
+    __slots__ = ('id', 'name', 'description', 'html_url', 'published',
+                 'points_possible', 'grading_type', 'submission_types',
+                 'allowed_extensions', 'due_at', 'unlock_at', 'lock_at',
+                 'anonymize_students', 'anonymous_grading', 'quiz_id',
+                 'updated_at')
+    graphql_connection = 'assignmentsConnection'
+    graphql_node = 'assignment'
+    graphql_fields = OrderedDict([
+        ('id', '_id'), ('name', 'name'), ('description', 'description'),
+        ('html_url', 'htmlUrl'), ('published', 'published'),
+        ('points_possible', 'pointsPossible'), ('grading_type', 'gradingType'),
+        ('submission_types', 'submissionTypes'),
+        ('allowed_extensions', 'allowedExtensions'), ('due_at', 'dueAt'),
+        ('unlock_at', 'unlockAt'), ('lock_at', 'lockAt'),
+        ('anonymize_students', 'anonymizeStudents'),
+        ('anonymous_grading', 'anonymousGrading'), ('quiz_id', 'quiz._id'),
+        ('updated_at', 'updatedAt')])
     
     def to_disk(self, resource_id):
         '''Suitable YAML for yaml.dump'''
@@ -487,7 +1005,7 @@ class Assignment(Resource):
     @classmethod
     def from_disk(cls, course, yaml_data, resource_id):
         # Fix configuration on simpler attributes
-        yaml_data['description'] = m2h(yaml_data['description'])
+        yaml_data['description'] = m2h(yaml_data['description'], course)
         yaml_data['settings'].update(yaml_data['settings'].pop('timing'))
         yaml_data['settings'].update(yaml_data['settings'].pop('secrecy'))
         yaml_data['settings'].update(yaml_data['settings'].pop('submission'))
@@ -502,10 +1020,13 @@ class Assignment(Resource):
     def from_json(cls, course, json_data):
         return cls(**json_data, course=course)
 
-from waltz.quizzes import *
+from waltz.quizzes import Quiz  # noqa: E402
+from waltz.files import File  # noqa: E402
 
-ALL_RESOURCES = [Quiz, Page, Assignment]
+ALL_RESOURCES = [Quiz, Page, Assignment, File]
 RESOURCE_CATEGORIES = {}
+RESOURCE_TYPES = {ResourceType.canonical_category: ResourceType
+                  for ResourceType in ALL_RESOURCES}
 for ResourceType in ALL_RESOURCES:
     for category in ResourceType.category_names:
         RESOURCE_CATEGORIES[category] = ResourceType
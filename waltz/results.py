@@ -0,0 +1,423 @@
+'''
+Item analysis of quiz submissions, for the results verb.
+
+Every student's latest attempt at a quiz is read from the submission
+history of the quiz's assignment, a page at a time, into columnar arrays:
+for each answer, the student's row, the question's column and the points
+earned, and for each chosen answer, its row and option. The statistics are
+then computed over whole arrays at once:
+
+* difficulty: the mean fraction of a question's points that was earned
+* discrimination: the correlation between a question's points and the
+  rest of the quiz's score, among the students who got the question
+* upper-lower: the difficulty among the top 27% of scores minus the
+  difficulty among the bottom 27%
+* how often each answer was chosen, overall and by those two groups
+* the distribution of total scores
+
+NumPy is only needed by this verb, so it is only imported when the verb
+runs. Reports are written to `results/<quiz>.<format>` next to the course
+(as html, json, pdf, text or yaml); the raw format prints the text report.
+'''
+import io
+import os
+import json
+from array import array
+from html import escape
+from concurrent.futures import ThreadPoolExecutor
+
+from waltz.canvas_tools import iter_pages, get_setting
+from waltz.resources import ResourceID, WaltzException
+from waltz.quizzes import Quiz
+from waltz.yaml_setup import yaml
+from waltz.utilities import log, make_safe_filename
+
+# The share of students in each of the upper and lower groups
+GROUP_FRACTION = 0.27
+HISTOGRAM_BINS = 10
+DEFAULT_FETCH_CONCURRENCY = 8
+EXTENSIONS = {'html': '.html', 'json': '.json', 'pdf': '.pdf', 'text': '.txt',
+              'yaml': '.yaml'}
+
+
+def require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise WaltzException("The results verb needs NumPy, which is not installed.\n"
+                             "Install it with: pip install numpy")
+    return numpy
+
+
+def iter_latest_attempts(course, quiz_json):
+    '''
+    Yields the user id, score and per-question answers of each student's
+    latest attempt, as each page of submissions arrives.
+    '''
+    command = 'assignments/{}/submissions'.format(quiz_json['assignment_id'])
+    for page in iter_pages(command, course=course.course_name,
+                           params={'include[]': 'submission_history'}):
+        if isinstance(page, dict):
+            raise WaltzException("Errors in Canvas data: "+repr(page))
+        for submission in page:
+            attempts = [attempt for attempt in submission.get('submission_history') or []
+                        if attempt.get('submission_data')]
+            if attempts:
+                latest = max(attempts, key=lambda attempt: attempt.get('attempt') or 0)
+                yield submission['user_id'], latest.get('score'), latest['submission_data']
+
+
+def chosen_answers(answer):
+    '''The ids of the answers chosen for one question of an attempt.'''
+    if answer.get('answer_id') is not None:
+        return [answer['answer_id']]
+    # Multiple answer questions mark each chosen answer as "answer_<id>": "1"
+    return [int(key[7:]) for key, value in answer.items()
+            if key.startswith('answer_') and key[7:].isdigit() and str(value) == '1']
+
+
+class QuizResults:
+    '''
+    The answers of every student to a quiz, as columns. Options are the
+    answers of every question, numbered across the whole quiz.
+    '''
+    def __init__(self, quiz_json, questions):
+        self.quiz_json = quiz_json
+        self.questions = questions
+        self.columns = {question['id']: column for column, question in enumerate(questions)}
+        self.options = []
+        self.option_numbers = {}
+        for column, question in enumerate(questions):
+            for answer in question.get('answers') or []:
+                self.add_option(column, answer['id'], answer.get('text') or
+                                answer.get('html') or '', answer.get('weight') == 100)
+        self.users = []
+        self.scores = array('d')
+        self.answer_rows = array('l')
+        self.answer_columns = array('l')
+        self.answer_points = array('d')
+        self.choice_rows = array('l')
+        self.choice_options = array('l')
+
+    def add_option(self, column, answer_id, text, correct=False):
+        self.option_numbers[(column, answer_id)] = len(self.options)
+        self.options.append({'column': column, 'id': answer_id, 'text': text,
+                             'correct': correct})
+        return self.option_numbers[(column, answer_id)]
+
+    def add_attempt(self, user_id, score, submission_data):
+        row = len(self.users)
+        self.users.append(user_id)
+        self.scores.append(float('nan') if score is None else score)
+        for answer in submission_data:
+            column = self.columns.get(answer.get('question_id'))
+            # Questions deleted since the attempt are left out
+            if column is None:
+                continue
+            self.answer_rows.append(row)
+            self.answer_columns.append(column)
+            self.answer_points.append(answer.get('points') or 0)
+            for answer_id in chosen_answers(answer):
+                option = self.option_numbers.get((column, answer_id))
+                if option is None:
+                    option = self.add_option(column, answer_id,
+                                             "(answer {})".format(answer_id))
+                self.choice_rows.append(row)
+                self.choice_options.append(option)
+
+    @classmethod
+    def download(cls, course, quiz_json):
+        questions = Quiz.fetch_parts(course, quiz_json)[0]
+        questions.sort(key=lambda question: question.get('position') or 0)
+        results = cls(quiz_json, questions)
+        for user_id, score, submission_data in iter_latest_attempts(course, quiz_json):
+            results.add_attempt(user_id, score, submission_data)
+        return results
+
+    def analyze(self):
+        '''
+        Returns:
+            dict: The score distribution and the statistics of every
+                question and answer (NaN where there were no students).
+        '''
+        np = require_numpy()
+        students, count = len(self.users), len(self.questions)
+        rows = np.frombuffer(self.answer_rows, dtype=np.dtype('l'))
+        columns = np.frombuffer(self.answer_columns, dtype=np.dtype('l'))
+        possible = np.array([question.get('points_possible') or 0
+                             for question in self.questions], dtype=float)
+        # Points by student and question, NaN where a student was not asked
+        points = np.full((students, count), np.nan)
+        points[rows, columns] = np.frombuffer(self.answer_points, dtype=float)
+        asked = ~np.isnan(points)
+        earned = np.where(asked, points, 0.0)
+        scores = np.frombuffer(self.scores, dtype=float).copy()
+        missing = np.isnan(scores)
+        scores[missing] = earned.sum(axis=1)[missing]
+        answered = asked.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fractions = earned / np.where(possible > 0, possible, np.nan)
+            difficulty = np.where(asked, fractions, 0.0).sum(axis=0) / answered
+            # Corrected item-total correlation, over the students asked each question
+            rest = scores[:, None] - earned
+            item_mean = earned.sum(axis=0) / answered
+            rest_mean = np.where(asked, rest, 0.0).sum(axis=0) / answered
+            item_deviation = np.where(asked, earned - item_mean, 0.0)
+            rest_deviation = np.where(asked, rest - rest_mean, 0.0)
+            discrimination = ((item_deviation * rest_deviation).sum(axis=0) /
+                              np.sqrt((item_deviation**2).sum(axis=0) *
+                                      (rest_deviation**2).sum(axis=0)))
+            order = np.argsort(scores, kind='stable')
+            size = max(1, int(round(GROUP_FRACTION * students))) if students else 0
+            upper = np.zeros(students, dtype=bool)
+            lower = np.zeros(students, dtype=bool)
+            upper[order[students-size:]] = True
+            lower[order[:size]] = True
+
+            def group_difficulty(group):
+                group_asked = asked & group[:, None]
+                return (np.where(group_asked, fractions, 0.0).sum(axis=0) /
+                        group_asked.sum(axis=0))
+            upper_lower = group_difficulty(upper) - group_difficulty(lower)
+            # How often each option was chosen, by everyone and by each group
+            choice_rows = np.frombuffer(self.choice_rows, dtype=np.dtype('l'))
+            choices = np.frombuffer(self.choice_options, dtype=np.dtype('l'))
+            option_columns = np.array([option['column'] for option in self.options],
+                                      dtype=int)
+            total = len(self.options)
+            chosen = np.bincount(choices, minlength=total)
+            chosen_upper = np.bincount(choices[upper[choice_rows]], minlength=total)
+            chosen_lower = np.bincount(choices[lower[choice_rows]], minlength=total)
+            frequency = chosen / answered[option_columns]
+        points_possible = self.quiz_json.get('points_possible') or possible.sum()
+        if students:
+            histogram, edges = np.histogram(scores, bins=HISTOGRAM_BINS,
+                                            range=(0, max(points_possible, scores.max())))
+            quartiles = np.percentile(scores, [0, 25, 50, 75, 100])
+        else:
+            histogram, edges, quartiles = [], [], [np.nan]*5
+        report = {
+            'quiz': self.quiz_json['title'], 'id': self.quiz_json['id'],
+            'students': students, 'points_possible': float(points_possible),
+            'scores': {
+                'mean': scores.mean() if students else np.nan,
+                'std': scores.std() if students else np.nan,
+                'min': quartiles[0], 'q1': quartiles[1], 'median': quartiles[2],
+                'q3': quartiles[3], 'max': quartiles[4],
+                'histogram': [{'from': edges[i], 'to': edges[i+1], 'count': histogram[i]}
+                              for i in range(len(histogram))],
+            },
+            'questions': [],
+        }
+        for column, question in enumerate(self.questions):
+            report['questions'].append({
+                'id': question['id'], 'name': question.get('question_name') or '',
+                'type': question.get('question_type'),
+                'points_possible': possible[column], 'answered': answered[column],
+                'difficulty': difficulty[column],
+                'discrimination': discrimination[column],
+                'upper_lower': upper_lower[column], 'answers': [],
+            })
+        for number, option in enumerate(self.options):
+            report['questions'][option['column']]['answers'].append({
+                'id': option['id'], 'text': option['text'], 'correct': option['correct'],
+                'count': chosen[number], 'frequency': frequency[number],
+                'upper': chosen_upper[number], 'lower': chosen_lower[number],
+            })
+        return plain(report)
+
+
+def plain(value):
+    '''Turns NumPy numbers into Python ones (and NaN into None), for exporting.'''
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float):
+        return None if value != value else round(value, 4)
+    return value
+
+
+def number(value, digits=2):
+    return '-' if value is None else '{:.{}f}'.format(value, digits)
+
+
+def to_text(report):
+    scores = report['scores']
+    lines = ["{}: {} students, {} points possible".format(
+                report['quiz'], report['students'], number(report['points_possible'], 1)),
+             "Scores: mean {}, std {}, min {}, Q1 {}, median {}, Q3 {}, max {}".format(
+                *(number(scores[key]) for key in ('mean', 'std', 'min', 'q1', 'median',
+                                                  'q3', 'max'))),
+             ""]
+    most = max([bin['count'] for bin in scores['histogram']] + [1])
+    for bin in scores['histogram']:
+        lines.append("  {:>7} - {:<7} {:<40} {}".format(
+            number(bin['from'], 1), number(bin['to'], 1),
+            '#' * int(round(40 * bin['count'] / most)), bin['count']))
+    lines.append("")
+    lines.append("{:<32} {:>6} {:>8} {:>10} {:>14} {:>11}".format(
+        "Question", "Points", "Answered", "Difficulty", "Discrimination", "Upper-lower"))
+    for question in report['questions']:
+        lines.append("{:<32} {:>6} {:>8} {:>10} {:>14} {:>11}".format(
+            question['name'][:32], number(question['points_possible'], 1),
+            question['answered'], number(question['difficulty']),
+            number(question['discrimination']), number(question['upper_lower'])))
+        for answer in question['answers']:
+            lines.append("  {} {:<40} {:>6} {:>6} {:>6} {:>6}".format(
+                '*' if answer['correct'] else ' ', answer['text'][:40],
+                answer['count'], number(answer['frequency']),
+                answer['upper'], answer['lower']))
+    return lines
+
+
+def to_html(report):
+    scores = report['scores']
+    out = io.StringIO()
+    out.write("<h1>{}</h1>\n".format(escape(report['quiz'])))
+    out.write("<p>{} students, {} points possible. Mean {}, standard deviation {}, "
+              "median {}.</p>\n".format(report['students'],
+                                        number(report['points_possible'], 1),
+                                        number(scores['mean']), number(scores['std']),
+                                        number(scores['median'])))
+    out.write("<table>\n<tr><th>Scores</th><th>Students</th></tr>\n")
+    for bin in scores['histogram']:
+        out.write("<tr><td>{} - {}</td><td>{}</td></tr>\n".format(
+            number(bin['from'], 1), number(bin['to'], 1), bin['count']))
+    out.write("</table>\n<table>\n<tr><th>Question</th><th>Answer</th><th>Points</th>"
+              "<th>Answered</th><th>Difficulty</th><th>Discrimination</th>"
+              "<th>Upper-lower</th></tr>\n")
+    for question in report['questions']:
+        out.write("<tr><th>{}</th><td></td><td>{}</td><td>{}</td><td>{}</td>"
+                  "<td>{}</td><td>{}</td></tr>\n".format(
+                      escape(question['name']), number(question['points_possible'], 1),
+                      question['answered'], number(question['difficulty']),
+                      number(question['discrimination']),
+                      number(question['upper_lower'])))
+        for answer in question['answers']:
+            out.write("<tr><td></td><td>{}{}</td><td></td><td>{}</td><td>{}</td>"
+                      "<td>{} upper</td><td>{} lower</td></tr>\n".format(
+                          '&#10004; ' if answer['correct'] else '',
+                          escape(answer['text']), answer['count'],
+                          number(answer['frequency']), answer['upper'],
+                          answer['lower']))
+    out.write("</table>\n")
+    return out.getvalue()
+
+
+def to_pdf(lines, lines_per_page=70):
+    '''A minimal PDF of the lines of text, in a fixed-width font.'''
+    pages = [lines[start:start+lines_per_page]
+             for start in range(0, len(lines), lines_per_page)] or [[]]
+    # The catalog, the page tree and the font come first, then each page
+    # and its contents
+    page_numbers = [4 + 2*index for index in range(len(pages))]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+                   " ".join("{} 0 R".format(page) for page in page_numbers),
+                   len(pages)).encode('ascii'),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"]
+    for page_number, page in zip(page_numbers, pages):
+        text = ["BT /F1 8 Tf 10 TL 36 756 Td"]
+        for line in page:
+            line = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            text.append("({}) Tj T*".format(line))
+        text.append("ET")
+        stream = "\n".join(text).encode('latin-1', 'replace')
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       "/Resources << /Font << /F1 3 0 R >> >> /Contents {} 0 R >>"
+                       .format(page_number+1).encode('ascii'))
+        objects.append("<< /Length {} >>\nstream\n".format(len(stream)).encode('ascii') +
+                       stream + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for index, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += "{} 0 obj\n".format(index).encode('ascii') + body + b"\nendobj\n"
+    start = len(out)
+    out += "xref\n0 {}\n0000000000 65535 f \n".format(len(objects)+1).encode('ascii')
+    for offset in offsets:
+        out += "{:010d} 00000 n \n".format(offset).encode('ascii')
+    out += "trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(
+        len(objects)+1, start).encode('ascii')
+    return bytes(out)
+
+
+def export(report, format):
+    '''
+    Returns:
+        bytes: The report in the given format.
+    '''
+    if format == 'json':
+        return json.dumps(report, indent=2).encode('utf-8')
+    if format == 'yaml':
+        out = io.BytesIO()
+        yaml.dump(report, out)
+        return out.getvalue()
+    if format == 'html':
+        return to_html(report).encode('utf-8')
+    if format == 'pdf':
+        return to_pdf(to_text(report))
+    return "\n".join(to_text(report)).encode('utf-8')
+
+
+def find_quizzes(course, raw_ids=None):
+    '''
+    Returns:
+        list[dict]: The Canvas JSON of every quiz named by the resource IDs,
+            or of every quiz if there are none.
+    '''
+    if not raw_ids or any(raw.endswith('/*') for raw in raw_ids):
+        for raw in raw_ids or []:
+            if ResourceID._parse_type(raw)[3] is not Quiz:
+                raise WaltzException("Only quizzes have results: "+raw)
+        return list(Quiz.iter_resources_on_canvas(course))
+    quizzes = []
+    for resource_id in ResourceID.resolve_all(course, raw_ids):
+        if resource_id.resource_type is not Quiz:
+            raise WaltzException("Only quizzes have results: "+resource_id.raw)
+        quizzes.append(resource_id.canvas_data)
+    return quizzes
+
+
+def report_results(course, raw_ids=None, format='raw', jobs=None):
+    '''
+    Analyzes the submissions of the quizzes, downloading those of up to
+    `jobs` quizzes at once (the "fetch-concurrency" setting, or 8). Quizzes
+    without an assignment (like ungraded surveys) have no submissions to
+    analyze, so they are skipped. A quiz that cannot be analyzed does not
+    stop the others; the errors are raised together at the end.
+    Returns:
+        int: How many quizzes were analyzed.
+    '''
+    require_numpy()
+    quizzes = []
+    for quiz in find_quizzes(course, raw_ids):
+        if quiz.get('assignment_id') is None:
+            log("Skipping", quiz['title']+": it has no assignment (e.g., an ungraded survey).")
+        else:
+            quizzes.append(quiz)
+    if jobs is None:
+        jobs = get_setting('fetch-concurrency', course=course.course_name,
+                           default=DEFAULT_FETCH_CONCURRENCY)
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(QuizResults.download, course, quiz) for quiz in quizzes]
+        for quiz, future in zip(quizzes, futures):
+            try:
+                report = future.result().analyze()
+                if format == 'raw':
+                    print("\n".join(to_text(report)))
+                    continue
+                path = os.path.join(course.root_directory, 'results',
+                                    make_safe_filename(report['quiz'])+EXTENSIONS[format])
+                course.write_file(path, export(report, format))
+                log("Wrote results to", path)
+            except Exception as e:
+                failures.append("{}: {}: {}".format(quiz['title'], type(e).__name__, e))
+    if failures:
+        raise WaltzException("Could not analyze {} quizzes:\n{}".format(
+            len(failures), "\n".join(failures)))
+    return len(quizzes)
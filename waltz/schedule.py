@@ -0,0 +1,341 @@
+'''
+Pushing a whole course in dependency order.
+
+Resources are pushed by a `DependencyScheduler`, which starts each push as
+soon as everything it depends on has been pushed, running independent
+pushes at the same time. The dependencies come from the resources
+themselves:
+
+* A page built from a template (a `.yaml` file in `pages` with a
+  `_template`) is rebuilt and pushed after the local pages and assignments
+  that its template links to with `make_link`, since the link can only be
+  made once they are on Canvas.
+* Within a quiz, each group is pushed before the questions in it (see
+  `Quiz.extra_push`).
+
+When a push fails, only the resources that depend on it are skipped. A
+scheduler started from a task of another one (like a quiz's, during a
+course push) runs its tasks one at a time, so that the number of pushes at
+the same time stays within the outer scheduler's limit.
+'''
+import os
+import threading
+from glob import glob
+from functools import partial
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from waltz.yaml_setup import yaml
+from waltz.canvas_tools import get_setting
+from waltz.resources import (RESOURCE_TYPES, Assignment, Page, ResourceID,
+                             WaltzException)
+from waltz.utilities import log, make_safe_filename, indent4
+
+DEFAULT_PUSH_CONCURRENCY = 8
+# Whether the current thread is running a scheduler's task
+_running = threading.local()
+# The categories that make_link searches
+LINKABLE_TYPES = (Assignment, Page)
+
+
+class DependencyScheduler:
+    '''
+    Runs tasks on a pool of threads, each once the tasks it depends on have
+    finished. A failed task skips the tasks that depend on it (directly or
+    not), but everything else still runs. Dependencies on tasks that were
+    never added are treated as already met.
+    '''
+    def __init__(self, jobs=DEFAULT_PUSH_CONCURRENCY):
+        self.jobs = jobs
+        self.tasks = OrderedDict()
+        self.finished = []
+        self.failed = OrderedDict()
+        self.skipped = OrderedDict()
+
+    def add(self, key, action, depends_on=()):
+        if key in self.tasks:
+            raise WaltzException("Task added twice: {}".format(key))
+        self.tasks[key] = (action, tuple(depends_on))
+
+    def _graph(self):
+        '''
+        Returns:
+            (dict, dict): How many unmet dependencies each task has, and the
+                tasks that depend on each task.
+        '''
+        waiting = OrderedDict()
+        dependents = {key: [] for key in self.tasks}
+        for key, (action, depends_on) in self.tasks.items():
+            depends_on = {other for other in depends_on if other in self.tasks}
+            waiting[key] = len(depends_on)
+            for other in depends_on:
+                dependents[other].append(key)
+        return waiting, dependents
+
+    def check(self):
+        '''Raises an exception if some tasks depend on each other in a cycle.'''
+        waiting, dependents = self._graph()
+        ready = deque(key for key, count in waiting.items() if not count)
+        reached = 0
+        while ready:
+            key = ready.popleft()
+            reached += 1
+            for dependent in dependents[key]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    ready.append(dependent)
+        if reached < len(waiting):
+            stuck = [str(key) for key, count in waiting.items() if count]
+            raise WaltzException("Circular dependencies between:\n{}".format(
+                indent4("\n".join(stuck))))
+
+    def _skip(self, failed_key, dependents):
+        pending = deque(dependents[failed_key])
+        while pending:
+            key = pending.popleft()
+            if key not in self.skipped:
+                self.skipped[key] = failed_key
+                pending.extend(dependents[key])
+
+    def _call(self, key):
+        nested = getattr(_running, 'task', False)
+        _running.task = True
+        try:
+            return self.tasks[key][0]()
+        finally:
+            _running.task = nested
+
+    def _settle(self, key, error, waiting, dependents, ready):
+        '''Records how a task ended, and queues the tasks it unblocked.'''
+        if error is not None:
+            self.failed[key] = error
+            self._skip(key, dependents)
+            return
+        self.finished.append(key)
+        for dependent in dependents[key]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+
+    def _run_here(self, waiting, dependents, ready):
+        while ready:
+            key = ready.popleft()
+            if key in self.skipped:
+                continue
+            try:
+                self._call(key)
+            except Exception as e:
+                self._settle(key, e, waiting, dependents, ready)
+            else:
+                self._settle(key, None, waiting, dependents, ready)
+
+    def run(self):
+        '''
+        Returns:
+            DependencyScheduler: Itself, with `finished`, `failed` (the
+                exception of each failed task) and `skipped` (the failed
+                task that each skipped task depended on) filled in.
+        '''
+        self.check()
+        waiting, dependents = self._graph()
+        ready = deque(key for key, count in waiting.items() if not count)
+        if getattr(_running, 'task', False) or self.jobs == 1:
+            self._run_here(waiting, dependents, ready)
+            return self
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while ready or running:
+                while ready:
+                    key = ready.popleft()
+                    if key not in self.skipped:
+                        running[pool.submit(self._call, key)] = key
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    self._settle(key, future.exception(), waiting, dependents,
+                                 ready)
+        return self
+
+    def describe_problems(self):
+        lines = ["{}: {}: {}".format(key, type(error).__name__, error)
+                 for key, error in self.failed.items()]
+        lines.extend("{}: skipped, since {} failed".format(key, failed)
+                     for key, failed in self.skipped.items())
+        return "\n".join(lines)
+
+
+def push_concurrency(course, jobs=None):
+    if jobs is not None:
+        return jobs
+    return get_setting('push-concurrency', course=course.course_name,
+                       default=DEFAULT_PUSH_CONCURRENCY)
+
+
+def template_sources(course):
+    '''
+    Returns:
+        dict[str, str]: The template data file of every page that is built
+            from a template, by the page's title.
+    '''
+    search_path = os.path.join(course.root_directory, Page.canonical_category,
+                               '**', '*.yaml')
+    sources = {}
+    for path in sorted(glob(search_path, recursive=True)):
+        if path.endswith('.public.yaml'):
+            continue
+        with open(path) as yaml_file:
+            yaml_data = yaml.load(yaml_file)
+        if isinstance(yaml_data, dict) and '_template' in yaml_data:
+            title = os.path.basename(path)[:-len('.yaml')]
+            sources[title] = path
+    return sources
+
+
+def template_links(course, template_name, yaml_data):
+    '''
+    Finds the names a template (or a template it extends or includes) links
+    to with the `make_link` filter, either written out or taken from the
+    page's data.
+    Returns:
+        set[str]: The linked resource names.
+    '''
+    from jinja2 import meta, nodes
+    names = set()
+    pending, seen = [template_name], set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        source = course.env.loader.get_source(course.env, name)[0]
+        ast = course.env.parse(source)
+        # Loop variables stand for each item of a list in the page's data
+        loops = {loop.target.name: loop.iter.name
+                 for loop in ast.find_all(nodes.For)
+                 if isinstance(loop.target, nodes.Name) and
+                 isinstance(loop.iter, nodes.Name)}
+        for node in ast.find_all(nodes.Filter):
+            if node.name != 'make_link':
+                continue
+            if isinstance(node.node, nodes.Const):
+                values = [node.node.value]
+            elif isinstance(node.node, nodes.Name):
+                values = yaml_data.get(loops.get(node.node.name, node.node.name))
+                values = values if isinstance(values, list) else [values]
+            else:
+                continue
+            names.update(value for value in values if isinstance(value, str))
+        pending.extend(other for other in meta.find_referenced_templates(ast)
+                       if other is not None)
+    return names
+
+
+def local_titles(course):
+    '''
+    Returns:
+        OrderedDict[str, list[str]]: The titles of the local resources of
+            every category, from their filenames.
+    '''
+    from waltz.plans import local_resource_ids
+    titles = OrderedDict()
+    for category in sorted(RESOURCE_TYPES):
+        titles[category] = [raw.split('/?', 1)[1]
+                            for raw in local_resource_ids(course, category+'/*')]
+    return titles
+
+
+def canvas_titles(course, resource_type):
+    '''
+    Lists a category once, so that each resource can be matched by its exact
+    title instead of searched for.
+    '''
+    return {resource_type.identify_title(data): data
+            for data in resource_type.iter_resources_on_canvas(course)}
+
+
+def course_push_tasks(course):
+    '''
+    Works out what pushing every local resource of the course takes.
+    Returns:
+        list[tuple[str, str, list[str]]]: The "?title" resource ID of each
+            local resource, the template data file it is built from (or
+            None), and the resource IDs it depends on.
+    '''
+    titles = local_titles(course)
+    templates = template_sources(course)
+    # Templated pages are pushed even if they were never built
+    for title in templates:
+        if title not in titles[Page.canonical_category]:
+            titles[Page.canonical_category].append(title)
+    linkable = {}
+    for resource_type in LINKABLE_TYPES:
+        for title in titles[resource_type.canonical_category]:
+            linkable.setdefault(title, "{}/?{}".format(resource_type.canonical_category,
+                                                       title))
+    tasks = []
+    for category, category_titles in titles.items():
+        resource_type = RESOURCE_TYPES[category]
+        for title in category_titles:
+            raw = "{}/?{}".format(category, title)
+            depends_on = []
+            template = templates.get(title) if resource_type is Page else None
+            if template is not None:
+                with open(template) as yaml_file:
+                    yaml_data = yaml.load(yaml_file)
+                for name in template_links(course, yaml_data['_template'], yaml_data):
+                    target = linkable.get(make_safe_filename(name))
+                    if target is not None and target != raw:
+                        depends_on.append(target)
+            tasks.append((raw, template, depends_on))
+    return tasks
+
+
+def push_built_resource(course, resource_id, template=None):
+    '''Rebuilds the resource from its template data file, if any, and pushes it.'''
+    from waltz.sync import push_resource, build_from_template
+    if template is not None:
+        # Building loads local files, like from_disk does
+        with course.load_lock:
+            build_from_template(os.path.basename(template), course.root_directory,
+                                course, False)
+    push_resource(resource_id, 'raw', course.root_directory, course, False)
+
+
+def plan_course_push(course, jobs=None):
+    '''
+    Builds a scheduler that pushes every local resource of the course,
+    with each resource's dependencies pushed first.
+    '''
+    scheduler = DependencyScheduler(push_concurrency(course, jobs))
+    tasks = course_push_tasks(course)
+    on_canvas = {}
+    for category in sorted({raw.split('/', 1)[0] for raw, template, depends_on in tasks}):
+        on_canvas[category] = {make_safe_filename(title): data for title, data in
+                               canvas_titles(course, RESOURCE_TYPES[category]).items()}
+    for raw, template, depends_on in tasks:
+        category, title = raw.split('/?', 1)
+        resource_id = ResourceID.from_canvas_data(course, raw,
+                                                  on_canvas[category].get(title))
+        scheduler.add(raw, partial(push_built_resource, course, resource_id,
+                                   template), depends_on)
+    return scheduler
+
+
+def push_course(course, jobs=None):
+    '''
+    Pushes every local resource of the course, in dependency order.
+    Returns:
+        int: How many resources were pushed.
+    '''
+    scheduler = plan_course_push(course, jobs)
+    log("Pushing", len(scheduler.tasks), "resources,", scheduler.jobs, "at a time.")
+    scheduler.run()
+    if scheduler.failed:
+        raise WaltzException("Pushed {} resources, but {} failed and {} were "
+                             "skipped:\n{}".format(
+                                 len(scheduler.finished), len(scheduler.failed),
+                                 len(scheduler.skipped),
+                                 indent4(scheduler.describe_problems())))
+    return len(scheduler.finished)
@@ -0,0 +1,158 @@
+'''
+Single-file course snapshots.
+
+A snapshot keeps every pulled resource of a course (its raw Canvas JSON and
+the converted Markdown/YAML that would normally be written to disk) as
+compressed rows in one SQLite file. Entries can be looked up by Canvas id or
+by title, are only rewritten when their contents change, and can be exported
+to the usual directory layout whenever the loose files are actually needed.
+'''
+import os
+import json
+import zlib
+import sqlite3
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+
+from waltz.utilities import ensure_dir
+
+SnapshotEntry = namedtuple('SnapshotEntry', ['category', 'canvas_id', 'title',
+                                             'path', 'canvas_data',
+                                             'representation', 'updated_at'])
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    category TEXT NOT NULL,
+    canvas_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    path TEXT NOT NULL,
+    canvas_json BLOB NOT NULL,
+    representation BLOB NOT NULL,
+    digest TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (category, canvas_id)
+);
+CREATE INDEX IF NOT EXISTS entries_by_title ON entries (category, title);
+'''
+
+
+class Snapshot:
+    '''
+    Args:
+        path (str): The snapshot file; it is created if it does not exist.
+    '''
+    COMPRESSION_LEVEL = 6
+
+    def __init__(self, path):
+        self.path = path
+        ensure_dir(os.path.abspath(path))
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def store(self, category, canvas_id, title, path, canvas_data,
+              representation):
+        '''
+        Adds or updates a single resource. Unchanged entries are not touched.
+
+        Args:
+            path (str): Where the resource lives, relative to the course root.
+            canvas_data (dict): The raw JSON from Canvas.
+            representation (bytes): The converted file contents.
+        Returns:
+            bool: Whether the entry was new or changed.
+        '''
+        canvas_json = json.dumps(canvas_data, sort_keys=True).encode('utf-8')
+        digest = hashlib.sha1(canvas_json + b'\0' + representation).hexdigest()
+        row = self.connection.execute(
+            'SELECT digest FROM entries WHERE category=? AND canvas_id=?',
+            (category, str(canvas_id))).fetchone()
+        if row is not None and row[0] == digest:
+            return False
+        self.connection.execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (category, str(canvas_id), title, path,
+             zlib.compress(canvas_json, self.COMPRESSION_LEVEL),
+             zlib.compress(representation, self.COMPRESSION_LEVEL),
+             digest, datetime.now().isoformat()))
+        self.connection.commit()
+        return True
+
+    def remove(self, category, canvas_id):
+        self.connection.execute(
+            'DELETE FROM entries WHERE category=? AND canvas_id=?',
+            (category, str(canvas_id)))
+        self.connection.commit()
+
+    def _entry(self, row):
+        category, canvas_id, title, path, canvas_json, representation, updated_at = row
+        return SnapshotEntry(category, canvas_id, title, path,
+                             json.loads(zlib.decompress(canvas_json).decode('utf-8')),
+                             zlib.decompress(representation), updated_at)
+
+    def by_id(self, category, canvas_id):
+        row = self.connection.execute(
+            'SELECT category, canvas_id, title, path, canvas_json, '
+            'representation, updated_at FROM entries '
+            'WHERE category=? AND canvas_id=?',
+            (category, str(canvas_id))).fetchone()
+        return None if row is None else self._entry(row)
+
+    def by_title(self, category, title):
+        '''
+        Returns:
+            list of SnapshotEntry: Every entry in the category with that title.
+        '''
+        rows = self.connection.execute(
+            'SELECT category, canvas_id, title, path, canvas_json, '
+            'representation, updated_at FROM entries '
+            'WHERE category=? AND title=?', (category, title)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def entries(self, category=None):
+        '''Yields every entry (optionally only those in one category).'''
+        query = ('SELECT category, canvas_id, title, path, canvas_json, '
+                 'representation, updated_at FROM entries')
+        if category is None:
+            rows = self.connection.execute(query)
+        else:
+            rows = self.connection.execute(query+' WHERE category=?',
+                                           (category,))
+        for row in rows:
+            yield self._entry(row)
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def export(self, root, entries=None):
+        '''
+        Writes entries out to the regular directory layout under ``root``.
+        Files whose contents already match are left alone.
+
+        Returns:
+            int: How many files were written.
+        '''
+        written = 0
+        if entries is None:
+            entries = self.entries()
+        for entry in entries:
+            path = os.path.join(root, entry.path)
+            if os.path.exists(path):
+                with open(path, 'rb') as existing:
+                    if existing.read() == entry.representation:
+                        continue
+            ensure_dir(path)
+            with open(path, 'wb') as out:
+                out.write(entry.representation)
+            written += 1
+        return written
@@ -0,0 +1,98 @@
+'''
+The shared stylesheet for class-based code highlighting.
+
+With the "highlight-mode: classes" setting, code blocks are pushed with short
+Pygments class names (`<span class="k">`) instead of inline styles on every
+token. The rules for those classes are kept in `_styles/highlight.css` next to
+the course, and uploaded once to the course files; it is only uploaded again
+when the rules change (a new Pygments style or version).
+
+Canvas removes <style> and <link> tags from page content, so the uploaded
+stylesheet has to be included through the account's theme (custom CSS) by an
+admin. Until the "highlight-theme-applied: true" setting says that has been
+done, class mode is refused (see Course.set_highlight_mode), since the pages
+would show up unstyled.
+'''
+import os
+import re
+import json
+import hashlib
+
+from waltz.canvas_tools import upload_file
+from waltz.utilities import log
+
+STYLESHEET_NAME = 'waltz-highlight.css'
+STYLESHEET_FOLDER = 'waltz'
+# The classes each Pygments style has rules for
+STYLED_CLASSES = {}
+UNSTYLED_SPAN = re.compile(r'<span(?: class="([\w-]+)")?>([^<]*)</span>')
+
+
+def build_stylesheet(style='default', css_class='codehilite'):
+    '''
+    Returns:
+        str: The CSS rules for code highlighted with the given Pygments style.
+    '''
+    from pygments.formatters import HtmlFormatter
+    return HtmlFormatter(style=style).get_style_defs('.'+css_class)
+
+
+def styled_classes(style='default'):
+    if style not in STYLED_CLASSES:
+        from pygments.formatters import HtmlFormatter
+        STYLED_CLASSES[style] = frozenset(HtmlFormatter(style=style).class2style)
+    return STYLED_CLASSES[style]
+
+
+def strip_unstyled_spans(html, style='default'):
+    '''
+    Pygments wraps every token in a span, but most classes (names,
+    punctuation) have no rules in the stylesheet; their spans are removed.
+    '''
+    styled = styled_classes(style)
+
+    def replace(match):
+        if match.group(1) in styled:
+            return match.group(0)
+        return match.group(2)
+    return UNSTYLED_SPAN.sub(replace, html)
+
+
+def stylesheet_state_path(course):
+    return os.path.join(course.root_directory, '_cache', 'stylesheet.json')
+
+
+def write_stylesheet(course, style='default', css_class='codehilite'):
+    '''
+    Writes the stylesheet into the course's `_styles` folder.
+    Returns:
+        (str, bytes): Where the stylesheet was written, and its contents.
+    '''
+    stylesheet = build_stylesheet(style, css_class).encode('utf-8')
+    path = os.path.join(course.root_directory, '_styles', 'highlight.css')
+    course.write_file(path, stylesheet)
+    return path, stylesheet
+
+
+def push_stylesheet(course, style='default', css_class='codehilite'):
+    '''
+    Writes the stylesheet into the course's `_styles` folder and uploads it,
+    unless the same stylesheet was already uploaded.
+    Returns:
+        bool: Whether the stylesheet was uploaded.
+    '''
+    path, stylesheet = write_stylesheet(course, style, css_class)
+    digest = hashlib.sha1(stylesheet).hexdigest()
+    state_path = stylesheet_state_path(course)
+    if os.path.exists(state_path):
+        with open(state_path) as state_file:
+            if json.load(state_file).get('sha1') == digest:
+                return False
+    uploaded = upload_file(STYLESHEET_NAME, stylesheet, 'text/css',
+                           course=course.course_name,
+                           parent_folder_path=STYLESHEET_FOLDER)
+    state = {'sha1': digest, 'id': uploaded.get('id'),
+             'url': uploaded.get('url')}
+    course.write_file(state_path, json.dumps(state, indent=2).encode('utf-8'))
+    log("Uploaded the highlighting stylesheet: ", state['url'])
+    return True
@@ -1,51 +1,129 @@
-import json
+import io
 import os
-import math
-import requests
-import requests_cache
+import sys
+import time
 import argparse
-import re
-import csv
-import dateutil.parser
-from datetime import datetime
-from pprint import pprint
-from collections import Counter, defaultdict
-try:
-    from tqdm import tqdm
-except:
-    print("TQDM is not installed. No progress bars will be available.")
-    tqdm = list
-
 from glob import glob
+from collections import deque
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from waltz.yaml_setup import yaml
-from ruamel.yaml.scalarstring import walk_tree
-    
-from waltz.canvas_tools import get, post, put, delete, progress_loop
-from waltz.canvas_tools import get_setting, get_courses, download_file
-from waltz.canvas_tools import from_canvas_date, to_canvas_date
-from waltz.canvas_tools import yaml_load, load_settings
-from waltz.utilities import ensure_dir, global_settings, log
-from waltz.resources import (RESOURCE_CATEGORIES, ResourceID, WaltzException,
-                             Course, Page)
+
+from waltz.canvas_tools import get_setting, get_courses, load_settings
+from waltz.utilities import global_settings, log, indent4
+from waltz.resources import (RESOURCE_TYPES, ResourceID, find_by_title,
+                             WaltzException, Course, Page)
+from waltz.quizzes import Quiz
+from waltz.files import File, pull_files, push_files
+from waltz.snapshots import Snapshot
+from waltz.watcher import watch_course
+from waltz.plans import PushPlan, plan_push
+from waltz.dates import shift_dates, parse_offset, load_date_mapping
+from waltz.publicize import publicize_all
+from waltz.schedule import push_course
+from waltz.tasks import run_queued
+from waltz.results import report_results
 
 #multiple_dropdowns_question
 
+def open_course(course_name, directory):
+    '''
+    Returns:
+        Course: The course itself, if one is given, or else the course with
+            that name whose files are in the directory.
+    '''
+    if isinstance(course_name, str):
+        return Course(directory, course_name)
+    return course_name
+
 def pull_all_resources(resource_ids, format, destination, course_name, ignore):
-    course = Course(destination, course_name)
+    course = open_course(course_name, destination)
     category, _, _, resource_type = ResourceID._parse_type(resource_ids)
-    resource_list = resource_type.find_resource_on_canvas(course, '')
-    for resource_json in resource_list:
-        id = resource_type.identify_id(resource_json)
-        title = resource_type.identify_title(resource_json)
-        print(title)
-        resource_id = "{category}/:{id}".format(category=category, id=id)
-        pull_resource(resource_id, format, destination, course_name, ignore)
-    return len(resource_list)
+    if resource_type is Quiz:
+        return pull_all_quizzes(course)
+    if resource_type is File:
+        return pull_files(course)
+    # Each resource is pulled while the next page of the listing downloads,
+    # and its files are written in the background
+    count = 0
+    with course.write_behind():
+        for resource_json in resource_type.iter_resources_on_canvas(course):
+            id = resource_type.identify_id(resource_json)
+            title = resource_type.identify_title(resource_json)
+            print(title)
+            # The listing already identifies the resource, so it is not fetched again
+            resource_id = ResourceID.from_canvas_data(
+                course, "{category}/:{id}".format(category=category, id=id),
+                resource_json)
+            pull_resource(resource_id, format, destination, course, ignore)
+            count += 1
+    return count
+
+def pull_all_quizzes(course, jobs=None):
+    '''
+    Pulls every quiz, downloading the questions and groups of up to `jobs`
+    quizzes at once (the "fetch-concurrency" setting, or 8). Each quiz is
+    converted and written while later quizzes are still downloading.
+    Returns:
+        int: How many quizzes were pulled.
+    '''
+    if jobs is None:
+        jobs = get_setting('fetch-concurrency', course=course.course_name,
+                           default=8)
+    timings = []
+
+    def fetch(quiz_json):
+        start = time.time()
+        parts = Quiz.fetch_parts(course, quiz_json)
+        return parts, time.time() - start
+
+    def convert(quiz_json, fetched):
+        (questions, groups), fetch_time = fetched.result()
+        start = time.time()
+        resource_id = ResourceID.from_canvas_data(
+            course, "quizzes/:{}".format(quiz_json['id']), quiz_json)
+        quiz = Quiz.from_parts(course, quiz_json, questions, groups)
+        course.to_disk(resource_id, quiz)
+        if course.snapshot is None:
+            course.record_canvas_state(resource_id)
+        timings.append((resource_id.canvas_title, len(questions),
+                        fetch_time, time.time() - start))
+    # Conversions happen on this thread, since they are not thread-safe;
+    # the window of pending downloads keeps memory bounded.
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as pool, course.write_behind():
+        for quiz_json in Quiz.iter_resources_on_canvas(course):
+            print(Quiz.identify_title(quiz_json))
+            pending.append((quiz_json, pool.submit(fetch, quiz_json)))
+            while len(pending) > 2*jobs:
+                convert(*pending.popleft())
+        while pending:
+            convert(*pending.popleft())
+    report_quiz_timings(timings)
+    return len(timings)
+
+def report_quiz_timings(timings):
+    '''Logs how long each quiz took to download and convert, slowest first.'''
+    if not timings:
+        return
+    log("{:<40} {:>9} {:>9} {:>9}".format("Quiz", "Questions", "Fetch s", "Convert s"))
+    for title, questions, fetched, converted in sorted(timings,
+                                                       key=lambda t: -(t[2]+t[3])):
+        log("{:<40} {:>9} {:>9.2f} {:>9.2f}".format(title[:40], questions,
+                                                    fetched, converted))
+    log("{:<40} {:>9} {:>9.2f} {:>9.2f}".format(
+        "Total ({} quizzes)".format(len(timings)),
+        sum(t[1] for t in timings), sum(t[2] for t in timings),
+        sum(t[3] for t in timings)))
 
 def push_resource(resource_id, format, source, course_name, ignore):
-    course = Course(source, course_name)
-    resource_id = ResourceID(course, resource_id)
+    course = open_course(course_name, source)
+    if isinstance(resource_id, str):
+        resource_id = ResourceID(course, resource_id)
+    if resource_id.resource_type is File:
+        push_files(course, [resource_id])
+        return
     # Make a backup of the canvas version
     json_resource = course.pull(resource_id)
     resource_id.resource_type.extra_pull(course, resource_id)
@@ -56,37 +134,76 @@ def push_resource(resource_id, format, source, course_name, ignore):
     #pprint(json_resource)
     course.push(resource_id, json_resource)
     resource.extra_push(course, resource_id)
+    course.record_canvas_state(resource_id)
+
+def push_resources(resource_ids, format, source, course_name, ignore):
+    '''
+    Pushes several resources, resolving all of their IDs together first
+    (see ResourceID.resolve_all).
+    Returns:
+        int: How many resources were pushed.
+    '''
+    course = open_course(course_name, source)
+    resolved = ResourceID.resolve_all(course, resource_ids)
+    # Files are uploaded together, several at a time
+    files = [resource_id for resource_id in resolved if resource_id.resource_type is File]
+    for resource_id in resolved:
+        if resource_id.resource_type is not File:
+            push_resource(resource_id, format, source, course, ignore)
+    if files:
+        push_files(course, files)
+    return len(resolved)
+
+def pull_resources(resource_ids, format, destination, course_name, ignore):
+    '''
+    Pulls several resources, resolving all of their IDs together first
+    (see ResourceID.resolve_all).
+    Returns:
+        int: How many resources were pulled.
+    '''
+    course = open_course(course_name, destination)
+    resolved = ResourceID.resolve_all(course, resource_ids)
+    files = [resource_id for resource_id in resolved if resource_id.resource_type is File]
+    with course.write_behind():
+        for resource_id in resolved:
+            if resource_id.resource_type is not File:
+                pull_resource(resource_id, format, destination, course, ignore)
+    if files:
+        pull_files(course, files)
+    return len(resolved)
 
 def pull_resource(resource_id, format, destination, course_name, ignore):
     '''
     If resource_id is a number
     '''
-    if isinstance(course_name, str):
-        course = Course(destination, course_name)
-    else:
-        course = course_name
-    resource_id = ResourceID(course, resource_id)
+    course = open_course(course_name, destination)
+    if isinstance(resource_id, str):
+        resource_id = ResourceID(course, resource_id)
+    if resource_id.resource_type is File:
+        pull_files(course, [resource_id])
+        return
     # Save the version from the server
     json_resource = course.pull(resource_id)
     resource = course.from_json(resource_id, json_resource)
     course.to_disk(resource_id, resource)
+    if course.snapshot is None:
+        course.record_canvas_state(resource_id)
     
 def publicize_resource(resource_id, format, destination, course_name, ignore):
-    if isinstance(course_name, str):
-        course = Course(destination, course_name)
+    course = open_course(course_name, destination)
+    # Publicizing only needs the local file, so searches are resolved on disk
+    category, command, name, resource_type = ResourceID._parse_type(resource_id)
+    if command == '?':
+        resource_id = ResourceID.from_canvas_data(course, resource_id, None)
     else:
-        course = course_name
-    resource_id = ResourceID(course, resource_id)
+        resource_id = ResourceID(course, resource_id)
     # Find the resource on disk
     resource = course.from_disk(resource_id)
     public_resource = course.to_public(resource_id, resource)
     course.publicize(resource_id, public_resource)
     
 def build_from_template(path, destination, course_name, ignore):
-    if isinstance(course_name, str):
-        course = Course(destination, course_name)
-    else:
-        course = course_name
+    course = open_course(course_name, destination)
     # Find the YAML file
     search_path = os.path.join(destination, Page.canonical_category, '**', path)
     potentials = glob(search_path, recursive=True)
@@ -108,52 +225,269 @@ def build_from_template(path, destination, course_name, ignore):
     with open(output_path, 'w') as output_file:
         output_file.write(markdown_page)
 
-def main(args):
-    global quiet
-    load_settings(args.settings)
-    
-    if not args.ignore:
-        requests_cache.install_cache('waltz_cache')
-    
-    # Override default course
-    if args.course:
-        course = args.course
-        if course not in get_courses():
-            raise Exception("Unknown course name: {}".format(course))
+def export_snapshot(resource_id, destination, snapshot):
+    '''
+    Writes snapshot entries out as regular files. The resource ID can be
+    None (everything), "category/*", "category/:id" or "category/?title",
+    where the title is matched like any other `?` (see find_by_title).
+    '''
+    if resource_id is None:
+        entries = list(snapshot.entries())
     else:
-        course = get_setting('course')
-    
+        category, command, name, resource_type = ResourceID._parse_type(resource_id)
+        category = resource_type.canonical_category
+        if command == '*':
+            entries = list(snapshot.entries(category))
+        elif command == ':':
+            entries = [snapshot.by_id(category, name)]
+        elif command == '?':
+            entries = find_by_title(name, snapshot.entries(category),
+                                    lambda entry: entry.title)
+            if len(entries) > 1:
+                raise WaltzException("Ambiguous {} resource ID: {}\nMatches:\n{}".format(
+                    resource_type.canvas_name, resource_id,
+                    indent4("\n".join(entry.title for entry in entries))))
+        else:
+            raise WaltzException("Unknown command: "+repr(command))
+        entries = [entry for entry in entries if entry is not None]
+        if not entries:
+            raise WaltzException("No snapshot entries found for: "+resource_id)
+    return snapshot.export(destination, entries)
+
+def course_destination(args, course_name):
     if args.destination is None:
-        destination = 'courses/{}/'.format(course)
+        # Daemon jobs give the directory the command was given in
+        destination = os.path.join(getattr(args, 'cwd', None) or '',
+                                   'courses', course_name, '')
         os.makedirs(destination, exist_ok=True)
-    else:
-        destination = args.destination
+        return destination
+    return args.destination
+
+def run_course(args, course_name, cache_name='waltz_cache', course=None):
+    '''
+    Performs the requested verb on a single course. An existing Course can
+    be given to reuse what it has already loaded (see waltz.daemon).
+    Returns:
+        int: How many resources were handled.
+    '''
+    if not args.ignore:
+        import requests_cache
+        requests_cache.install_cache(cache_name)
     
-    # Handle quiet
-    global_settings['quiet'] = args.quiet
+    destination = course_destination(args, course_name)
+    if course is None:
+        course = Course(destination, course_name)
+    if args.snapshot:
+        course.snapshot = Snapshot(args.snapshot)
+    course.cache_highlighting()
+    try:
+        course.set_highlight_mode()
+        return run_verb(args, course, destination)
+    finally:
+        course.stop_caching_highlighting()
+        if course.snapshot is not None:
+            course.snapshot.close()
+            course.snapshot = None
 
+def run_verb(args, course, destination):
+    '''
+    Performs the requested verb with a course that is ready to use (see
+    run_course).
+    Returns:
+        int: How many resources were handled.
+    '''
+    # The pull and push verbs can be given several resource IDs at once
+    raw_ids = [args.id] if isinstance(args.id, str) else list(args.id or [])
+    if len(raw_ids) > 1 and args.verb not in ('pull', 'push', 'results'):
+        raise WaltzException("Only the pull, push and results verbs take several resource IDs.")
+    raw_id = raw_ids[0] if raw_ids else None
+
+    # Pulls and pushes of many resources can go through the task queue
+    queued = ((getattr(args, 'queue', False) or
+               get_setting('task-queue', course=course.course_name, default=False)) and
+              (raw_id is None or len(raw_ids) > 1 or raw_id.endswith('/*')))
+
+    count = 1
     # Handle the dates exporting
     if args.verb == 'pull':
-        if args.id is None:
-            successes = pull_all_resources(args.format, destination, 
-                                           args.course, args.ignore)
-            log("Finished", len(successes), "reports.")
-            log(sum(map(bool, successes)), "were successful.")
-        elif args.id.endswith("/*"):
-            count = pull_all_resources(args.id, args.format, destination,
-                                       args.course, args.ignore)
+        if queued:
+            count = run_queued(course, 'pull', raw_ids, args.jobs)
+        elif raw_id is None:
+            count = 0
+            with course.write_behind():
+                for category in sorted(RESOURCE_TYPES):
+                    count += pull_all_resources(category+"/*", args.format,
+                                                destination, course, args.ignore)
+            log("Finished", count, "pulls.")
+        elif len(raw_ids) > 1:
+            count = pull_resources(raw_ids, args.format, destination,
+                                   course, args.ignore)
+            log("Finished", count, "pulls.")
+        elif raw_id.endswith("/*"):
+            count = pull_all_resources(raw_id, args.format, destination,
+                                       course, args.ignore)
             log("Finished", count, "pulls.")
         else:
-            pull_resource(args.id, args.format, destination,
-                          args.course, args.ignore)
+            pull_resource(raw_id, args.format, destination,
+                          course, args.ignore)
     if args.verb == 'push':
-        if args.id is None:
-            pass
+        if args.apply or not args.plan:
+            course.push_stylesheet()
+        if args.apply:
+            plan = PushPlan.load(args.apply)
+            plan.apply(course)
+            count = len(plan.resources)
+            log("Applied plan for", count, "resources.")
+        elif args.plan:
+            plan = plan_push(course, raw_ids or None)
+            print(plan.describe())
+            if isinstance(args.plan, str):
+                plan.save(args.plan)
+                log("Saved plan to", args.plan)
+            count = len(plan.resources)
+        elif queued:
+            count = run_queued(course, 'push', raw_ids, args.jobs)
+            log("Finished", count, "pushes.")
+        elif (len(raw_ids) == 1 and raw_id.endswith('/*') and
+              ResourceID._parse_type(raw_id)[3] is File):
+            count = push_files(course, None, args.jobs)
+            log("Finished", count, "uploads.")
+        elif raw_id is None:
+            count = push_course(course, args.jobs)
+            log("Finished", count, "pushes.")
+        elif len(raw_ids) > 1:
+            count = push_resources(raw_ids, args.format, destination,
+                                   course, args.ignore)
+            log("Finished", count, "pushes.")
         else:
-            push_resource(args.id, args.format, destination,
-                          args.course, args.ignore)
+            push_resource(raw_id, args.format, destination,
+                          course, args.ignore)
     if args.verb == 'build':
-        build_from_template(args.id, destination, args.course, args.ignore)
+        build_from_template(raw_id, destination, course, args.ignore)
     if args.verb == 'publicize':
-        publicize_resource(args.id, args.format, destination,
-                        args.course, args.ignore)
\ No newline at end of file
+        if raw_id is None or raw_id == 'all' or raw_id.endswith('/*'):
+            count = publicize_all(course, raw_id)
+            log("Publicized", count, "resources.")
+        else:
+            publicize_resource(raw_id, args.format, destination,
+                            course, args.ignore)
+    if args.verb == 'watch':
+        course.push_stylesheet()
+        count = watch_course(course, args.debounce, args.poll)
+        log("Pushed", count, "resources.")
+    if args.verb == 'shift-dates':
+        offset = parse_offset(args.offset) if args.offset else None
+        mapping = load_date_mapping(args.mapping) if args.mapping else None
+        count = shift_dates(course, offset, mapping, raw_id)
+        log("Shifted dates in", count, "resources.")
+    if args.verb == 'results':
+        count = report_results(course, raw_ids, args.format, args.jobs)
+        log("Analyzed", count, "quizzes.")
+    if args.verb == 'export':
+        if course.snapshot is None:
+            raise WaltzException("The export verb needs a --snapshot file.")
+        count = export_snapshot(raw_id, destination, course.snapshot)
+        log("Exported", count, "files.")
+    return count
+
+def _run_course_in_worker(args, course_name):
+    '''
+    Runs one course of a multi-course invocation inside a worker process.
+    Each worker has its own Course objects, resource caches and HTTP cache
+    file, and its output is captured so that it can be reported per course.
+    '''
+    load_settings(args.settings)
+    global_settings['quiet'] = args.quiet
+    summary = {'course': course_name, 'count': 0, 'error': None}
+    output = io.StringIO()
+    start = time.time()
+    try:
+        with redirect_stdout(output):
+            summary['count'] = run_course(args, course_name,
+                                          'waltz_cache_'+course_name)
+    except Exception as e:
+        summary['error'] = "{}: {}".format(type(e).__name__, e)
+    summary['seconds'] = time.time() - start
+    summary['output'] = output.getvalue()
+    return summary
+
+def per_course_args(args, course_name):
+    '''
+    Each course gets its own destination and snapshot file, so that
+    concurrent runs never write to the same place.
+    '''
+    course_args = argparse.Namespace(**vars(args))
+    if args.destination is not None:
+        course_args.destination = os.path.join(args.destination, course_name)
+    if args.snapshot is not None:
+        root, extension = os.path.splitext(args.snapshot)
+        course_args.snapshot = "{}_{}{}".format(root, course_name, extension)
+    return course_args
+
+def run_courses(args, course_names):
+    '''
+    Runs the same verb across several courses at once, with at most
+    `--jobs` (or the "max-concurrency" setting) courses in flight.
+    Returns:
+        list[dict]: A summary for each course, in the order given.
+    '''
+    jobs = args.jobs or get_setting('max-concurrency', default=4)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(course_names))) as pool:
+        futures = [pool.submit(_run_course_in_worker,
+                               per_course_args(args, course_name), course_name)
+                   for course_name in course_names]
+        return [future.result() for future in futures]
+
+def print_course_summaries(verb, summaries):
+    for summary in summaries:
+        print("==", summary['course'], "==")
+        if summary['output'].strip():
+            print(indent4(summary['output'].rstrip()))
+    print("Summary of", verb, "across", len(summaries), "courses:")
+    for summary in summaries:
+        status = ("FAILED - "+summary['error'] if summary['error']
+                  else "{} resources".format(summary['count']))
+        print("    {:<20} {:>7.1f}s  {}".format(summary['course'],
+                                              summary['seconds'], status))
+
+def select_courses(args):
+    '''
+    Returns:
+        list[str]: The names of the courses to work on.
+    '''
+    if args.all_courses:
+        return list(get_courses())
+    elif args.course:
+        for course in args.course:
+            if course not in get_courses():
+                raise Exception("Unknown course name: {}".format(course))
+        return args.course
+    else:
+        return [get_setting('course')]
+
+def main(args):
+    # Handle quiet
+    global_settings['quiet'] = args.quiet
+    
+    if getattr(args, 'daemon', None):
+        from waltz.daemon import forward_to_daemon
+        return forward_to_daemon(args)
+    
+    load_settings(args.settings)
+    
+    if args.verb == 'daemon':
+        from waltz.daemon import serve
+        return serve(args)
+    
+    # Override default course
+    course_names = select_courses(args)
+    
+    if len(course_names) == 1:
+        run_course(args, course_names[0])
+    else:
+        summaries = run_courses(args, course_names)
+        print_course_summaries(args.verb, summaries)
+        failed = [summary['course'] for summary in summaries if summary['error']]
+        if failed:
+            sys.exit("Failed in {} of {} courses: {}".format(
+                len(failed), len(summaries), ", ".join(failed)))
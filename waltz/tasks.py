@@ -0,0 +1,414 @@
+'''
+A durable queue of per-resource pull and push tasks.
+
+With `--queue`, a pull or push of many resources is split into one task per
+resource. The tasks are recorded in `_cache/tasks.sqlite` next to the course
+and run by a pool of workers (`--jobs`, or the "task-workers" setting, or 4).
+A task that failed because Canvas could not be reached, failed (a 5xx
+status) or throttled it is retried after "task-backoff" seconds (1 by
+default), twice as long after each further failure, up to "task-attempts"
+(3) attempts in all; any other error (like a missing or ambiguous resource)
+fails the task at once. Each task's status, attempts, timing and last error
+are recorded as it runs.
+
+A run that was interrupted, crashed or ended with failed tasks is resumed by
+running the same command again: only the tasks that have not finished are
+run. Each run records the process running it, so a run that is still going
+in another process is never resumed twice. Pushes of a whole course keep
+the dependency order of waltz.schedule.
+'''
+import os
+import json
+import time
+import sqlite3
+import threading
+from functools import partial
+from collections import OrderedDict
+
+from waltz.canvas_tools import get_setting, CanvasUnavailable
+from waltz.resources import RESOURCE_TYPES, ResourceID, WaltzException
+from waltz.quizzes import Quiz
+from waltz.files import File, pull_files
+from waltz.schedule import DependencyScheduler, course_push_tasks, push_built_resource
+from waltz.utilities import ensure_dir, log, indent4, make_safe_filename
+
+DEFAULT_WORKERS = 4
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BACKOFF = 1.0
+TASK_COLUMNS = ('key', 'resource', 'template', 'depends_on', 'status',
+                'attempts', 'started', 'finished', 'seconds', 'error')
+
+
+def tasks_path(root_directory):
+    return os.path.join(root_directory, '_cache', 'tasks.sqlite')
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TaskQueue:
+    '''
+    The runs of the queue and their tasks. A run is one pull or push
+    command (a verb and its resource IDs); it stays unfinished until every
+    one of its tasks is done.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        ensure_dir(path)
+        self.connection = sqlite3.connect(path, timeout=30,
+                                          check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY, verb TEXT NOT NULL,
+                target TEXT NOT NULL, status TEXT NOT NULL,
+                created REAL NOT NULL, finished REAL, owner INTEGER);
+            CREATE TABLE IF NOT EXISTS tasks (
+                run INTEGER NOT NULL, key TEXT NOT NULL,
+                resource TEXT NOT NULL, template TEXT,
+                depends_on TEXT NOT NULL, status TEXT NOT NULL,
+                attempts INTEGER NOT NULL, started REAL, finished REAL,
+                seconds REAL, error TEXT, PRIMARY KEY (run, key));''')
+        # Queues from before runs had owners
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(runs)')]
+        if 'owner' not in columns:
+            self.connection.execute('ALTER TABLE runs ADD COLUMN owner INTEGER')
+        self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _check_not_running(self, verb, target):
+        '''
+        Returns:
+            int: The latest unfinished run of the command, or None; raises
+                an exception if another live process is running it.
+        '''
+        row = self.connection.execute(
+            '''SELECT id, status, owner FROM runs
+               WHERE verb=? AND target=? AND status!='done'
+               ORDER BY id DESC LIMIT 1''', (verb, target)).fetchone()
+        if row is None:
+            return None
+        run, status, owner = row
+        if status == 'running' and owner is not None and process_alive(owner):
+            raise WaltzException("Run {} of this command is already running "
+                                 "(process {}).".format(run, owner))
+        return run
+
+    def claim_run(self, verb, target):
+        '''
+        Takes over the latest unfinished run of the command, making its
+        unfinished tasks pending again. The run is looked up and claimed in
+        one transaction, so two processes never resume the same run.
+        Returns:
+            int: The claimed run, or None if there is no unfinished run.
+        '''
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                run = self._check_not_running(verb, target)
+                if run is not None:
+                    self.connection.execute(
+                        "UPDATE tasks SET status='pending' WHERE run=? AND status!='done'",
+                        (run,))
+                    self.connection.execute(
+                        '''UPDATE runs SET status='running', finished=NULL, owner=?
+                           WHERE id=?''', (os.getpid(), run))
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+        return run
+
+    def create_run(self, verb, target, tasks):
+        '''
+        Args:
+            tasks (list[dict]): The key, resource ID, template data file
+                (or None) and dependencies (keys) of each task.
+        Returns:
+            int: The new run.
+        '''
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                # Another process may have started the same command meanwhile
+                self._check_not_running(verb, target)
+                run = self.connection.execute(
+                    '''INSERT INTO runs (verb, target, status, created, owner)
+                       VALUES (?, ?, 'running', ?, ?)''',
+                    (verb, target, time.time(), os.getpid())).lastrowid
+                self.connection.executemany(
+                    '''INSERT INTO tasks (run, key, resource, template, depends_on,
+                                          status, attempts)
+                       VALUES (?, ?, ?, ?, ?, 'pending', 0)''',
+                    [(run, task['key'], task['resource'], task.get('template'),
+                      json.dumps(task.get('depends_on', [])))
+                     for task in tasks])
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+        return run
+
+    def finish_run(self, run, status):
+        with self.lock:
+            self.connection.execute(
+                'UPDATE runs SET status=?, finished=? WHERE id=?',
+                (status, time.time(), run))
+            self.connection.commit()
+
+    def tasks(self, run, status=None):
+        '''
+        Returns:
+            list[dict]: The tasks of the run (with the given status), in the
+                order they were queued.
+        '''
+        query = 'SELECT {} FROM tasks WHERE run=?'.format(', '.join(TASK_COLUMNS))
+        parameters = [run]
+        if status is not None:
+            query += ' AND status=?'
+            parameters.append(status)
+        with self.lock:
+            rows = self.connection.execute(query+' ORDER BY rowid',
+                                           parameters).fetchall()
+        tasks = [dict(zip(TASK_COLUMNS, row)) for row in rows]
+        for task in tasks:
+            task['depends_on'] = json.loads(task['depends_on'])
+        return tasks
+
+    def update_task(self, run, key, **fields):
+        assignments = ', '.join('{}=?'.format(field) for field in fields)
+        with self.lock:
+            self.connection.execute(
+                'UPDATE tasks SET {} WHERE run=? AND key=?'.format(assignments),
+                list(fields.values())+[run, key])
+            self.connection.commit()
+
+    def counts(self, run):
+        '''
+        Returns:
+            OrderedDict[str, int]: How many tasks of the run have each status.
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                '''SELECT status, COUNT(*) FROM tasks WHERE run=?
+                   GROUP BY status ORDER BY status''', (run,)).fetchall()
+        return OrderedDict(rows)
+
+
+def plan_pull_tasks(course, raw_ids=None):
+    '''
+    Lists (or resolves) the resources to pull, so that each can be pulled
+    by its id later.
+    '''
+    raws = raw_ids or [category+"/*" for category in sorted(RESOURCE_TYPES)]
+    resources = []
+    for raw in raws:
+        category, command, name, resource_type = ResourceID._parse_type(raw)
+        if command == '*':
+            resources.extend("{}/:{}".format(resource_type.canonical_category,
+                                             resource_type.identify_id(data))
+                             for data in resource_type.iter_resources_on_canvas(course))
+    singles = [raw for raw in raws if not raw.endswith('/*')]
+    if singles:
+        resources.extend("{}/:{}".format(resource_id.resource_type.canonical_category,
+                                         resource_id.canvas_id)
+                         for resource_id in ResourceID.resolve_all(course, singles))
+    return [{'key': resource, 'resource': resource}
+            for resource in OrderedDict.fromkeys(resources)]
+
+
+def plan_push_tasks(course, raw_ids=None):
+    '''
+    Finds the local resources to push. Local files are matched to Canvas by
+    their exact title when the tasks run, so that resources created by an
+    interrupted run are not created again.
+    '''
+    from waltz.plans import local_resource_ids
+    if not raw_ids:
+        return [{'key': raw, 'resource': raw, 'template': template,
+                 'depends_on': depends_on}
+                for raw, template, depends_on in course_push_tasks(course)]
+    resources, searches = [], []
+    for raw in raw_ids:
+        if raw.endswith('/*'):
+            resources.extend(local_resource_ids(course, raw))
+        elif ResourceID._parse_type(raw)[1] == '?':
+            searches.append(raw)
+        else:
+            resources.append(raw)
+    if searches:
+        resources.extend("{}/:{}".format(resource_id.resource_type.canonical_category,
+                                         resource_id.canvas_id)
+                         for resource_id in ResourceID.resolve_all(course, searches))
+    return [{'key': resource, 'resource': resource}
+            for resource in OrderedDict.fromkeys(resources)]
+
+
+def resolve_tasks(course, tasks):
+    '''
+    Resolves the resource IDs of the tasks with one listing per category:
+    ":id" IDs by their id and "?title" IDs by their exact title (a title
+    that is not on Canvas is a new resource). Anything else, or an id that
+    is not listed, is resolved when its task runs.
+    Returns:
+        dict[str, ResourceID]: The resource ID of each task, by its key.
+    '''
+    listings = {}
+    resolved = {}
+    for task in tasks:
+        raw = task['resource']
+        category, command, name, resource_type = ResourceID._parse_type(raw)
+        if command not in (':', '?'):
+            resolved[task['key']] = ResourceID(course, raw)
+            continue
+        if resource_type not in listings:
+            listing = list(resource_type.iter_resources_on_canvas(course))
+            listings[resource_type] = (
+                {str(resource_type.identify_id(data)): data for data in listing},
+                {make_safe_filename(resource_type.identify_title(data)): data
+                 for data in listing})
+        by_id, by_title = listings[resource_type]
+        if command == '?':
+            resolved[task['key']] = ResourceID.from_canvas_data(
+                course, raw, by_title.get(name))
+        elif name in by_id:
+            resolved[task['key']] = ResourceID.from_canvas_data(
+                course, raw, by_id[name])
+        else:
+            resolved[task['key']] = ResourceID(course, raw)
+    ResourceID.find_all_on_disk(course, [resource_id for resource_id in resolved.values()
+                                         if resource_id._canvas_data is not None])
+    return resolved
+
+
+def pull_task(course, resource_id):
+    '''
+    Downloads a resource, then converts and stores it. Conversions happen
+    one at a time, since they are not thread-safe.
+    '''
+    from waltz.sync import pull_resource
+    resource_json = resource_id.canvas_data
+    print(resource_id.canvas_title)
+    if resource_id.resource_type is File:
+        # Files are only streamed to disk, without any conversion
+        pull_files(course, [resource_id])
+    elif resource_id.resource_type is Quiz:
+        questions, groups = Quiz.fetch_parts(course, resource_json)
+        with course.load_lock:
+            quiz = Quiz.from_parts(course, resource_json, questions, groups)
+            course.to_disk(resource_id, quiz)
+            if course.snapshot is None:
+                course.record_canvas_state(resource_id)
+    else:
+        with course.load_lock:
+            pull_resource(resource_id, 'raw', course.root_directory, course, True)
+
+
+def is_transient(error):
+    '''Whether an error may go away on its own, so that retrying can help.'''
+    import requests
+    return isinstance(error, (CanvasUnavailable, requests.ConnectionError,
+                              requests.Timeout))
+
+
+def attempt_task(queue, run, task, action, attempts, backoff):
+    '''
+    Runs the task's action, retrying it with exponential backoff when it
+    fails for a transient reason (see is_transient).
+    '''
+    for attempt in range(1, attempts+1):
+        started = time.time()
+        queue.update_task(run, task['key'], status='running', started=started,
+                          attempts=task['attempts']+attempt)
+        try:
+            action()
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+            finished = time.time()
+            queue.update_task(run, task['key'], status='failed', finished=finished,
+                              seconds=finished-started, error=error)
+            if attempt == attempts or not is_transient(e):
+                raise
+            delay = backoff * 2 ** (attempt-1)
+            log("Retrying", task['key'], "in", delay, "seconds after", error)
+            time.sleep(delay)
+        else:
+            finished = time.time()
+            queue.update_task(run, task['key'], status='done', finished=finished,
+                              seconds=finished-started, error=None)
+            return
+
+
+def run_queued(course, verb, raw_ids=None, jobs=None):
+    '''
+    Pulls or pushes resources through the task queue, resuming the last
+    unfinished run of the same command if there is one.
+    Returns:
+        int: How many tasks were run (not counting any finished earlier).
+    '''
+    queue = TaskQueue(tasks_path(course.root_directory))
+    try:
+        target = " ".join(raw_ids) if raw_ids else "*"
+        run = queue.claim_run(verb, target)
+        if run is None:
+            planned = (plan_pull_tasks if verb == 'pull' else plan_push_tasks)(course, raw_ids)
+            run = queue.create_run(verb, target, planned)
+            log("Queued", len(planned), verb, "tasks as run", run)
+        else:
+            counts = queue.counts(run)
+            log("Resuming run", run, "with", counts.get('pending', 0), "of",
+                sum(counts.values()), "tasks left")
+        pending = queue.tasks(run, 'pending')
+        resolved = resolve_tasks(course, pending)
+        if jobs is None:
+            jobs = get_setting('task-workers', course=course.course_name,
+                               default=DEFAULT_WORKERS)
+        attempts = get_setting('task-attempts', course=course.course_name,
+                               default=DEFAULT_ATTEMPTS)
+        backoff = get_setting('task-backoff', course=course.course_name,
+                              default=DEFAULT_BACKOFF)
+        scheduler = DependencyScheduler(jobs)
+        for task in pending:
+            resource_id = resolved[task['key']]
+            if verb == 'pull':
+                action = partial(pull_task, course, resource_id)
+            else:
+                action = partial(push_built_resource, course, resource_id,
+                                 task['template'])
+            scheduler.add(task['key'], partial(attempt_task, queue, run, task, action,
+                                               attempts, backoff),
+                          task['depends_on'])
+        try:
+            if verb == 'pull':
+                with course.write_behind():
+                    scheduler.run()
+            else:
+                scheduler.run()
+        except BaseException:
+            queue.finish_run(run, 'interrupted')
+            raise
+        for key, failed in scheduler.skipped.items():
+            queue.update_task(run, key, status='skipped',
+                              error="Skipped, since {} failed".format(failed))
+        queue.finish_run(run, 'failed' if scheduler.failed else 'done')
+        if scheduler.failed:
+            raise WaltzException("Run {} finished {} tasks, but {} failed and {} were "
+                                 "skipped:\n{}\nRun the same command again to retry "
+                                 "only these.".format(
+                                     run, len(scheduler.finished), len(scheduler.failed),
+                                     len(scheduler.skipped),
+                                     indent4(scheduler.describe_problems())))
+        log("Finished run", run, "with", len(scheduler.finished), "tasks.")
+        return len(scheduler.finished)
+    finally:
+        queue.close()
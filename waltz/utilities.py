@@ -1,7 +1,6 @@
 import os
 import re
 from datetime import datetime
-from dateutil import tz, parser
 from textwrap import indent
 import pathlib
 
@@ -36,11 +35,11 @@ def log(*args):
         print(*args)
 
 FRIENDLY_DATE_FORMAT = "%B %d %Y, %I%M %p"
-from_zone = tz.tzutc()
-to_zone = tz.tzlocal()
 def to_friendly_date(canvas_date_string):
     if not canvas_date_string:
         return ''
+    from dateutil import tz
+    from_zone, to_zone = tz.tzutc(), tz.tzlocal()
     return (from_canvas_date(canvas_date_string)
                       .replace(tzinfo=from_zone)
                       .astimezone(to_zone)
@@ -50,6 +49,8 @@ def to_friendly_date(canvas_date_string):
 def from_friendly_date(friendly_date_string):
     if not friendly_date_string:
         return ''
+    from dateutil import tz, parser
+    from_zone, to_zone = tz.tzutc(), tz.tzlocal()
     return to_canvas_date(parser.parse(friendly_date_string)
                                 .replace(tzinfo=to_zone)
                                 .astimezone(from_zone))
@@ -0,0 +1,222 @@
+'''
+Watches a course directory and pushes resources as their files are saved.
+
+Changes are detected with inotify when the optional `inotify_simple` package
+is installed (on Linux), and by polling modification times otherwise. Bursts
+of saves are coalesced over a debounce window, mapped back to resources by
+their category folder, and pushed from one long-lived process, so the Course
+object, its caches and the HTTP session all stay warm between pushes.
+'''
+import os
+import time
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from waltz.utilities import log, make_safe_filename, indent4
+
+IGNORED_PREFIXES = ('_', '.')
+
+
+class PollingBackend:
+    '''Finds changes by comparing modification times between scans.'''
+    def __init__(self, root, interval=0.5):
+        self.root = root
+        self.interval = interval
+        self.known = self.scan()
+
+    def scan(self):
+        found = {}
+        for directory, subdirectories, filenames in os.walk(self.root):
+            subdirectories[:] = [d for d in subdirectories
+                                 if not d.startswith(IGNORED_PREFIXES)]
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    found[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+        return found
+
+    def read(self, timeout):
+        '''
+        Returns:
+            set[str]: The paths that changed, waiting at most `timeout` seconds.
+        '''
+        deadline = time.time() + timeout
+        while True:
+            current = self.scan()
+            changed = {path for path, mtime in current.items()
+                       if self.known.get(path) != mtime}
+            self.known = current
+            if changed or time.time() >= deadline:
+                return changed
+            time.sleep(min(self.interval, max(0, deadline - time.time())))
+
+    def close(self):
+        pass
+
+
+class InotifyBackend:
+    '''Uses inotify watches on every directory under the root.'''
+    def __init__(self, root):
+        self.root = root
+        self.inotify = INotify()
+        self.mask = (flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE |
+                     flags.DELETE_SELF)
+        self.directories = {}
+        for directory, subdirectories, _ in os.walk(root):
+            subdirectories[:] = [d for d in subdirectories
+                                 if not d.startswith(IGNORED_PREFIXES)]
+            self.add_watch(directory)
+
+    def add_watch(self, directory):
+        descriptor = self.inotify.add_watch(directory, self.mask)
+        self.directories[descriptor] = directory
+
+    def read(self, timeout):
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout*1000)):
+            directory = self.directories.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+            if event.mask & flags.ISDIR:
+                if (event.mask & flags.CREATE and
+                        not event.name.startswith(IGNORED_PREFIXES)):
+                    self.add_watch(path)
+            elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+
+def make_backend(root, force_polling=False):
+    if INotify is not None and not force_polling:
+        try:
+            return InotifyBackend(root)
+        except OSError as e:
+            log("Could not use inotify, falling back to polling:", e)
+    return PollingBackend(root)
+
+
+def debounced_batches(backend, debounce=1.0, timeout=None):
+    '''
+    Yields sets of changed paths. A batch is only released once no new
+    change has arrived for `debounce` seconds. If `timeout` is given, the
+    generator stops after that many seconds without any change.
+    '''
+    while True:
+        batch = backend.read(timeout if timeout is not None else 3600)
+        if not batch:
+            if timeout is not None:
+                return
+            continue
+        while True:
+            more = backend.read(debounce)
+            if not more:
+                break
+            batch |= more
+        yield batch
+
+
+def resource_for_path(root, path):
+    '''
+    Maps a changed file back to the resource it describes.
+    Returns:
+        (str, object) or None: The verb needed and its target: 'push' with
+            the category and filename of the resource (see
+            resource_id_for_file), or 'build' with the template path. None
+            if the file is not a resource.
+    '''
+    from waltz.resources import RESOURCE_TYPES, Page
+    relative = os.path.relpath(path, root)
+    parts = relative.split(os.sep)
+    if len(parts) < 2 or parts[0].startswith(IGNORED_PREFIXES):
+        return None
+    if any(part.startswith(IGNORED_PREFIXES) for part in parts[1:]):
+        return None
+    category, filename = parts[0], parts[-1]
+    resource_type = RESOURCE_TYPES.get(category)
+    if resource_type is None or filename.endswith('.public.yaml'):
+        return None
+    if filename.endswith(resource_type.extension):
+        return 'push', (category, filename)
+    # Template data for pages gets rebuilt, which in turn triggers a push
+    if resource_type is Page and filename.endswith('.yaml'):
+        return 'build', filename
+    return None
+
+
+def resource_id_for_file(course, resource_type, filename):
+    '''
+    Works out which resource a file belongs to without searching Canvas by
+    title, since a title search also matches every title containing it:
+    first from the Canvas state recorded when the file was last pulled or
+    pushed, then from the indexed (or else listed) resource whose title
+    makes exactly this filename. A file that matches nothing is new.
+    Returns:
+        str: The resource ID to push, by id (or with + if it is new).
+    '''
+    from waltz.resources import WaltzException
+    category = resource_type.canonical_category
+    state = course.load_canvas_state(resource_type, filename)
+    if state is not None:
+        return "{}/:{}".format(category, resource_type.identify_id(state))
+
+    def named_by_file(listing):
+        return [data for data in listing
+                if make_safe_filename(resource_type.identify_title(data)) +
+                resource_type.extension == filename]
+    found = named_by_file(course.index.listing(resource_type))
+    if not found:
+        found = named_by_file(resource_type.iter_resources_on_canvas(course))
+    if len(found) > 1:
+        raise WaltzException("Several {} resources are saved as {}:\n{}".format(
+            resource_type.canvas_name, filename,
+            indent4("\n".join(resource_type.get_names_from_json(found)))))
+    if found:
+        return "{}/:{}".format(category, resource_type.identify_id(found[0]))
+    return "{}/+{}".format(category, filename[:len(filename)-len(resource_type.extension)])
+
+
+def watch_course(course, debounce=1.0, force_polling=False, timeout=None):
+    '''
+    Pushes every resource whose file changes under the course's root
+    directory, until interrupted (or until `timeout` idle seconds pass).
+    Returns:
+        int: How many resources were pushed.
+    '''
+    from waltz.resources import RESOURCE_TYPES
+    from waltz.sync import push_resource, build_from_template
+    root = course.root_directory
+    backend = make_backend(root, force_polling)
+    log("Watching", root, "with", type(backend).__name__)
+    pushed = 0
+    try:
+        for batch in debounced_batches(backend, debounce, timeout):
+            actions = {resource_for_path(root, path) for path in batch}
+            actions.discard(None)
+            for verb, target in sorted(actions):
+                try:
+                    if verb == 'build':
+                        log("Building", target)
+                        build_from_template(target, root, course, False)
+                    else:
+                        category, filename = target
+                        target = resource_id_for_file(
+                            course, RESOURCE_TYPES[category], filename)
+                        log("Pushing", target)
+                        push_resource(target, 'raw', root, course, False)
+                        pushed += 1
+                except Exception as e:
+                    print("Failed to {} {}: {}".format(verb, target, e))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        backend.close()
+    return pushed
@@ -0,0 +1,131 @@
+'''
+Atomic, write-behind file output.
+
+Files are written to a temporary file in the same directory and renamed
+into place, so a crash never leaves a half-written resource behind. The
+new file keeps the old one's permissions (or gets the usual ones for the
+umask). Writes whose bytes match what is already on disk are skipped. A DiskWriter does
+this on a background thread: the conversion stage queues finished outputs
+and carries on fetching from Canvas, while the writer drains the queue in
+batches.
+'''
+import os
+import gzip
+import queue
+import tempfile
+import threading
+
+from waltz.utilities import ensure_dir, log, make_datetime_filename
+
+# The umask can only be read by setting it, which is not safe once other
+# threads might be creating files, so it is read once on import
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def write_atomically(path, data, backup_directory=None, durable=False):
+    '''
+    Args:
+        data (bytes): The new contents.
+        backup_directory (str): If given, any different old contents are
+            gzipped into this directory before being replaced.
+        durable (bool): Whether to fsync the new contents before renaming
+            (see the "durable-writes" setting).
+    Returns:
+        bool: Whether the file was written (False if it was unchanged).
+    '''
+    # mkstemp only gives the owner access, unlike an ordinary new file
+    mode = 0o666 & ~UMASK
+    if os.path.exists(path):
+        mode = os.stat(path).st_mode & 0o7777
+        with open(path, 'rb') as original_file:
+            contents = original_file.read()
+        if contents == data:
+            return False
+        if backup_directory is not None:
+            extension = os.path.splitext(path)[1]
+            backup_path = os.path.join(backup_directory,
+                                       make_datetime_filename()+extension+'.gz')
+            ensure_dir(backup_path)
+            with gzip.open(backup_path, 'wb') as out:
+                out.write(contents)
+            log("Backed up file: ", path)
+    ensure_dir(path)
+    directory, filename = os.path.split(path)
+    descriptor, temporary = tempfile.mkstemp(dir=directory or '.',
+                                             prefix='.'+filename+'.',
+                                             suffix='.tmp')
+    try:
+        os.chmod(temporary, mode)
+        with os.fdopen(descriptor, 'wb') as out:
+            out.write(data)
+            if durable:
+                out.flush()
+                os.fsync(out.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return True
+
+
+class DiskWriter:
+    '''
+    Writes files on a background thread. Errors are kept and raised by the
+    next call to flush (or close).
+
+    Args:
+        batch_size (int): The most files written between checks of the queue.
+        max_pending (int): How many files may wait in the queue before
+            `write` blocks, which bounds the memory held by pending writes.
+    '''
+    def __init__(self, batch_size=32, max_pending=256, durable=False):
+        self.batch_size = batch_size
+        self.durable = durable
+        self.pending = queue.Queue(max_pending)
+        self.errors = []
+        self.written = 0
+        self.skipped = 0
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def write(self, path, data, backup_directory=None):
+        self.pending.put((path, data, backup_directory))
+
+    def _work(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                try:
+                    if write_atomically(*item, durable=self.durable):
+                        self.written += 1
+                    else:
+                        self.skipped += 1
+                except Exception as e:
+                    self.errors.append(e)
+            for _ in batch:
+                self.pending.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        '''Waits for every queued write to finish.'''
+        self.pending.join()
+        if self.errors:
+            error, self.errors = self.errors[0], []
+            raise error
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.flush()